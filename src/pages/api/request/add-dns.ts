@@ -1,5 +1,6 @@
 import { NextApiRequest, NextApiResponse } from 'next';
 import { PrismaClient } from '@prisma/client';
+import { prewarmForms } from '@/utils/prewarmForms';
 
 const prisma = new PrismaClient();
 
@@ -177,6 +178,8 @@ export default async function addDns(req: NextApiRequest, res: NextApiResponse)
       }
     }
 
+    prewarmForms(request);
+
     res.status(201).json({ success: true, msg: 'DNS records added successfully', data: {} });
   } catch (error) {
     if (error instanceof Error) {
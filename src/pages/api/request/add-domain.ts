@@ -1,5 +1,6 @@
 import { NextApiRequest, NextApiResponse } from 'next';
 import { PrismaClient, domain as DomainType } from '@prisma/client';
+import { prewarmForms } from '@/utils/prewarmForms';
 
 const prisma = new PrismaClient();
 
@@ -86,6 +87,7 @@ export default async function addDomain(req: NextApiRequest, res: NextApiRespons
     });
 
     const fullDomainName = await getFullDomainName(topLevelDomainId);
+    prewarmForms(request);
 
     res.status(201).json({
       success: true,
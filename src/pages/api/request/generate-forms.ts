@@ -4,6 +4,7 @@ import Cors from 'cors';
 import { exec } from 'child_process';
 import { promisify } from 'util';
 import path from 'path';
+import { coverLetterDate } from '@/utils/coverLetterDate';
 
 const prisma = new PrismaClient();
 const execPromise = promisify(exec);
@@ -60,6 +61,7 @@ export default async function generateForms(req: NextApiRequest, res: NextApiRes
         contact_no: true,
         request_form_path: true,
         cover_letter_path: true,
+        cover_letter_date: true,
       }
     });
 
@@ -67,20 +69,16 @@ export default async function generateForms(req: NextApiRequest, res: NextApiRes
       return res.status(404).json({ success: false, msg: 'request_not_found', data: {} });
     }
 
-    // Check if the forms are already generated
-    if (request.request_form_path && request.cover_letter_path) {
-      return res.status(200).json({
-        success: true,
-        msg: 'forms_already_generated',
-        data: {
-          request_form_path: request.request_form_path,
-          cover_letter_path: request.cover_letter_path
-        }
-      });
-    }
+    // Forms generated before are not returned as they are: the request may have been edited
+    // since. The generator's render cache reuses them when nothing they show has changed.
+    // The cover letter keeps the date it was first issued with.
+    const letterDate = coverLetterDate(request);
 
-    const scriptPath = path.join(process.cwd(), 'src', 'utils', 'generate_domain_request_forms.py');
-    const command = `python3 "${scriptPath}" -t ${requestToken}`;
+    // A prebuilt zipapp (python3 src/utils/build_form_generator.py) starts faster than the script
+    const scriptPath = process.env.FORM_GENERATOR_PYZ
+      ? path.resolve(process.cwd(), process.env.FORM_GENERATOR_PYZ)
+      : path.join(process.cwd(), 'src', 'utils', 'generate_domain_request_forms.py');
+    const command = `python3 "${scriptPath}" -t ${requestToken} --date ${letterDate}`;
     
 
 
@@ -110,6 +108,7 @@ export default async function generateForms(req: NextApiRequest, res: NextApiRes
       data: {
         request_form_path: requestFormPath,
         cover_letter_path: coverLetterPath,
+        cover_letter_date: new Date(`${letterDate}T00:00:00Z`),
       },
     });
 
@@ -1,5 +1,6 @@
 import { NextApiRequest, NextApiResponse } from 'next';
 import { PrismaClient } from '@prisma/client';
+import { prewarmForms } from '@/utils/prewarmForms';
 
 const prisma = new PrismaClient();
 
@@ -27,6 +28,11 @@ export default async function removeDomain(req: NextApiRequest, res: NextApiResp
       where: { id: requestDomainId },
     });
 
+    const request = await prisma.request.findUnique({ where: { id: existingRequestDomain.request_id } });
+    if (request) {
+      prewarmForms(request);
+    }
+
     res.status(200).json({ success: true, msg: 'Domain removed successfully', data: {} });
   } catch (error) {
     if (error instanceof Error) {
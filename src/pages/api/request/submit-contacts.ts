@@ -1,5 +1,6 @@
 import { NextApiRequest, NextApiResponse } from 'next';
 import { PrismaClient } from '@prisma/client';
+import { prewarmForms } from '@/utils/prewarmForms';
 
 const prisma = new PrismaClient();
 
@@ -59,7 +60,7 @@ export default async function submitContacts(req: NextApiRequest, res: NextApiRe
     }
 
     // Update the request with provided user IDs, hosting place, address, email, and contact number
-    await prisma.request.update({
+    const updated = await prisma.request.update({
       where: { id: request.id },
       data: {
         owner_user_id: owner_user_id ? parseInt(owner_user_id) : request.owner_user_id,
@@ -74,6 +75,8 @@ export default async function submitContacts(req: NextApiRequest, res: NextApiRe
       },
     });
 
+    prewarmForms(updated);
+
     res.status(200).json({ success: true, msg: 'Request updated successfully' });
   } catch (error) {
     if (error instanceof Error) {
@@ -0,0 +1,396 @@
+import argparse
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import form_converter
+import form_optimize
+import form_pdf
+import form_source
+import generate_domain_request_forms as forms
+
+# Benchmarks the form generator in-process on synthetic get-summary payloads,
+# without Next.js, Postgres or (with the stub converter) LibreOffice:
+#
+#   python3 src/utils/benchmark_forms.py --output bench.json
+#   python3 src/utils/benchmark_forms.py --output new.json --compare bench.json
+#   python3 src/utils/benchmark_forms.py --source sqlite   # fetch from a SQLite copy of the tables
+
+STAGES = ['fetch', 'request_form_build', 'cover_letter_build', 'docx_save', 'request_form_stream', 'template_docx',
+          'pdf_conversion', 'native_pdf']
+
+# Sizes that come from the converter, meaningless with the stub
+CONVERTED_OUTPUTS = ('request_form_pdf', 'cover_letter_pdf')
+
+RECORD_TYPES = ['A', 'AAAA', 'CNAME', 'TXT', 'MX', 'SOA', 'SRV', 'CCA']
+
+# name -> (domains, records per domain, record types, long text)
+SCENARIOS = {
+    'minimal': (1, 2, ['A', 'MX'], False),
+    'typical': (3, 8, ['A', 'AAAA', 'CNAME', 'TXT', 'MX'], False),
+    'all-types': (2, 16, RECORD_TYPES, False),
+    'long-text': (5, 10, ['TXT', 'CNAME', 'CCA'], True),
+    'domains-100': (100, 5, RECORD_TYPES, False),
+    'records-1000': (1, 1000, RECORD_TYPES, False),
+}
+DEFAULT_SCENARIOS = ['minimal', 'typical', 'all-types', 'long-text', 'domains-100']
+
+
+def long_text(rng, words):
+    vocabulary = ['ministry', 'department', 'provincial', 'council', 'services', 'portal', 'citizen', 'public',
+                  'information', 'division', 'secretariat', 'registration', 'online', 'development', 'authority']
+    return ' '.join(rng.choice(vocabulary) for _ in range(words))
+
+
+def synthetic_record(rng, record_type, index, long):
+    ttl = rng.choice([300, 3600, 86400])
+    if record_type == 'A':
+        record = {'ttl': ttl, 'value': f'203.94.{rng.randint(0, 255)}.{rng.randint(1, 254)}'}
+    elif record_type == 'AAAA':
+        record = {'ttl': ttl, 'value': f'2001:db8:{index:x}::{rng.randint(1, 0xffff):x}'}
+    elif record_type == 'CNAME':
+        record = {'ttl': ttl, 'value': f'host{index}.' + ('cdn.' * (8 if long else 1)) + 'gov.lk'}
+    elif record_type == 'TXT':
+        value = f'v=spf1 ip4:203.94.{index % 256}.0/24 include:_spf.gov.lk -all'
+        if long:
+            value = 'google-site-verification=' + ''.join(rng.choice('abcdef0123456789') for _ in range(200))
+        record = {'ttl': ttl, 'value': value}
+    elif record_type == 'MX':
+        record = {'ttl': ttl, 'value': f'mx{index}.gov.lk', 'priority': 10 * (index % 5 + 1)}
+    elif record_type == 'SOA':
+        record = {'ttl': ttl, 'm_name': 'ns1.gov.lk', 'r_name': 'hostmaster.gov.lk', 'serial': 2024010100 + index,
+                  'refresh': 7200, 'retry': 3600, 'expire': 1209600, 'min_ttl': 300}
+    elif record_type == 'SRV':
+        record = {'service': '_sip._tcp', 'ttl': ttl, 'weight': rng.randint(0, 100), 'port': 5060,
+                  'target': f'sip{index}.gov.lk'}
+    else:
+        record = {'ttl': ttl, 'flag': 0, 'tag': rng.choice(['issue', 'issuewild', 'iodef']),
+                  'value': 'letsencrypt.org' if not long else 'mailto:' + long_text(rng, 12).replace(' ', '.') + '@gov.lk'}
+    # Same shape as get-summary: ids first, then the type, then the type's columns
+    return {'dns_record_id': index + 1, 'type_record_id': index + 1, 'type': record_type, 'id': index + 1, **record}
+
+
+def synthetic_user(rng, role, index, long):
+    name = f'{role.title()} Person {index}'
+    if long:
+        name += ' ' + long_text(rng, 4).title()
+    return {
+        'id': index,
+        'full_name': name,
+        'nic': f'{rng.randint(10 ** 11, 10 ** 12 - 1)}',
+        'mobile': f'07{rng.randint(10 ** 7, 10 ** 8 - 1)}',
+        'email': f'{role}{index}@example.gov.lk',
+        'designation': long_text(rng, 6).title() if long else 'Director',
+    }
+
+
+def synthetic_summary(domains, records, record_types, long=False, seed=0):
+    rng = random.Random(seed)
+    summary = {
+        'request_id': 1000 + seed,
+        'request_token': f'BENCH{seed:06d}',
+        'site_code': 'BENCH01',
+        'organization_name': 'Benchmark ' + (long_text(rng, 10).title() if long else 'Organization'),
+        'request_reason': 'Benchmark',
+        'address': long_text(rng, 40).title() if long else 'No. 1, Main Street, Colombo 01',
+        'email': 'info@example.gov.lk',
+        'contact_no': 112000000 + seed,
+        'organization_head': synthetic_user(rng, 'head', 1, long),
+        'administrator': synthetic_user(rng, 'admin', 2, long),
+        'technical_contact': synthetic_user(rng, 'tech', 3, long),
+        'content_developer': synthetic_user(rng, 'content', 4, long),
+        'hosting_coordinator': synthetic_user(rng, 'hosting', 5, long),
+        'hosting_provider': 'Lanka Government Cloud',
+        'requested_domains': [],
+    }
+    for d in range(domains):
+        summary['requested_domains'].append({
+            'domain_id': d + 1,
+            'request_domain_id': d + 1,
+            'fqdn': f'site{d}.benchmark.gov.lk' if d else 'benchmark.gov.lk',
+            'dns_records': [synthetic_record(rng, record_types[r % len(record_types)], d * records + r, long)
+                            for r in range(records)],
+            'reason': long_text(rng, 60) if long else 'Official website',
+            'include_www': False,
+        })
+    return summary
+
+
+class StubConverter:
+    # Stands in for LibreOffice, so the other stages can be measured on machines
+    # without an office suite. It writes a one-page PDF naming the document:
+    # publishing pins its metadata and optimizes it like a real export.
+
+    def convert_many(self, pairs):
+        for docx_path, pdf_path in pairs:
+            document = form_pdf.PdfDocument(os.path.basename(docx_path))
+            document.add_section([form_pdf.Paragraph([(os.path.basename(docx_path), False)])])
+            document.save(pdf_path)
+
+    def close(self):
+        pass
+
+
+def make_converter(name, workers):
+    if name == 'stub':
+        return StubConverter()
+    if name == 'pool':
+        return form_converter.ConverterPool(workers)
+    # oneshot: None makes the generator cold-start LibreOffice per request
+    return None
+
+
+class _SummaryHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = json.dumps({'success': True, 'msg': 'summary_retrieved_successfully',
+                           'data': self.server.summary}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def summary_server(summary):
+    # A local stand-in for get-summary so the fetch stage includes HTTP and JSON decoding
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _SummaryHandler)
+    server.summary = summary
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summary_fixture(summary, workdir):
+    # The payload stored in the get-summary tables of a SQLite database, read
+    # back by form_source.SqlSource (the organization name is not in the database)
+    path = os.path.join(workdir, 'summary.sqlite3')
+    db = sqlite3.connect(path)
+    try:
+        form_source.insert_summary(db, summary['request_token'], summary)
+    finally:
+        db.close()
+    return form_source.SqlSource(lambda: sqlite3.connect(path),
+                                 organization_names={summary['site_code']: summary['organization_name']})
+
+
+def run_pipeline(summary, fetch, workdir, converter, timer):
+    # One generator run, stage by stage; timer(stage, fn) runs and measures fn
+    token = summary['request_token']
+    fetched = timer('fetch', lambda: fetch(token))
+    form = timer('request_form_build', lambda: forms.build_request_form(fetched, token))
+    letter = timer('cover_letter_build', lambda: forms.build_cover_letter(fetched, token, '2024-01-01'))
+
+    # The Word documents go to a scratch directory that convert_documents removes
+    scratch = tempfile.mkdtemp(dir=workdir)
+    form_base = os.path.join(workdir, 'Request_Form')
+    letter_base = os.path.join(workdir, 'Cover_Letter')
+    form_docx = os.path.join(scratch, 'Request_Form.docx')
+    letter_docx = os.path.join(scratch, 'Cover_Letter.docx')
+
+    def save():
+        return {'request_form_docx': forms.save_docx(form, form_docx, 'request form'),
+                'cover_letter_docx': forms.save_docx(letter, letter_docx, 'cover letter')}
+
+    sizes = timer('docx_save', save)
+    # The streamed writer used for large requests, built and written in one go
+    streamed_docx = os.path.join(scratch, 'Request_Form_streamed.docx')
+    timer('request_form_stream', lambda: forms.save_docx(
+        forms.stream_request_form(fetched, token, letter_date='2024-01-01'), streamed_docx, 'request form'))
+
+    # Both documents filled into the precompiled templates and written, as the
+    # generator does by default. The templates are compiled once per process,
+    # outside the timer, so the stage measures the fills only.
+    templates = {kind: forms.form_template(kind) for kind in ('request_form', 'cover_letter')}
+
+    def templated():
+        return [forms.save_docx(template.document(fetched, token, '2024-01-01'),
+                                os.path.join(scratch, f'{kind}_template.docx'), kind)
+                for kind, template in templates.items()]
+
+    timer('template_docx', templated)
+    pending = [(form_docx, form_base + '.pdf', 'request form'),
+               (letter_docx, letter_base + '.pdf', 'cover letter')]
+    timer('pdf_conversion', lambda: forms.convert_documents(pending, converter))
+    sizes['request_form_pdf'] = os.path.getsize(form_base + '.pdf')
+    sizes['cover_letter_pdf'] = os.path.getsize(letter_base + '.pdf')
+
+    def native():
+        return [forms.build_pdf_document(fetched, token, '2024-01-01', (part,)).to_bytes()
+                for part in ('request_form', 'cover_letter')]
+
+    native_form, native_letter = timer('native_pdf', native)
+    sizes['native_request_form_pdf'] = len(native_form)
+    sizes['native_cover_letter_pdf'] = len(native_letter)
+    return sizes
+
+
+def benchmark(summary, repeat, converter, source='api'):
+    samples = {stage: {'wall': [], 'cpu': []} for stage in STAGES}
+    peaks = {}
+    workdir = tempfile.mkdtemp(prefix='form-bench-')
+    server = data_source = None
+    if source == 'sqlite':
+        data_source = summary_fixture(summary, workdir)
+        fetch = data_source.summary
+    else:
+        server = summary_server(summary)
+        host = f'http://127.0.0.1:{server.server_address[1]}'
+
+        def fetch(token):
+            return forms.fetch_summary(token, host)
+
+    def timed(stage, fn):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn()
+        samples[stage]['wall'].append(time.perf_counter() - wall)
+        samples[stage]['cpu'].append(time.process_time() - cpu)
+        return result
+
+    def traced(stage, fn):
+        # Separate run: tracemalloc slows allocation-heavy code, so it never overlaps the timed runs
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - start
+        return result
+
+    try:
+        # Warm-up run: template loading and imports are not part of any stage
+        forms.new_document()
+        for _ in range(repeat):
+            sizes = run_pipeline(summary, fetch, workdir, converter, timed)
+        tracemalloc.start()
+        try:
+            run_pipeline(summary, fetch, workdir, converter, traced)
+        finally:
+            tracemalloc.stop()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {}
+    for stage in STAGES:
+        wall, cpu = samples[stage]['wall'], samples[stage]['cpu']
+        stages[stage] = {
+            'wall_s': statistics.median(wall),
+            'wall_min_s': min(wall),
+            'cpu_s': statistics.median(cpu),
+            'peak_alloc_bytes': peaks.get(stage),
+        }
+    result = {'stages': stages, 'sizes': sizes}
+    if data_source is not None:
+        # The same for every scenario: the queries do not depend on the number of domains or records
+        result['queries_per_fetch'] = data_source.queries // (repeat + 1)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    # Per-stage median wall time ratio and per-output size ratio against a
+    # previous results file (> 1 is slower or larger). Converted PDF sizes are
+    # only compared when both runs used LibreOffice (--converter oneshot or pool).
+    converted = results['converter'] != 'stub' and baseline.get('converter') == results['converter']
+    lines = []
+    for name, scenario in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        for stage, metrics in scenario['stages'].items():
+            old = before['stages'].get(stage, {}).get('wall_s')
+            if old:
+                lines.append(f"{name:14} {stage:20} {old:9.4f}s -> {metrics['wall_s']:9.4f}s  x{metrics['wall_s'] / old:.2f}")
+        for output, size in scenario['sizes'].items():
+            old = before.get('sizes', {}).get(output)
+            if output in CONVERTED_OUTPUTS and not converted:
+                continue
+            if old:
+                lines.append(f"{name:14} {output:20} {old:9d} B -> {size:9d} B  x{size / old:.2f}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the domain request form generator on synthetic requests.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help=f'Scenario to run (repeatable, default: {", ".join(DEFAULT_SCENARIOS)})')
+    parser.add_argument('--domains', type=int, help='Run a custom scenario with this many domains')
+    parser.add_argument('--records', type=int, default=8, help='DNS records per domain for the custom scenario')
+    parser.add_argument('--long-text', action='store_true', help='Use long addresses and reasons in the custom scenario')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per scenario (median is reported)')
+    parser.add_argument('--converter', choices=['stub', 'oneshot', 'pool'], default='stub',
+                        help='PDF conversion: stub writes a placeholder PDF, oneshot and pool use LibreOffice')
+    parser.add_argument('--workers', type=int, default=1, help='LibreOffice instances for --converter pool')
+    parser.add_argument('--source', choices=['api', 'sqlite'], default='api',
+                        help='Fetch summaries from a local get-summary stand-in (api) or a SQLite copy of the tables')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic payloads')
+    parser.add_argument('--output', help='Write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='Print wall time ratios against a previous results file')
+    args = parser.parse_args()
+
+    scenarios = {name: SCENARIOS[name] for name in (args.scenario or ([] if args.domains else DEFAULT_SCENARIOS))}
+    if args.domains:
+        scenarios[f'custom-{args.domains}x{args.records}'] = (args.domains, args.records, RECORD_TYPES, args.long_text)
+
+    converter = make_converter(args.converter, args.workers)
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'converter': args.converter,
+        # The converted PDFs are optimized by this, when it is installed
+        'pdf_optimizer': form_optimize.version(),
+        'source': args.source,
+        'repeat': args.repeat,
+        'scenarios': {},
+    }
+    try:
+        for name, (domains, records, record_types, long) in scenarios.items():
+            summary = synthetic_summary(domains, records, record_types, long, args.seed)
+            result = benchmark(summary, args.repeat, converter, args.source)
+            result.update(domains=domains, records_per_domain=records, record_types=record_types, long_text=long)
+            results['scenarios'][name] = result
+            print(f"{name}: " + ', '.join(f"{stage} {metrics['wall_s']:.4f}s"
+                                          for stage, metrics in result['stages'].items()), file=sys.stderr)
+    finally:
+        if converter is not None:
+            converter.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for line in compare(results, baseline):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import importlib.util
+import os
+import py_compile
+import sys
+import tempfile
+import zipfile
+
+# Packs the form generator into a single zipapp with precompiled bytecode, so a
+# per-request `python3 form-generator.pyz -t TOKEN` neither compiles the entry
+# script nor checks the sources of the modules it imports:
+#
+#   python3 src/utils/build_form_generator.py
+#   python3 src/utils/form-generator.pyz -t <REQUEST_TOKEN>
+#
+# The bytecode only matches the Python version that built it (another version
+# falls back to the sources stored alongside it). python-docx, requests and
+# python-dotenv are still imported from the interpreter's site-packages: lxml is
+# a C extension and cannot be loaded from an archive.
+
+MODULES = ['generate_domain_request_forms', 'form_cache', 'form_converter', 'form_export', 'form_http',
+           'form_metrics', 'form_optimize', 'form_pdf', 'form_queue', 'form_source', 'form_stream']
+
+MAIN = '''import generate_domain_request_forms
+
+generate_domain_request_forms.main()
+'''
+
+utils_root = os.path.dirname(os.path.abspath(__file__))
+default_output = os.path.join(utils_root, 'form-generator.pyz')
+
+
+def compiled(source_path, archive_name):
+    # Unchecked hash-based bytecode: zipimport uses it without comparing it to the source
+    fd, pyc_path = tempfile.mkstemp(suffix='.pyc')
+    os.close(fd)
+    try:
+        py_compile.compile(source_path, cfile=pyc_path, dfile=archive_name, doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        with open(pyc_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(pyc_path)
+
+
+def build(output_path, interpreter='/usr/bin/env python3'):
+    # The archive must stay in src/utils: the generator resolves the media and
+    # cache directories relative to it
+    output_path = os.path.abspath(output_path)
+    fd, temp_path = tempfile.mkstemp(prefix='.form-generator-', dir=os.path.dirname(output_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'#!' + interpreter.encode() + b'\n')
+            # Stored rather than deflated: the archive is small and read on every start
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as archive:
+                for module in MODULES:
+                    source_path = os.path.join(utils_root, module + '.py')
+                    archive.write(source_path, module + '.py')
+                    archive.writestr(module + '.pyc', compiled(source_path, module + '.py'))
+                archive.writestr('__main__.py', MAIN)
+        os.chmod(temp_path, 0o755)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the form generator zipapp.')
+    parser.add_argument('--output', default=default_output, help=f'Archive to write (default: {default_output})')
+    parser.add_argument('--python', default='/usr/bin/env python3', help='Interpreter for the archive\'s #! line')
+    args = parser.parse_args()
+
+    if os.path.dirname(os.path.abspath(args.output)) != utils_root:
+        print(f"Warning: the generator resolves public/media relative to the archive; "
+              f"outside {utils_root} it writes to a different directory")
+    output_path = build(args.output, args.python)
+    print(f"{output_path} ({os.path.getsize(output_path)} bytes, bytecode for Python "
+          f"{sys.version_info.major}.{sys.version_info.minor}, magic {importlib.util.MAGIC_NUMBER.hex()})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+// The date printed on a request's cover letter, as YYYY-MM-DD for the generator's --date.
+// It is the day the forms were first generated, kept in request.cover_letter_date, so
+// regenerating the forms (after an edit, or from the render cache) never re-dates a letter
+// that may already have been printed or sent. A request without forms yet gets today.
+export function coverLetterDate(request: { cover_letter_date: Date | null }) {
+  if (request.cover_letter_date) {
+    // A @db.Date column comes back as midnight UTC
+    return request.cover_letter_date.toISOString().slice(0, 10);
+  }
+  const now = new Date();
+  return [
+    now.getFullYear(),
+    String(now.getMonth() + 1).padStart(2, '0'),
+    String(now.getDate()).padStart(2, '0'),
+  ].join('-');
+}
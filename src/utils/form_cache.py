@@ -0,0 +1,173 @@
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+# A put sweeps the cache (a scan of every entry) only when the bytes this
+# process knows of cross max_bytes, or when no process has swept it for this
+# many seconds; the size limit is exceeded by at most what is written in between
+EVICT_INTERVAL = 10 * 60
+
+# A sweep over the size limit goes down to this fraction of it, so that the
+# puts that follow do not sweep again at once
+EVICT_TARGET = 0.9
+
+# Touched by every sweep, so that concurrent processes share the interval
+EVICT_MARKER = '.evicted'
+
+
+def fingerprint(payload):
+    # Stable hash of a JSON-serializable payload (key order and whitespace do not matter)
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    # Content-addressed store of rendered PDFs. Each entry is a directory named
+    # after the fingerprint of everything that went into the documents, so an
+    # identical input is a hit and any change is a miss. Entries are written to a
+    # temporary directory and renamed into place, which makes them safe to share
+    # between concurrent generator processes.
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Total size as of this process's last sweep plus what it stored since;
+        # None until it has swept
+        self.known_bytes = None
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key, names):
+        entry = self.entry_dir(key)
+        paths = {name: os.path.join(entry, name) for name in names}
+        if not all(os.path.isfile(path) for path in paths.values()):
+            return None
+        if time.time() - os.path.getmtime(entry) > self.max_age:
+            return None
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return paths
+
+    def restore(self, key, targets):
+        # Copy cached files to their output paths; targets maps cached name -> output path.
+        # Each copy is written to a temporary file and renamed, so a reader never
+        # sees a partially restored file.
+        cached = self.get(key, list(targets))
+        if cached is None:
+            return False
+        for name, target in targets.items():
+            # An identical file is left alone, keeping its modification time
+            if os.path.isfile(target) and filecmp.cmp(cached[name], target, shallow=False):
+                continue
+            directory, base = os.path.split(target)
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(prefix=f'.{base}.', suffix='.tmp', dir=directory)
+                os.close(fd)
+                shutil.copyfile(cached[name], temp_path)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, target)
+            except OSError:
+                if temp_path is not None and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return False
+        return True
+
+    def put(self, key, sources):
+        # sources maps cached name -> path of the freshly rendered file
+        entry = self.entry_dir(key)
+        staging = None
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=os.path.dirname(entry))
+            for name, source in sources.items():
+                shutil.copyfile(source, os.path.join(staging, name))
+            if os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(staging, entry)
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in sources)
+        except OSError:
+            # Another process won the race or the disk is unavailable; the cache is best-effort
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+            return False
+        if self.known_bytes is not None:
+            self.known_bytes += size
+        if self.evict_due():
+            self.evict()
+        return True
+
+    def evict_due(self):
+        if self.known_bytes is not None and self.known_bytes > self.max_bytes:
+            return True
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self.root, EVICT_MARKER)) > EVICT_INTERVAL
+        except OSError:
+            return True
+
+    def discard(self, key):
+        entry = self.entry_dir(key)
+        if os.path.isdir(entry):
+            self.remove(entry)
+
+    def entries(self):
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir() or entry.name.startswith('.'):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    result.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:
+                    continue
+        return result
+
+    def remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def evict(self):
+        # Drop expired entries, then, once over the size limit, the least recently
+        # used ones until EVICT_TARGET of it
+        now = time.time()
+        live = []
+        for mtime, size, path in self.entries():
+            if now - mtime > self.max_age:
+                self.remove(path)
+            else:
+                live.append((mtime, size, path))
+
+        total = sum(size for _, size, _ in live)
+        limit = self.max_bytes * EVICT_TARGET if total > self.max_bytes else self.max_bytes
+        for mtime, size, path in sorted(live):
+            if total <= limit:
+                break
+            self.remove(path)
+            total -= size
+        self.known_bytes = total
+        try:
+            with open(os.path.join(self.root, EVICT_MARKER), 'a'):
+                pass
+            os.utime(os.path.join(self.root, EVICT_MARKER))
+        except OSError:
+            pass
@@ -0,0 +1,461 @@
+import argparse
+import json
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Binary used for conversions, both for the warm pool and the one-shot fallback
+SOFFICE_BINARY = os.getenv('SOFFICE_BINARY', 'libreoffice')
+
+# Restart a pooled soffice instance after this many conversions to keep its memory in check
+DEFAULT_MAX_CONVERSIONS = 200
+DEFAULT_STARTUP_TIMEOUT = 30
+DEFAULT_SOCKET_TIMEOUT = 120
+# is_warm() asks a converter server whether it is warm, and counts a server
+# that has not answered within this many seconds as cold
+WARM_CHECK_TIMEOUT = 1
+
+
+# FORM_PDF_A exports PDF/A-1b, -2b or -3b for archiving instead of plain PDF
+PDFA_LEVELS = ('1', '2', '3')
+
+
+class ConversionError(Exception):
+    pass
+
+
+def pdfa_level():
+    level = os.getenv('FORM_PDF_A', '')
+    if level and level not in PDFA_LEVELS:
+        raise ConversionError(f"FORM_PDF_A must be one of {', '.join(PDFA_LEVELS)}, not {level!r}")
+    return level or None
+
+
+def export_format():
+    # The --convert-to target; PDF/A is set through the export filter's JSON
+    # options (LibreOffice 7.4 and later)
+    level = pdfa_level()
+    if level is None:
+        return 'pdf'
+    return 'pdf:writer_pdf_Export:' + json.dumps({'SelectPdfVersion': {'type': 'long', 'value': level}})
+
+
+def profile_url(profile_dir):
+    return 'file://' + os.path.abspath(profile_dir)
+
+
+def convert_oneshot(docx_path, outdir, profile_dir=None):
+    # Cold-start a LibreOffice process for a single document (the original behaviour)
+    convert_oneshot_many([docx_path], outdir, profile_dir)
+
+
+def convert_oneshot_many(docx_paths, outdir, profile_dir=None):
+    # One cold-started LibreOffice process converts every document into outdir.
+    # Without a profile_dir it gets a private profile for this call: a second
+    # soffice started on a profile in use (a pre-warm next to generate-forms)
+    # hands its documents to the first one and can exit without converting them.
+    private_profile = None
+    if not profile_dir:
+        private_profile = profile_dir = tempfile.mkdtemp(prefix='soffice-profile-')
+    command = [SOFFICE_BINARY, '--headless', f'-env:UserInstallation={profile_url(profile_dir)}',
+               '--convert-to', export_format(), '--outdir', outdir] + list(docx_paths)
+    try:
+        # Redirect stdout and stderr to /dev/null to suppress output
+        with open(os.devnull, 'w') as devnull:
+            subprocess.run(command, check=True, stdout=devnull, stderr=devnull)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise ConversionError(f"Failed to convert {', '.join(docx_paths)} to PDF: {e}")
+    finally:
+        if private_profile is not None:
+            shutil.rmtree(private_profile, ignore_errors=True)
+
+
+def oneshot_pdf_path(docx_path, outdir):
+    # Where LibreOffice's --convert-to writes the PDF for docx_path
+    return os.path.join(outdir, os.path.splitext(os.path.basename(docx_path))[0] + '.pdf')
+
+
+def convert_oneshot_pairs(pairs, profile_dir=None):
+    # pairs is a list of (docx_path, pdf_path); documents sharing an output
+    # directory are converted by a single process and moved to their target names
+    by_outdir = {}
+    for docx_path, pdf_path in pairs:
+        by_outdir.setdefault(os.path.dirname(pdf_path), []).append((docx_path, pdf_path))
+    for outdir, group in by_outdir.items():
+        convert_oneshot_many([docx_path for docx_path, _ in group], outdir, profile_dir)
+        for docx_path, pdf_path in group:
+            produced = oneshot_pdf_path(docx_path, outdir)
+            if os.path.abspath(produced) != os.path.abspath(pdf_path):
+                os.replace(produced, pdf_path)
+
+
+_uno_available = None
+_cold_pool_logged = False
+
+def uno_available():
+    global _uno_available
+    if _uno_available is None:
+        try:
+            import uno  # noqa: F401
+            _uno_available = True
+        except ImportError:
+            _uno_available = False
+    return _uno_available
+
+
+def log_cold_pool():
+    # Once per process, on stderr: stdout carries the results of --serve and --batch
+    global _cold_pool_logged
+    if not _cold_pool_logged:
+        _cold_pool_logged = True
+        print("form_converter: the LibreOffice Python bindings (uno) are not installed; the converter pool "
+              "converts through one-shot LibreOffice processes instead of warm instances", file=sys.stderr)
+
+
+class SofficeWorker:
+    # A single headless soffice instance with its own user profile, driven over UNO.
+    # Without the uno bindings the worker still keeps its private profile but
+    # converts through one-shot processes.
+
+    def __init__(self, index, base_dir, max_conversions=DEFAULT_MAX_CONVERSIONS,
+                 startup_timeout=DEFAULT_STARTUP_TIMEOUT):
+        self.index = index
+        self.profile_dir = os.path.join(base_dir, f'profile-{index}')
+        self.pipe_name = f'form_converter_{os.getpid()}_{index}'
+        self.max_conversions = max_conversions
+        self.startup_timeout = startup_timeout
+        self.use_uno = uno_available()
+        self.process = None
+        self.desktop = None
+        self.conversions = 0
+        self.restarts = 0
+
+    def start(self):
+        if not self.use_uno:
+            return
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen(
+                [
+                    SOFFICE_BINARY, '--headless', '--invisible', '--nologo', '--norestore',
+                    '--nodefault', '--nolockcheck',
+                    f'-env:UserInstallation={profile_url(self.profile_dir)}',
+                    f'--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext',
+                ],
+                stdout=devnull,
+                stderr=devnull,
+            )
+        self.desktop = self._connect()
+        self.conversions = 0
+
+    def _connect(self):
+        import uno
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context)
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self.process.poll() is not None:
+                raise ConversionError(f"soffice worker {self.index} exited during startup")
+            try:
+                context = resolver.resolve(
+                    f'uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext')
+                return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+            except Exception:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise ConversionError(f"soffice worker {self.index} did not accept connections")
+                time.sleep(0.25)
+
+    def healthy(self):
+        if not self.use_uno:
+            return True
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getFrames().getCount()
+        except Exception:
+            return False
+        return True
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def convert_many(self, pairs):
+        if not self.use_uno:
+            convert_oneshot_pairs(pairs, self.profile_dir)
+            self.conversions += len(pairs)
+            return
+        for docx_path, pdf_path in pairs:
+            self.convert(docx_path, pdf_path)
+
+    def convert(self, docx_path, pdf_path):
+        if not self.use_uno:
+            convert_oneshot(docx_path, os.path.dirname(pdf_path), self.profile_dir)
+            self.conversions += 1
+            return
+
+        if self.conversions >= self.max_conversions or not self.healthy():
+            self.restart()
+
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def props(**values):
+            result = []
+            for name, value in values.items():
+                prop = PropertyValue()
+                prop.Name = name
+                prop.Value = value
+                result.append(prop)
+            return tuple(result)
+
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(docx_path)), '_blank', 0, props(Hidden=True))
+        if document is None:
+            raise ConversionError(f"soffice worker {self.index} could not load {docx_path}")
+        try:
+            level = pdfa_level()
+            if level is None:
+                document.storeToURL(
+                    uno.systemPathToFileUrl(os.path.abspath(pdf_path)), props(FilterName='writer_pdf_Export'))
+            else:
+                # FilterData is a sequence of PropertyValue, which only passes through uno.invoke
+                filter_data = uno.Any('[]com.sun.star.beans.PropertyValue', props(SelectPdfVersion=int(level)))
+                uno.invoke(document, 'storeToURL', (uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                                                    props(FilterName='writer_pdf_Export', FilterData=filter_data)))
+        finally:
+            document.close(True)
+        self.conversions += 1
+
+
+class ConverterPool:
+    # A fixed set of warm soffice workers. Each conversion borrows one worker;
+    # a worker that fails is restarted and the document retried once, then the
+    # pool falls back to the one-shot subprocess.
+
+    def __init__(self, size=2, max_conversions=DEFAULT_MAX_CONVERSIONS, base_dir=None):
+        self.size = size
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix='form-converter-')
+        self.owns_base_dir = base_dir is None
+        self.workers = [SofficeWorker(i, self.base_dir, max_conversions) for i in range(size)]
+        # Without uno the workers run one-shot conversions: the pool is not warm
+        self.warm = size > 0 and uno_available()
+        if size > 0 and not self.warm:
+            log_cold_pool()
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+
+    def convert(self, docx_path, pdf_path):
+        self.convert_many([(docx_path, pdf_path)])
+
+    def convert_many(self, pairs):
+        # All documents of one call go through the same worker
+        worker = self.idle.get()
+        try:
+            for attempt in range(2):
+                try:
+                    if worker.use_uno and worker.process is None:
+                        worker.start()
+                    worker.convert_many(pairs)
+                    return
+                except Exception:
+                    worker.stop()
+            with self.lock:
+                self.fallbacks += 1
+            convert_oneshot_pairs(pairs)
+        finally:
+            self.idle.put(worker)
+
+    def status(self):
+        return {
+            'size': self.size,
+            'uno': uno_available(),
+            'warm': self.warm,
+            'idle': self.idle.qsize(),
+            'fallbacks': self.fallbacks,
+            'workers': [
+                {
+                    'index': worker.index,
+                    'healthy': worker.healthy(),
+                    'conversions': worker.conversions,
+                    'restarts': worker.restarts,
+                }
+                for worker in self.workers
+            ],
+        }
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        if self.owns_base_dir:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+
+
+class _ConverterRequestHandler(socketserver.StreamRequestHandler):
+    # One JSON object per line: {"docx": ..., "pdf": ...}, {"jobs": [{"docx": ..., "pdf": ...}, ...]}
+    # or {"op": "ping"}
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                job = json.loads(line)
+                if job.get('op') == 'ping':
+                    reply = {'ok': True, 'status': self.server.pool.status()}
+                elif 'jobs' in job:
+                    self.server.pool.convert_many([(item['docx'], item['pdf']) for item in job['jobs']])
+                    reply = {'ok': True, 'pdf': [item['pdf'] for item in job['jobs']]}
+                else:
+                    self.server.pool.convert(job['docx'], job['pdf'])
+                    reply = {'ok': True, 'pdf': job['pdf']}
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+            self.wfile.flush()
+
+
+class ConverterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.pool = pool
+        super().__init__(socket_path, _ConverterRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+
+def _request(socket_path, payload, timeout=DEFAULT_SOCKET_TIMEOUT):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall((json.dumps(payload) + '\n').encode())
+        with client.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConversionError("Converter server closed the connection")
+    return json.loads(line)
+
+
+def convert_via_socket(socket_path, docx_path, pdf_path, timeout=DEFAULT_SOCKET_TIMEOUT):
+    reply = _request(socket_path, {'docx': os.path.abspath(docx_path), 'pdf': os.path.abspath(pdf_path)}, timeout)
+    if not reply.get('ok'):
+        raise ConversionError(reply.get('error', 'conversion failed'))
+
+
+def convert_many_via_socket(socket_path, pairs, timeout=DEFAULT_SOCKET_TIMEOUT):
+    jobs = [{'docx': os.path.abspath(docx_path), 'pdf': os.path.abspath(pdf_path)} for docx_path, pdf_path in pairs]
+    reply = _request(socket_path, {'jobs': jobs}, timeout * len(jobs))
+    if not reply.get('ok'):
+        raise ConversionError(reply.get('error', 'conversion failed'))
+
+
+def ping(socket_path, timeout=5):
+    return _request(socket_path, {'op': 'ping'}, timeout)
+
+
+def server_socket():
+    socket_path = os.getenv('SOFFICE_POOL_SOCKET')
+    if socket_path and os.path.exists(socket_path):
+        return socket_path
+    return None
+
+
+def is_warm(pool=None):
+    # True when a conversion does not have to cold-start LibreOffice: the pool
+    # drives warm instances over UNO, or the converter server answers and says
+    # its pool does
+    if pool is not None:
+        return pool.warm
+    socket_path = server_socket()
+    if socket_path is None:
+        return False
+    try:
+        status = ping(socket_path, WARM_CHECK_TIMEOUT).get('status') or {}
+    except (OSError, ValueError, ConversionError):
+        return False
+    return bool(status.get('warm'))
+
+
+def convert(docx_path, pdf_path, pool=None):
+    convert_many([(docx_path, pdf_path)], pool)
+
+
+def convert_many(pairs, pool=None):
+    # Convert (docx_path, pdf_path) pairs in a single call. Prefer an in-process
+    # pool, then a running converter server, then one one-shot process.
+    if pool is not None:
+        pool.convert_many(pairs)
+        return
+
+    socket_path = server_socket()
+    if socket_path:
+        try:
+            convert_many_via_socket(socket_path, pairs)
+            return
+        except (OSError, ValueError, ConversionError):
+            pass
+
+    convert_oneshot_pairs(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm LibreOffice conversion server for the domain request forms.')
+    parser.add_argument('--socket', default=os.getenv('SOFFICE_POOL_SOCKET', '/tmp/gov-lk-soffice.sock'),
+                        help='Unix socket path to listen on')
+    parser.add_argument('--workers', type=int, default=2, help='Number of soffice instances to keep warm')
+    parser.add_argument('--max-conversions', type=int, default=DEFAULT_MAX_CONVERSIONS,
+                        help='Restart an instance after this many conversions')
+    parser.add_argument('--ping', action='store_true', help='Query a running server and print its status')
+    args = parser.parse_args()
+
+    if args.ping:
+        try:
+            print(json.dumps(ping(args.socket)))
+        except (OSError, ValueError, ConversionError) as e:
+            print(f"Converter server is not reachable: {e}")
+            sys.exit(1)
+        return
+
+    pool = ConverterPool(args.workers, args.max_conversions)
+    server = ConverterServer(args.socket, pool)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import os
+import shutil
+import zipfile
+from decimal import Decimal
+
+# Writes the generated PDFs of many requests as a single file, for the
+# hostmaster to review a day's submissions in one download:
+#
+#   ZipExport  a ZIP archive of the PDFs as they were published
+#   MergedPdf  one PDF with every document in turn and a bookmark per request
+#              (with one below it per document), written object by object
+#
+# Both write to a file object as each request is added and never seek, so they
+# can write straight to stdout; memory stays flat however many requests there
+# are (the merged PDF keeps an offset per object and a title per request).
+# Merging needs pikepdf (pip install pikepdf) to read the PDFs.
+
+FORMATS = ('zip', 'pdf')
+
+# Bytes copied into the archive at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Page attributes a page may inherit from the page tree; merged pages are all
+# children of one page tree node, so they get their own copy
+INHERITED_PAGE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+# The merged document's catalog and page tree are written last, under these numbers
+CATALOG_NUMBER = 1
+PAGES_NUMBER = 2
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_format(path):
+    # 'pdf' for a .pdf path, 'zip' otherwise (and for stdout)
+    return 'pdf' if path.lower().endswith('.pdf') else 'zip'
+
+
+class CountingWriter:
+    # Tracks the position in a stream that cannot tell() (a pipe)
+
+    def __init__(self, f):
+        self.f = f
+        self.position = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.position += len(data)
+
+
+class ZipExport:
+    # PDFs are stored under their published names, dated 1980-01-01 like the
+    # Word documents, so the same forms always give the same archive
+
+    def __init__(self, f):
+        self.archive = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+        self.names = set()
+
+    def add(self, title, documents):
+        # documents: (label, path) of each PDF of one request; the title is not used
+        for _, path in documents:
+            name = os.path.basename(path)
+            if name in self.names:
+                continue
+            self.names.add(name)
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            try:
+                with open(path, 'rb') as source, self.archive.open(info, 'w') as target:
+                    shutil.copyfileobj(source, target, CHUNK_SIZE)
+            except OSError as e:
+                raise ExportError(f"Failed to add {name} to the archive: {e}")
+
+    def close(self):
+        self.archive.close()
+
+
+def text_string(text):
+    import pikepdf
+    # PDFDocEncoding when it can hold the text, UTF-16BE otherwise
+    return pikepdf.String(text).unparse()
+
+
+class MergedPdf:
+    # The pages of each added PDF are copied with everything they refer to
+    # (content streams, fonts, images), still compressed: streams are written
+    # with their raw bytes and filters. Objects are renumbered per document and
+    # written as soon as they are reached, and the catalog, page tree, outline
+    # and cross-reference table follow the last document.
+
+    def __init__(self, f, title=None, producer=None):
+        try:
+            import pikepdf
+        except ImportError:
+            raise ExportError("Merging PDFs needs pikepdf (pip install pikepdf)")
+        self.pikepdf = pikepdf
+        self.out = CountingWriter(f)
+        self.title = title
+        self.producer = producer
+        # offsets[number] of each object written so far
+        self.offsets = [None] * (PAGES_NUMBER + 1)
+        self.pages = []
+        # (title, [(label, first page number)]) per request
+        self.outline = []
+        # A binary comment marks the file as binary for transfer tools
+        self.out.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def new_number(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.out.position
+        self.out.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def add(self, title, documents):
+        # documents: (label, path) of each PDF of one request. A request that
+        # fails is left out whole: the objects already written stay in the file,
+        # but nothing refers to them.
+        page_count = len(self.pages)
+        entries = []
+        try:
+            for label, path in documents:
+                first_page = self.copy_pages(path)
+                if first_page is not None:
+                    entries.append((label, first_page))
+        except ExportError:
+            del self.pages[page_count:]
+            raise
+        if entries:
+            self.outline.append((title, entries))
+
+    def copy_pages(self, path):
+        # Copies the pages of the PDF at path; returns the number of the first one
+        pikepdf = self.pikepdf
+        numbers = {}
+        pending = []
+
+        def reference(obj):
+            if obj.objgen not in numbers:
+                numbers[obj.objgen] = self.new_number()
+                pending.append(obj)
+            return b'%d 0 R' % numbers[obj.objgen]
+
+        try:
+            with pikepdf.open(path) as pdf:
+                pages = [page.obj for page in pdf.pages]
+                page_ids = {page.objgen for page in pages}
+                first = len(self.pages)
+                for page in pages:
+                    reference(page)
+                    self.pages.append(numbers[page.objgen])
+                while pending:
+                    obj = pending.pop()
+                    if obj.objgen in page_ids:
+                        body = self.serialize_page(obj, reference)
+                    elif isinstance(obj, pikepdf.Stream):
+                        body = self.serialize_stream(obj, reference)
+                    else:
+                        body = self.serialize_direct(obj, reference)
+                    self.write_object(numbers[obj.objgen], body)
+        except (pikepdf.PdfError, OSError) as e:
+            raise ExportError(f"Failed to merge {os.path.basename(path)}: {e}")
+        return self.pages[first] if len(self.pages) > first else None
+
+    def serialize(self, value, reference):
+        # pikepdf hands out numbers, booleans and null as Python values
+        if value is None:
+            return b'null'
+        if isinstance(value, bool):
+            return b'true' if value else b'false'
+        if isinstance(value, int):
+            return b'%d' % value
+        if isinstance(value, Decimal):
+            return format(value, 'f').encode('ascii')
+        if value.is_indirect:
+            return reference(value)
+        return self.serialize_direct(value, reference)
+
+    def serialize_dictionary(self, entries, reference):
+        parts = [b'<<']
+        for key in sorted(entries):
+            parts.append(self.pikepdf.Name(key).unparse() + b' ' + self.serialize(entries[key], reference))
+        parts.append(b'>>')
+        return b' '.join(parts)
+
+    def serialize_direct(self, obj, reference):
+        pikepdf = self.pikepdf
+        if isinstance(obj, pikepdf.Dictionary):
+            return self.serialize_dictionary({key: obj[key] for key in obj.keys()}, reference)
+        if isinstance(obj, pikepdf.Array):
+            return b'[' + b' '.join(self.serialize(item, reference) for item in obj) + b']'
+        # Names and strings
+        return obj.unparse()
+
+    def serialize_stream(self, obj, reference):
+        data = obj.read_raw_bytes()
+        entries = {key: obj.stream_dict[key] for key in obj.stream_dict.keys() if key != '/Length'}
+        entries['/Length'] = len(data)
+        return self.serialize_dictionary(entries, reference) + b'\nstream\n' + data + b'\nendstream'
+
+    def serialize_page(self, page, reference):
+        # The source page tree is not copied: the page is reparented to the
+        # merged one and takes along the attributes it inherited from it
+        entries = {key: page[key] for key in page.keys() if key != '/Parent'}
+        node = page.get('/Parent')
+        while node is not None:
+            for key in INHERITED_PAGE_KEYS:
+                if key not in entries and key in node:
+                    entries[key] = node[key]
+            node = node.get('/Parent')
+        body = self.serialize_dictionary(entries, reference)
+        return body[:-2] + b'/Parent %d 0 R >>' % PAGES_NUMBER
+
+    def write_outline(self):
+        # One bookmark per request, opening its first document, with one per
+        # document below it; returns the number of the outline root
+        root = self.new_number()
+        items = [(self.new_number(), title, entries) for title, entries in self.outline]
+        for index, (number, title, entries) in enumerate(items):
+            children = [(self.new_number(), label, page) for label, page in entries]
+            for child_index, (child, label, page) in enumerate(children):
+                links = {'/Parent': number}
+                if child_index > 0:
+                    links['/Prev'] = children[child_index - 1][0]
+                if child_index < len(children) - 1:
+                    links['/Next'] = children[child_index + 1][0]
+                self.write_object(child, self.outline_item(label, page, links))
+            links = {'/Parent': root, '/First': children[0][0], '/Last': children[-1][0]}
+            if index > 0:
+                links['/Prev'] = items[index - 1][0]
+            if index < len(items) - 1:
+                links['/Next'] = items[index + 1][0]
+            # A negative count: closed, showing the requests only
+            self.write_object(number, self.outline_item(title, entries[0][1], links, -len(children)))
+        if items:
+            self.write_object(root, b'<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>'
+                              % (items[0][0], items[-1][0], len(items)))
+        else:
+            self.write_object(root, b'<< /Type /Outlines /Count 0 >>')
+        return root
+
+    def outline_item(self, title, page, links, count=None):
+        parts = [b'<< /Title ' + text_string(title)]
+        for key, number in links.items():
+            parts.append(key.encode('ascii') + b' %d 0 R' % number)
+        if count is not None:
+            parts.append(b'/Count %d' % count)
+        parts.append(b'/Dest [%d 0 R /Fit] >>' % page)
+        return b' '.join(parts)
+
+    def close(self):
+        outlines = self.write_outline()
+        kids = b' '.join(b'%d 0 R' % number for number in self.pages)
+        self.write_object(PAGES_NUMBER, b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % len(self.pages))
+        self.write_object(CATALOG_NUMBER, b'<< /Type /Catalog /Pages %d 0 R /Outlines %d 0 R /PageMode /UseOutlines >>'
+                          % (PAGES_NUMBER, outlines))
+        info = {}
+        if self.title:
+            info['/Title'] = text_string(self.title)
+        if self.producer:
+            info['/Producer'] = text_string(self.producer)
+        info_number = None
+        if info:
+            info_number = self.new_number()
+            self.write_object(info_number, b'<< ' + b' '.join(key.encode('ascii') + b' ' + value
+                                                                for key, value in info.items()) + b' >>')
+
+        # No /ID: the same forms always give the same file
+        xref = self.out.position
+        self.out.write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self.offsets))
+        for offset in self.offsets[1:]:
+            if offset is None:
+                # Numbered, but not written before its document failed
+                self.out.write(b'0000000000 00001 f \n')
+            else:
+                self.out.write(b'%010d 00000 n \n' % offset)
+        trailer = b'<< /Size %d /Root %d 0 R' % (len(self.offsets), CATALOG_NUMBER)
+        if info_number is not None:
+            trailer += b' /Info %d 0 R' % info_number
+        self.out.write(b'trailer\n' + trailer + b' >>\nstartxref\n%d\n%%%%EOF\n' % xref)
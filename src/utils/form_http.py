@@ -0,0 +1,177 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# HTTP access to the app's API for the form generator: one keep-alive session
+# per process, connect and read timeouts, bounded retries with jitter, and
+# conditional requests for responses that were fetched before. requests is
+# imported when the first client is created.
+
+DEFAULT_CONNECT_TIMEOUT = 5
+# get-summary waits on the external organization name lookup
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 8
+DEFAULT_POOL_SIZE = 16
+DEFAULT_ETAG_ENTRIES = 256
+DEFAULT_PREFETCH_CONCURRENCY = 8
+
+# Worth another attempt; any other error status is final
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    pass
+
+
+class HttpClient:
+    # Thread-safe: worker threads share the session and its connection pool
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 pool_size=DEFAULT_POOL_SIZE, etag_entries=DEFAULT_ETAG_ENTRIES):
+        import requests
+
+        self.requests = requests
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        # url -> (ETag, decoded body) of the latest 200 response, least recently used first
+        self.etags = OrderedDict()
+        self.etag_entries = etag_entries
+
+    def delay(self, attempt):
+        # Exponential backoff with jitter, so retrying workers do not arrive together
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def get_json(self, url):
+        # Decoded JSON body of url. A 304 answer to If-None-Match reuses the body
+        # of the previous response. Raises FetchError once retries are exhausted.
+        with self.lock:
+            known = self.etags.get(url)
+        headers = {'If-None-Match': known[0]} if known else {}
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.delay(attempt - 1))
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (self.requests.ConnectionError, self.requests.Timeout) as e:
+                error = e
+                continue
+            except self.requests.RequestException as e:
+                raise FetchError(str(e))
+            if response.status_code == 304 and known:
+                with self.lock:
+                    if url in self.etags:
+                        self.etags.move_to_end(url)
+                return known[1]
+            if response.status_code in RETRY_STATUSES:
+                error = f"{response.status_code} {response.reason} for url: {url}"
+                continue
+            try:
+                response.raise_for_status()
+                body = response.json()
+            except self.requests.HTTPError as e:
+                raise FetchError(str(e))
+            except ValueError as e:
+                raise FetchError(f"Invalid JSON from {url}: {e}")
+            etag = response.headers.get('ETag')
+            if etag:
+                with self.lock:
+                    self.etags[url] = (etag, body)
+                    self.etags.move_to_end(url)
+                    while len(self.etags) > self.etag_entries:
+                        self.etags.popitem(last=False)
+            return body
+        raise FetchError(f"{error} (after {self.retries + 1} attempts)")
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    # The process-wide client, configured from the environment on first use
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(
+                connect_timeout=float(os.getenv('FORM_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+                read_timeout=float(os.getenv('FORM_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)),
+                retries=int(os.getenv('FORM_HTTP_RETRIES', DEFAULT_RETRIES)),
+            )
+        return _client
+
+
+def prefetch(fetch, keys, on_result, concurrency=DEFAULT_PREFETCH_CONCURRENCY):
+    # Calls fetch(key) for every key with at most `concurrency` calls in flight,
+    # and on_result(key, value, error) as each one finishes, in completion order.
+    # fetch blocks (requests), so each call runs on a thread of its own pool,
+    # which asyncio's default executor would size by CPU count instead.
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    concurrency = max(1, concurrency)
+
+    async def fetch_one(executor, semaphore, key):
+        async with semaphore:
+            try:
+                value = await asyncio.get_running_loop().run_in_executor(executor, fetch, key)
+            except Exception as e:
+                on_result(key, None, e)
+            else:
+                on_result(key, value, None)
+
+    async def fetch_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(keys))) as executor:
+            await asyncio.gather(*(fetch_one(executor, semaphore, key) for key in keys))
+
+    if keys:
+        asyncio.run(fetch_all())
+
+
+class PrefetchedValues:
+    # Values fetched ahead of use, each handed out once and only while fresh:
+    # within the TTL, and fetched after whatever the value depends on last changed
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.values
+
+    def put(self, key, value, fetched_at=None):
+        # fetched_at: the time.time() at which the fetch started, now by default
+        with self.lock:
+            self.values[key] = (time.monotonic(), fetched_at or time.time(), value)
+
+    def pop(self, key, since=None):
+        # since: a time.time() the value must have been fetched after
+        with self.lock:
+            stored = self.values.pop(key, None)
+            now = time.monotonic()
+            # Drop whatever expired without being used
+            for stale in [k for k, (at, _, _) in self.values.items() if now - at > self.ttl]:
+                del self.values[stale]
+        if stored is None or time.monotonic() - stored[0] > self.ttl:
+            return None
+        if since is not None and stored[1] < since:
+            return None
+        return stored[2]
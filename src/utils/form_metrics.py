@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Stage timings and document sizes for the form generator. Recording is off
+# until enable() is called, and nothing here ever writes to stdout or stderr:
+# the API reads the generator's stdout for the PDF paths and treats any stderr
+# output as a failure.
+
+PROMETHEUS_PREFIX = 'gov_lk_form_generator'
+
+
+class Recorder:
+    # Aggregates over every run in the process, so long-running modes report
+    # totals; a single CLI run has a count of 1 per stage
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.sizes = {}
+        self.runs = {'ok': 0, 'failed': 0}
+        self.artifacts = {}
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stage['count'] += 1
+            stage['seconds'] += seconds
+            stage['max_seconds'] = max(stage['max_seconds'], seconds)
+
+    def add_size(self, name, size):
+        with self.lock:
+            document = self.sizes.setdefault(name, {'count': 0, 'bytes': 0, 'last_bytes': 0})
+            document['count'] += 1
+            document['bytes'] += size
+            document['last_bytes'] = size
+
+    def add_run(self, ok):
+        with self.lock:
+            self.runs['ok' if ok else 'failed'] += 1
+
+    def add_artifact(self, name, rebuilt):
+        with self.lock:
+            artifact = self.artifacts.setdefault(name, {'rebuilt': 0, 'reused': 0})
+            artifact['rebuilt' if rebuilt else 'reused'] += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started_at': self.started,
+                'written_at': time.time(),
+                'runs': dict(self.runs),
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'documents': {name: dict(document) for name, document in self.sizes.items()},
+                'artifacts': {name: dict(artifact) for name, artifact in self.artifacts.items()},
+            }
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f'# HELP {p}_runs_total Form generation runs by result.',
+            f'# TYPE {p}_runs_total counter',
+        ]
+        lines += [f'{p}_runs_total{{result="{result}"}} {count}' for result, count in data['runs'].items()]
+        lines += [
+            f'# HELP {p}_stage_seconds_total Time spent in each generation stage.',
+            f'# TYPE {p}_stage_seconds_total counter',
+        ]
+        lines += [f'{p}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}'
+                  for name, stage in sorted(data['stages'].items())]
+        lines += [f'# TYPE {p}_stage_runs_total counter']
+        lines += [f'{p}_stage_runs_total{{stage="{name}"}} {stage["count"]}'
+                  for name, stage in sorted(data['stages'].items())]
+        lines += [f'# TYPE {p}_stage_max_seconds gauge']
+        lines += [f'{p}_stage_max_seconds{{stage="{name}"}} {stage["max_seconds"]:.6f}'
+                  for name, stage in sorted(data['stages'].items())]
+        lines += [
+            f'# HELP {p}_document_bytes Size of the last generated document of each kind.',
+            f'# TYPE {p}_document_bytes gauge',
+        ]
+        lines += [f'{p}_document_bytes{{document="{name}"}} {document["last_bytes"]}'
+                  for name, document in sorted(data['documents'].items())]
+        lines += [
+            f'# HELP {p}_artifacts_total Outputs built versus restored unchanged from the render cache.',
+            f'# TYPE {p}_artifacts_total counter',
+        ]
+        lines += [f'{p}_artifacts_total{{artifact="{name}",result="{result}"}} {count}'
+                  for name, artifact in sorted(data['artifacts'].items()) for result, count in artifact.items()]
+        lines += [f'# TYPE {p}_last_write_timestamp_seconds gauge',
+                  f'{p}_last_write_timestamp_seconds {data["written_at"]:.3f}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        # Prometheus textfile format for *.prom, JSON otherwise. The file is
+        # replaced atomically so a collector never reads half of it.
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2) + '\n'
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix='.metrics-', dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except OSError:
+            # Metrics are best-effort and must never change the generator's output
+            return False
+        return True
+
+
+_recorder = None
+_path = None
+
+
+def enable(path):
+    # Start recording; flush() writes everything recorded so far to path
+    global _recorder, _path
+    if _recorder is None:
+        _recorder = Recorder()
+    _path = path
+    return _recorder
+
+
+def recorder():
+    return _recorder
+
+
+def flush():
+    if _recorder is not None and _path:
+        _recorder.write(_path)
+
+
+@contextmanager
+def stage(name):
+    if _recorder is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _recorder.add_stage(name, time.perf_counter() - start)
+
+
+def record_size(name, size):
+    if _recorder is not None:
+        _recorder.add_size(name, size)
+
+
+def record_file_size(name, path):
+    if _recorder is not None:
+        try:
+            _recorder.add_size(name, os.path.getsize(path))
+        except OSError:
+            pass
+
+
+def record_run(ok):
+    if _recorder is not None:
+        _recorder.add_run(ok)
+
+
+def record_artifact(name, rebuilt):
+    if _recorder is not None:
+        _recorder.add_artifact(name, rebuilt)
+
+
+class Profiler:
+    # cProfile statistics and a tracemalloc snapshot of one run, written to
+    # <directory>/<name>.prof and <directory>/<name>.tracemalloc
+    # (load them with pstats.Stats and tracemalloc.Snapshot.load)
+
+    def __init__(self, directory, name):
+        import cProfile
+
+        self.directory = directory
+        self.name = name
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        import tracemalloc
+
+        tracemalloc.start(25)
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        import tracemalloc
+
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.profile.dump_stats(os.path.join(self.directory, self.name + '.prof'))
+            snapshot.dump(os.path.join(self.directory, self.name + '.tracemalloc'))
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,159 @@
+import argparse
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Rewrites the PDFs LibreOffice exports into smaller equivalents before they
+# are published: objects are packed into compressed object streams with a
+# cross-reference stream, every stream is recompressed at the highest zlib
+# level, resources no page uses and objects nothing refers to are dropped.
+# LibreOffice already embeds only the glyphs a document uses (font subsets);
+# those subsets are kept as they are. The rewrite is deterministic (the /ID
+# is derived from the content), so reproducible input stays reproducible.
+#
+# It runs on pikepdf (pip install pikepdf) when it is installed, otherwise on
+# the qpdf command-line tool; both are qpdf underneath and write the same
+# document. Already published forms can be optimized in place:
+#
+#   python3 src/utils/form_optimize.py public/media/domain-request/forms/*.pdf
+
+QPDF_BINARY = os.getenv('QPDF_BINARY', 'qpdf')
+
+COMPRESSION_LEVEL = 9
+
+
+class OptimizeError(Exception):
+    pass
+
+
+# Memoized: both are looked up once per process
+_backend = None
+_version = None
+
+
+def pikepdf_available():
+    # Without importing it: the generator checks this on every run, cached or not
+    return importlib.util.find_spec('pikepdf') is not None
+
+
+def backend():
+    # 'pikepdf', 'qpdf', or None when neither is installed
+    global _backend
+    if _backend is None:
+        if pikepdf_available():
+            _backend = 'pikepdf'
+        elif shutil.which(QPDF_BINARY):
+            _backend = 'qpdf'
+        else:
+            _backend = ''
+    return _backend or None
+
+
+def version():
+    # The optimizer version, which decides the bytes it writes (pikepdf wheels
+    # bundle their qpdf)
+    global _version
+    name = backend()
+    if _version is None and name == 'pikepdf':
+        import importlib.metadata
+        _version = f"pikepdf {importlib.metadata.version('pikepdf')}"
+    elif _version is None and name == 'qpdf':
+        try:
+            output = subprocess.run([QPDF_BINARY, '--version'], check=True, capture_output=True, text=True).stdout
+        except (subprocess.CalledProcessError, OSError) as e:
+            raise OptimizeError(f"Failed to run {QPDF_BINARY}: {e}")
+        _version = output.splitlines()[0] if output else 'qpdf'
+    return _version
+
+
+def optimize_with_pikepdf(data, object_streams):
+    import pikepdf
+
+    pikepdf.settings.set_flate_compression_level(COMPRESSION_LEVEL)
+    output = io.BytesIO()
+    try:
+        with pikepdf.open(io.BytesIO(data)) as pdf:
+            pdf.remove_unreferenced_resources()
+            # The XMP packet (pinned by form_pdf.pin_metadata) is written back as it is
+            pdf.save(output, compress_streams=True, recompress_flate=True,
+                     stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+                     object_stream_mode=(pikepdf.ObjectStreamMode.generate if object_streams
+                                         else pikepdf.ObjectStreamMode.disable),
+                     deterministic_id=True, fix_metadata_version=False)
+    except pikepdf.PdfError as e:
+        raise OptimizeError(str(e))
+    return output.getvalue()
+
+
+def optimize_with_qpdf(data, object_streams):
+    with tempfile.TemporaryDirectory(prefix='gov-lk-optimize-') as directory:
+        source_path = os.path.join(directory, 'in.pdf')
+        output_path = os.path.join(directory, 'out.pdf')
+        with open(source_path, 'wb') as f:
+            f.write(data)
+        command = [QPDF_BINARY, '--compress-streams=y', '--recompress-flate',
+                   f'--compression-level={COMPRESSION_LEVEL}', '--decode-level=generalized',
+                   '--remove-unreferenced-resources=yes', '--deterministic-id',
+                   '--object-streams=' + ('generate' if object_streams else 'disable'), source_path, output_path]
+        try:
+            # Exit status 3 means the file was written with warnings
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            raise OptimizeError(f"Failed to run {QPDF_BINARY}: {e}")
+        if result.returncode not in (0, 3):
+            raise OptimizeError(result.stderr.strip() or f"{QPDF_BINARY} exited with status {result.returncode}")
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+
+def optimize(data, object_streams=True):
+    # The optimized PDF, or data itself if the rewrite is not smaller. Object
+    # streams need PDF 1.5; PDF/A-1 (based on PDF 1.4) does not allow them.
+    name = backend()
+    if name is None:
+        raise OptimizeError("Optimizing PDFs needs pikepdf (pip install pikepdf) or qpdf")
+    if name == 'pikepdf':
+        optimized = optimize_with_pikepdf(data, object_streams)
+    else:
+        optimized = optimize_with_qpdf(data, object_streams)
+    return optimized if len(optimized) < len(data) else data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Optimize generated form PDFs in place.')
+    parser.add_argument('paths', nargs='+', metavar='PDF')
+    parser.add_argument('--no-object-streams', action='store_true',
+                        help='Keep a PDF 1.4 structure (for PDF/A-1 files)')
+    args = parser.parse_args()
+
+    before = after = failures = 0
+    for path in args.paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            optimized = optimize(data, not args.no_object_streams)
+            if optimized != data:
+                fd, temp_path = tempfile.mkstemp(prefix='.optimize-', suffix='.pdf', dir=os.path.dirname(path) or '.')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(optimized)
+                os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+                os.replace(temp_path, path)
+        except (OSError, OptimizeError) as e:
+            print(f"{path}: {e}")
+            failures += 1
+            continue
+        before += len(data)
+        after += len(optimized)
+        print(f"{path}: {len(data)} -> {len(optimized)} bytes")
+    if before:
+        print(f"total: {before} -> {after} bytes ({100 * (before - after) / before:.1f}% smaller)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,518 @@
+import hashlib
+import re
+import zlib
+
+# A small PDF layout engine for the fixed form layouts: paragraphs of plain
+# and bold runs, bordered tables with a vertically merged column, page breaks
+# between table rows (a row taller than a page is split between lines) and
+# keep-with-next headings. It only uses the standard
+# Helvetica fonts, so nothing has to be installed or embedded.
+
+# US Letter with 0.5 inch margins, the same page as the Word documents
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 36
+FOOTER_BASELINE = 24
+FOOTER_SIZE = 9
+
+LEADING = 1.2
+CELL_PADDING_X = 5.4
+CELL_PADDING_Y = 1.5
+BORDER_WIDTH = 0.5
+
+PRODUCER = 'gov-lk domain request forms'
+
+# Advance widths (1/1000 em) of the printable ASCII characters, from the Adobe font metrics
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+DEFAULT_WIDTH = 556
+
+FONTS = {
+    False: ('F1', 'Helvetica', HELVETICA_WIDTHS),
+    True: ('F2', 'Helvetica-Bold', HELVETICA_BOLD_WIDTHS),
+}
+
+
+class PdfError(Exception):
+    pass
+
+
+def encode(text):
+    # The standard fonts use WinAnsiEncoding. Text outside it (Sinhala, Tamil)
+    # cannot be drawn with them and is refused rather than printed as '?'.
+    try:
+        return text.encode('cp1252')
+    except UnicodeEncodeError as e:
+        raise PdfError(f"The PDF backend cannot print {text[e.start:e.end]!r} in {text!r} "
+                       f"(only Windows-1252 text); use --backend docx")
+
+
+def text_width(text, size, bold=False):
+    widths = FONTS[bold][2]
+    total = 0
+    for byte in encode(text):
+        total += widths[byte - 32] if 32 <= byte < 127 else DEFAULT_WIDTH
+    return total * size / 1000
+
+
+def escape(data):
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def wrap(runs, size, width):
+    # Break (text, bold) runs into lines no wider than width. Each line is a
+    # list of (text, bold, x_offset) segments; explicit newlines force a break.
+    lines = [[]]
+    x = 0
+
+    def place(word, bold):
+        nonlocal x
+        line = lines[-1]
+        if line and line[-1][1] == bold:
+            text, _, offset = line[-1]
+            line[-1] = (text + word, bold, offset)
+        else:
+            line.append((word, bold, x))
+        x += text_width(word, size, bold)
+
+    def new_line():
+        nonlocal x
+        # Trailing spaces do not count towards the line width
+        if lines[-1]:
+            text, bold, offset = lines[-1][-1]
+            lines[-1][-1] = (text.rstrip(' '), bold, offset)
+        lines.append([])
+        x = 0
+
+    for text, bold in runs:
+        for n, chunk in enumerate(str(text).split('\n')):
+            if n:
+                new_line()
+            for word in _words(chunk):
+                word_width = text_width(word.rstrip(' '), size, bold)
+                if x and x + word_width > width:
+                    new_line()
+                    word = word.lstrip(' ') or word
+                while word and text_width(word.rstrip(' '), size, bold) > width:
+                    # A single word wider than the line is broken by character
+                    cut = fitting_prefix(word, size, bold, width)
+                    place(word[:cut], bold)
+                    new_line()
+                    word = word[cut:]
+                if word:
+                    place(word, bold)
+    if lines[-1]:
+        text, bold, offset = lines[-1][-1]
+        lines[-1][-1] = (text.rstrip(' '), bold, offset)
+    return lines
+
+
+def fitting_prefix(word, size, bold, width):
+    # Length of the longest prefix of word that fits in width (at least one character)
+    used = 0
+    for cut, char in enumerate(word):
+        used += text_width(char, size, bold)
+        if used > width:
+            return max(cut, 1)
+    return len(word)
+
+
+def _words(text):
+    # Words keep their trailing spaces so that runs join without losing them
+    words = []
+    start = 0
+    for i in range(1, len(text) + 1):
+        if i == len(text) or (text[i] != ' ' and text[i - 1] == ' '):
+            words.append(text[start:i])
+            start = i
+    return words
+
+
+def line_width(line, size):
+    if not line:
+        return 0
+    text, bold, offset = line[-1]
+    return offset + text_width(text, size, bold)
+
+
+class Paragraph:
+
+    def __init__(self, runs=(), size=11, align='left', keep_with_next=False, space_after=0):
+        # runs is a string or a list of (text, bold)
+        self.runs = [(runs, False)] if isinstance(runs, str) else list(runs)
+        self.size = size
+        self.align = align
+        self.keep_with_next = keep_with_next
+        self.space_after = space_after
+        self._lines = {}
+
+    def lines(self, width):
+        # Measured for pagination and again for drawing, so keep the result
+        if width not in self._lines:
+            self._lines[width] = wrap(self.runs, self.size, width)
+        return self._lines[width]
+
+    def line_height(self):
+        return self.size * LEADING
+
+    def height(self, width):
+        return len(self.lines(width)) * self.line_height() + self.space_after
+
+    def min_height(self, width):
+        return self.height(width)
+
+    def split(self, width, count):
+        # The first count lines and the rest, for a paragraph broken across pages
+        lines = self.lines(width)
+        head = Paragraph(size=self.size, align=self.align)
+        tail = Paragraph(size=self.size, align=self.align, space_after=self.space_after)
+        head._lines[width] = lines[:count]
+        tail._lines[width] = lines[count:]
+        return head, tail
+
+    def draw(self, canvas, x, top, width, lines=None):
+        lines = self.lines(width) if lines is None else lines
+        for n, line in enumerate(lines):
+            baseline = top - n * self.line_height() - self.size * 0.95
+            canvas.draw_line_text(line, x, baseline, width, self.size, self.align,
+                                  last=n == len(lines) - 1)
+        return len(lines) * self.line_height() + self.space_after
+
+
+class Table:
+    # rows are lists of cells; a cell is a Paragraph, a list of Paragraphs, or
+    # None to continue the merged cell above it in the same column
+
+    def __init__(self, rows, col_widths, keep_together=False):
+        self.rows = rows
+        self.col_widths = col_widths  # fractions of the available width
+        self.keep_together = keep_together
+        self.keep_with_next = False
+
+    @staticmethod
+    def paragraphs(cell):
+        if cell is None:
+            return []
+        return cell if isinstance(cell, list) else [cell]
+
+    def widths(self, width):
+        return [width * fraction for fraction in self.col_widths]
+
+    def row_height(self, row, width):
+        height = 0
+        for cell, cell_width in zip(row, self.widths(width)):
+            inner = cell_width - 2 * CELL_PADDING_X
+            cell_height = sum(p.height(inner) for p in self.paragraphs(cell))
+            height = max(height, cell_height)
+        return height + 2 * CELL_PADDING_Y
+
+    def height(self, width):
+        return sum(self.row_height(row, width) for row in self.rows)
+
+    def min_height(self, width):
+        if self.keep_together or not self.rows:
+            return self.height(width)
+        return self.row_height(self.rows[0], width)
+
+    def split_row(self, row, width, height):
+        # The part of row that fits in height, by whole lines, and the rest. A
+        # cell that fits entirely is blank in the rest; the head is None when
+        # not even one line fits.
+        room = height - 2 * CELL_PADDING_Y
+        head, tail = [], []
+        for cell, cell_width in zip(row, self.widths(width)):
+            if cell is None:
+                head.append(None)
+                tail.append(None)
+                continue
+            inner = cell_width - 2 * CELL_PADDING_X
+            fitted, rest = [], []
+            used = 0
+            for paragraph in self.paragraphs(cell):
+                if not rest and used + paragraph.height(inner) <= room:
+                    fitted.append(paragraph)
+                    used += paragraph.height(inner)
+                    continue
+                count = 0 if rest else int((room - used) // paragraph.line_height())
+                if count > 0:
+                    first, paragraph = paragraph.split(inner, count)
+                    fitted.append(first)
+                if paragraph.lines(inner):
+                    rest.append(paragraph)
+            head.append(fitted)
+            tail.append(rest)
+        if not any(cell for cell in head):
+            return None, row
+        return head, tail
+
+    def draw_rows(self, canvas, x, top, width, rows):
+        # Draw a run of consecutive (index, height, cells) rows starting at top;
+        # cells is the row itself or the part of it split onto this page
+        widths = self.widths(width)
+        y = top
+        for position, (index, height, cells) in enumerate(rows):
+            cx = x
+            for column, (cell, cell_width) in enumerate(zip(cells, widths)):
+                continued = cell is None and position > 0
+                if not continued:
+                    canvas.line(cx, y, cx + cell_width, y)
+                canvas.line(cx, y, cx, y - height)
+                if cell is not None or position == 0:
+                    span = self.merged_span(rows, position, column)
+                    origin = cell if cell is not None else self.origin(index, column)
+                    self.draw_cell(canvas, origin, cx, y, cell_width, span)
+                cx += cell_width
+            canvas.line(cx, y, cx, y - height)
+            y -= height
+        canvas.line(x, y, x + sum(widths), y)
+        return top - y
+
+    def merged_span(self, rows, position, column):
+        # Height of the cell at rows[position] including the continuation rows below it on this page
+        span = rows[position][1]
+        for _, height, cells in rows[position + 1:]:
+            if cells[column] is not None:
+                break
+            span += height
+        return span
+
+    def origin(self, index, column):
+        # The cell a continuation row belongs to, so its text repeats after a page break
+        while index > 0 and self.rows[index][column] is None:
+            index -= 1
+        return self.rows[index][column]
+
+    def draw_cell(self, canvas, cell, x, top, width, span):
+        inner = width - 2 * CELL_PADDING_X
+        paragraphs = self.paragraphs(cell)
+        content = sum(p.height(inner) for p in paragraphs)
+        # Merged cells are centred vertically, like the DNS record type column
+        y = top - CELL_PADDING_Y
+        if span - 2 * CELL_PADDING_Y > content and any(p.align == 'center' for p in paragraphs):
+            y -= (span - 2 * CELL_PADDING_Y - content) / 2
+        for paragraph in paragraphs:
+            y -= paragraph.draw(canvas, x + CELL_PADDING_X, y, inner)
+
+
+class Canvas:
+    # Content stream of one page
+
+    def __init__(self):
+        self.ops = [f'{BORDER_WIDTH} w'.encode()]
+        # Word spacing is graphics state and carries over between text objects
+        self.word_spacing = 0
+
+    def line(self, x1, y1, x2, y2):
+        self.ops.append(f'{x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S'.encode())
+
+    def text(self, text, x, y, size, bold=False, word_spacing=0):
+        font = FONTS[bold][0]
+        spacing = ''
+        if word_spacing != self.word_spacing:
+            spacing = f'{word_spacing:.3f} Tw '
+            self.word_spacing = word_spacing
+        self.ops.append(b'BT /' + font.encode() + f' {size} Tf {spacing}{x:.2f} {y:.2f} Td ('.encode()
+                        + escape(encode(text)) + b') Tj ET')
+
+    def draw_line_text(self, line, x, baseline, width, size, align, last=True):
+        used = line_width(line, size)
+        word_spacing = 0
+        if align == 'center':
+            x += (width - used) / 2
+        elif align == 'right':
+            x += width - used
+        elif align == 'justify' and not last:
+            gaps = sum(text.count(' ') for text, _, _ in line)
+            if gaps:
+                word_spacing = (width - used) / gaps
+        shift = 0
+        for text, bold, offset in line:
+            self.text(text, x + offset + shift, baseline, size, bold, word_spacing)
+            shift += text.count(' ') * word_spacing
+
+    def stream(self):
+        return b'\n'.join(self.ops)
+
+
+class PdfDocument:
+    # Sections start on a new page and carry their own footer
+
+    def __init__(self, title=''):
+        self.title = title
+        self.pages = []
+
+    def add_section(self, flowables, footer=''):
+        width = PAGE_WIDTH - 2 * MARGIN
+        top = PAGE_HEIGHT - MARGIN
+        bottom = MARGIN + FOOTER_SIZE * LEADING
+
+        canvas = self.new_page(footer)
+        y = top
+
+        def next_page():
+            nonlocal canvas, y
+            canvas = self.new_page(footer)
+            y = top
+
+        def needed(index):
+            # Height that has to fit on the current page before flowable index is placed
+            flowable = flowables[index]
+            height = flowable.min_height(width)
+            if flowable.keep_with_next and index + 1 < len(flowables):
+                height = flowable.height(width) + needed(index + 1)
+            return height
+
+        for index, flowable in enumerate(flowables):
+            if y < top and y - needed(index) < bottom:
+                next_page()
+
+            if isinstance(flowable, Paragraph):
+                lines = flowable.lines(width)
+                while lines:
+                    fit = max(int((y - bottom) // flowable.line_height()), 0)
+                    if fit == 0 and y < top:
+                        next_page()
+                        continue
+                    chunk, lines = lines[:max(fit, 1)], lines[max(fit, 1):]
+                    used = flowable.draw(canvas, MARGIN, y, width, chunk)
+                    y -= used if not lines else used - flowable.space_after
+                    if lines:
+                        next_page()
+            else:
+                rows = []
+                for row_index, row in enumerate(flowable.rows):
+                    height = flowable.row_height(row, width)
+                    while height > top - bottom:
+                        # A row taller than a page fills the rest of this one
+                        # and carries on at the top of the next
+                        head, row = flowable.split_row(row, width, y - sum(h for _, h, _ in rows) - bottom)
+                        if head is None and not rows and y == top:
+                            raise PdfError("A table row does not fit on a page")
+                        if head is not None:
+                            rows.append((row_index, flowable.row_height(head, width), head))
+                        if rows:
+                            flowable.draw_rows(canvas, MARGIN, y, width, rows)
+                        next_page()
+                        rows = []
+                        height = flowable.row_height(row, width)
+                    if rows and y - sum(h for _, h, _ in rows) - height < bottom:
+                        flowable.draw_rows(canvas, MARGIN, y, width, rows)
+                        next_page()
+                        rows = []
+                    rows.append((row_index, height, row))
+                if rows:
+                    y -= flowable.draw_rows(canvas, MARGIN, y, width, rows)
+
+    def new_page(self, footer):
+        canvas = Canvas()
+        if footer:
+            canvas.draw_line_text([(footer, False, 0)], MARGIN, FOOTER_BASELINE,
+                                  PAGE_WIDTH - 2 * MARGIN, FOOTER_SIZE, 'center')
+        self.pages.append(canvas)
+        return canvas
+
+    def to_bytes(self):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        catalog = add(None)
+        pages = add(None)
+        fonts = {
+            bold: add(f'<< /Type /Font /Subtype /Type1 /BaseFont /{name} /Encoding /WinAnsiEncoding >>'.encode())
+            for bold, (_, name, _) in FONTS.items()
+        }
+        font_resources = ' '.join(f'/{FONTS[bold][0]} {number} 0 R' for bold, number in fonts.items())
+        kids = []
+        for canvas in self.pages:
+            data = zlib.compress(canvas.stream())
+            content = add(f'<< /Length {len(data)} /Filter /FlateDecode >>\nstream\n'.encode() + data + b'\nendstream')
+            kids.append(add(
+                f'<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                f'/Resources << /Font << {font_resources} >> >> /Contents {content} 0 R >>'.encode()))
+        objects[catalog - 1] = f'<< /Type /Catalog /Pages {pages} 0 R >>'.encode()
+        objects[pages - 1] = (f'<< /Type /Pages /Kids [{" ".join(f"{kid} 0 R" for kid in kids)}] '
+                              f'/Count {len(kids)} >>').encode()
+        # No dates or /ID: the same content always gives the same bytes
+        info = add(b'<< /Title (' + escape(encode(self.title)) + b') /Producer (' + PRODUCER.encode() + b') >>')
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        xref = len(output)
+        output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+        for offset in offsets:
+            output += f'{offset:010d} 00000 n \n'.encode()
+        output += (f'trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R /Info {info} 0 R >>\n'
+                   f'startxref\n{xref}\n%%EOF\n').encode()
+        return bytes(output)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+
+# Metadata a converter such as LibreOffice writes differently on every export:
+# the Info dictionary dates, the dates and UUIDs of an uncompressed XMP packet
+# and the trailer /ID
+PDF_DATE = re.compile(rb'/(CreationDate|ModDate)\s*\((D:\d{4,14})([^)]*)\)')
+XMP_DATE = re.compile(rb'<(xmp:CreateDate|xmp:ModifyDate|xmp:MetadataDate)>([^<]*)</\1>')
+XMP_UUID = re.compile(rb'uuid:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+TRAILER_ID = re.compile(rb'(/ID\s*\[\s*)<([0-9a-fA-F]+)>(\s*)<([0-9a-fA-F]+)>')
+
+
+def zero_offset(text):
+    # A UTC offset of the same length: +05'30' -> +00'00', -04:00 -> +00:00
+    return re.sub(rb'\d', b'0', text).replace(b'-', b'+')
+
+
+def pin_metadata(data, date):
+    # Pins those fields so identical content gives identical bytes: dates become
+    # `date` (YYYY-MM-DD) at midnight UTC, the UUIDs and /ID a digest of the
+    # pinned document. Every value keeps its length, so the cross-reference
+    # offsets stay valid.
+    digits = date.replace('-', '').encode() + b'000000'
+
+    def pdf_date(match):
+        value = match.group(2)
+        return b'/' + match.group(1) + b'(' + b'D:' + digits[:len(value) - 2] + zero_offset(match.group(3)) + b')'
+
+    def xmp_date(match):
+        value = match.group(2)
+        pinned = (date.encode() + b'T00:00:00')[:len(value)] + zero_offset(value[19:])
+        return b'<' + match.group(1) + b'>' + pinned + b'</' + match.group(1) + b'>'
+
+    data = PDF_DATE.sub(pdf_date, data)
+    data = XMP_DATE.sub(xmp_date, data)
+    data = XMP_UUID.sub(b'uuid:00000000-0000-0000-0000-000000000000', data)
+    data = TRAILER_ID.sub(lambda m: m.group(1) + b'<' + b'0' * len(m.group(2)) + b'>' + m.group(3) + b'<'
+                          + b'0' * len(m.group(4)) + b'>', data)
+
+    digest = hashlib.sha256(data).hexdigest().encode()
+    uuid = b'uuid:' + b'-'.join([digest[0:8], digest[8:12], digest[12:16], digest[16:20], digest[20:32]])
+    data = data.replace(b'uuid:00000000-0000-0000-0000-000000000000', uuid)
+
+    def trailer_id(match):
+        first, second = (digest * (len(match.group(n)) // len(digest) + 1) for n in (2, 4))
+        return (match.group(1) + b'<' + first[:len(match.group(2))] + b'>' + match.group(3) + b'<'
+                + second[:len(match.group(4))] + b'>')
+
+    return TRAILER_ID.sub(trailer_id, data)
@@ -0,0 +1,265 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 5
+DEFAULT_MAX_BACKOFF = 300
+# A running job whose worker has not renewed its lease within this many
+# seconds is handed out again; a worker renews it every third of that while
+# the job runs (keep_lease), however long the job takes
+DEFAULT_LEASE = 600
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL,
+    job TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    follow_up TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_token ON jobs (token) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, run_after);
+'''
+
+
+class JobQueue:
+    # Durable form generation queue in a SQLite file shared by the API, any
+    # number of worker processes and status queries. A token has at most one
+    # queued or running job; enqueueing it again returns that job. A payload
+    # enqueued while the job runs is kept as its follow-up and queued as a new
+    # job once the running one is over, so the newest payload is always rendered.
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, lease=DEFAULT_LEASE):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+            # Queue files created before follow-ups
+            columns = [row['name'] for row in db.execute('PRAGMA table_info(jobs)')]
+            if 'follow_up' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN follow_up TEXT')
+
+    def connect(self):
+        # A connection per call keeps the queue usable from worker threads
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA busy_timeout=30000')
+        return _Connection(db)
+
+    def enqueue(self, token, job):
+        # Returns (job status, created); a newer payload replaces that of a job
+        # still waiting, and becomes the follow-up of a running one
+        now = time.time()
+        payload = json.dumps(job)
+        with self.connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            active = db.execute(
+                'SELECT * FROM jobs WHERE token = ? AND status IN (?, ?)', (token, QUEUED, RUNNING)).fetchone()
+            if active is not None:
+                if active['status'] == QUEUED:
+                    db.execute('UPDATE jobs SET job = ?, updated_at = ? WHERE id = ?', (payload, now, active['id']))
+                else:
+                    db.execute('UPDATE jobs SET follow_up = ? WHERE id = ?', (payload, active['id']))
+                active = db.execute('SELECT * FROM jobs WHERE id = ?', (active['id'],)).fetchone()
+                db.execute('COMMIT')
+                return self.describe(active), False
+            cursor = db.execute(
+                'INSERT INTO jobs (token, job, status, max_attempts, run_after, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (token, payload, QUEUED, self.max_attempts, now, now, now))
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (cursor.lastrowid,)).fetchone()
+            db.execute('COMMIT')
+        return self.describe(row), True
+
+    def claim(self, worker, limit=None):
+        # Atomically take the next runnable job, or None. With a limit, nothing is
+        # handed out while that many jobs are already running across all workers.
+        now = time.time()
+        with self.connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            # Jobs of a worker that died or hung are runnable again once their
+            # lease runs out, unless that was their last attempt: a job that
+            # kills its worker would otherwise be handed out forever
+            expired = db.execute('SELECT * FROM jobs WHERE status = ? AND lease_until < ?', (RUNNING, now)).fetchall()
+            for row in expired:
+                if row['attempts'] < row['max_attempts']:
+                    db.execute('UPDATE jobs SET status = ?, job = COALESCE(follow_up, job), follow_up = NULL, '
+                               'worker = NULL, lease_until = NULL, updated_at = ? WHERE id = ?',
+                               (QUEUED, now, row['id']))
+                else:
+                    db.execute('UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? '
+                               'WHERE id = ?', (FAILED, 'lease expired', now, row['id']))
+                    self.queue_follow_up(db, row, now)
+            if limit is not None:
+                running = db.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (RUNNING,)).fetchone()[0]
+                if running >= limit:
+                    db.execute('COMMIT')
+                    return None
+            row = db.execute('SELECT * FROM jobs WHERE status = ? AND run_after <= ? ORDER BY run_after, id LIMIT 1',
+                             (QUEUED, now)).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            db.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_until = ?, '
+                       'updated_at = ? WHERE id = ?', (RUNNING, worker, now + self.lease, now, row['id']))
+            db.execute('COMMIT')
+        # queued_at: when the job or its payload last changed before this claim
+        return {'id': row['id'], 'token': row['token'], 'job': json.loads(row['job']), 'attempt': row['attempts'] + 1,
+                'worker': worker, 'queued_at': row['updated_at']}
+
+    def renew(self, job_id, worker):
+        # Extend the lease of a job this worker still holds; False once it lost it
+        now = time.time()
+        with self.connect() as db:
+            cursor = db.execute('UPDATE jobs SET lease_until = ?, updated_at = ? '
+                                'WHERE id = ? AND worker = ? AND status = ?',
+                                (now + self.lease, now, job_id, worker, RUNNING))
+        return cursor.rowcount > 0
+
+    @contextmanager
+    def keep_lease(self, job_id, worker):
+        # Renew the lease in the background while the block runs
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease / 3):
+                if not self.renew(job_id, worker):
+                    return
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def upcoming(self, limit, within=0):
+        # The next queued jobs in claim order, runnable now or within `within`
+        # seconds, without claiming them
+        with self.connect() as db:
+            rows = db.execute('SELECT token, job FROM jobs WHERE status = ? AND run_after <= ? '
+                              'ORDER BY run_after, id LIMIT ?', (QUEUED, time.time() + within, limit)).fetchall()
+        return [{'token': row['token'], 'job': json.loads(row['job'])} for row in rows]
+
+    def queue_follow_up(self, db, row, now):
+        # The payload enqueued while the job of row ran, as a new job
+        if row['follow_up'] is not None:
+            db.execute('INSERT INTO jobs (token, job, status, max_attempts, run_after, created_at, updated_at) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (row['token'], row['follow_up'], QUEUED, self.max_attempts, now, now, now))
+
+    def complete(self, job_id, worker, result):
+        # Only the worker holding the job can finish it: a worker whose lease ran
+        # out (and whose job went to another) gets False and its result is dropped
+        now = time.time()
+        with self.connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT * FROM jobs WHERE id = ? AND worker = ? AND status = ?',
+                             (job_id, worker, RUNNING)).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return False
+            db.execute('UPDATE jobs SET status = ?, result = ?, error = NULL, lease_until = NULL, follow_up = NULL, '
+                       'updated_at = ? WHERE id = ?', (DONE, json.dumps(result), now, job_id))
+            self.queue_follow_up(db, row, now)
+            db.execute('COMMIT')
+        return True
+
+    def fail(self, job_id, worker, error):
+        # Retry with exponential backoff and jitter until the attempts run out;
+        # False, as for complete(), when the worker no longer holds the job
+        now = time.time()
+        with self.connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT * FROM jobs WHERE id = ? AND worker = ? AND status = ?',
+                             (job_id, worker, RUNNING)).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return False
+            if row['attempts'] < row['max_attempts']:
+                delay = min(self.max_backoff, self.backoff * 2 ** (row['attempts'] - 1))
+                delay *= random.uniform(0.5, 1.0)
+                # The retry renders the newest payload
+                db.execute('UPDATE jobs SET status = ?, error = ?, run_after = ?, job = COALESCE(follow_up, job), '
+                           'follow_up = NULL, worker = NULL, lease_until = NULL, updated_at = ? WHERE id = ?',
+                           (QUEUED, error, now + delay, now, job_id))
+            else:
+                db.execute('UPDATE jobs SET status = ?, error = ?, lease_until = NULL, follow_up = NULL, '
+                           'updated_at = ? WHERE id = ?', (FAILED, error, now, job_id))
+                self.queue_follow_up(db, row, now)
+            db.execute('COMMIT')
+        return True
+
+    def status(self, token):
+        # The most recent job for the token, or None
+        with self.connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE token = ? ORDER BY id DESC LIMIT 1', (token,)).fetchone()
+        return None if row is None else self.describe(row)
+
+    def counts(self):
+        with self.connect() as db:
+            rows = db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def describe(self, row):
+        description = {
+            'id': row['id'],
+            'token': row['token'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+        if row['status'] == QUEUED and row['run_after'] > time.time():
+            description['retry_at'] = row['run_after']
+        if row['follow_up'] is not None:
+            # Queued again once this run is over
+            description['follow_up'] = True
+        if row['result']:
+            description.update({key: value for key, value in json.loads(row['result']).items()
+                                if key.endswith(('_path', '_sha256')) or key == 'rebuilt'})
+        if row['error']:
+            description['error'] = row['error']
+        return description
+
+
+class _Connection:
+    # sqlite3 connections do not close themselves when used as a context manager
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None and self.db.in_transaction:
+            self.db.execute('ROLLBACK')
+        self.db.close()
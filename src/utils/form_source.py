@@ -0,0 +1,451 @@
+import argparse
+import datetime
+import json
+import os
+import threading
+import urllib.parse
+
+import form_http
+
+# Where request summaries come from. Every source returns the payload of the
+# get-summary API (src/pages/api/request/get-summary.ts), field for field:
+#
+#   ApiSource  calls get-summary over HTTP (the default)
+#   SqlSource  reads the tables of prisma/schema.prisma directly, in a fixed
+#              number of set-based queries however many domains and DNS
+#              records the request has; it works on PostgreSQL (DATABASE_URL)
+#              and on a SQLite fixture with the same tables
+#
+#   python3 src/utils/form_source.py --fixture forms.sqlite3 --summary-json summary.json --token <TOKEN>
+#   python3 src/utils/generate_domain_request_forms.py -t <TOKEN> --source sqlite:///forms.sqlite3
+
+# DNS type name -> (table, columns in model order), as get-summary maps them
+DNS_TABLES = {
+    'A': ('dns_a_record', ['id', 'ttl', 'value']),
+    'AAAA': ('dns_aaaa_record', ['id', 'ttl', 'value']),
+    'CNAME': ('dns_cname_record', ['id', 'ttl', 'value']),
+    'TXT': ('dns_txt_record', ['id', 'ttl', 'value']),
+    'PTR': ('dns_ptr_record', ['id', 'ttl', 'value']),
+    'NS': ('dns_ns_record', ['id', 'ttl', 'value']),
+    'MX': ('dns_mx_record', ['id', 'ttl', 'value', 'priority']),
+    'SOA': ('dns_soa_record', ['id', 'ttl', 'm_name', 'r_name', 'serial', 'refresh', 'retry', 'expire', 'min_ttl']),
+    'SRV': ('dns_srv_record', ['id', 'service', 'ttl', 'weight', 'port', 'target']),
+    'CCA': ('cca_record', ['id', 'ttl', 'flag', 'tag', 'value']),
+}
+
+# Request columns holding the contacts, and the summary keys they fill
+CONTACTS = [
+    ('owner_user_id', 'organization_head'),
+    ('administrator_user_id', 'administrator'),
+    ('technical_user_id', 'technical_contact'),
+    ('content_developer_user_id', 'content_developer'),
+    ('hosting_coordinator_user_id', 'hosting_coordinator'),
+]
+
+# A parent_domain_id cycle would otherwise never end the recursion
+MAX_DOMAIN_DEPTH = 32
+
+REQUEST_QUERY = '''
+SELECT id, org_site_code, request_reason, address, email, contact_no, hosting_place,
+       owner_user_id, administrator_user_id, technical_user_id, content_developer_user_id,
+       hosting_coordinator_user_id
+FROM request WHERE request_token = ?
+'''
+
+USERS_QUERY = '''
+SELECT id, full_name, nic, mobile, email, designation FROM "user" WHERE id IN ({ids})
+'''
+
+DOMAINS_QUERY = '''
+SELECT id, domain_id, reason, include_www FROM request_domain WHERE request_id = ? ORDER BY id
+'''
+
+# Each requested domain's chain up to the root, one row per label
+FQDN_QUERY = f'''
+WITH RECURSIVE chain (request_domain_id, depth, domain_name, parent_domain_id) AS (
+    SELECT rd.id, 0, d.domain_name, d.parent_domain_id
+    FROM request_domain rd JOIN domain d ON d.id = rd.domain_id
+    WHERE rd.request_id = ?
+    UNION ALL
+    SELECT chain.request_domain_id, chain.depth + 1, parent.domain_name, parent.parent_domain_id
+    FROM chain JOIN domain parent ON parent.id = chain.parent_domain_id
+    WHERE chain.depth < {MAX_DOMAIN_DEPTH}
+)
+SELECT request_domain_id, domain_name FROM chain ORDER BY request_domain_id, depth
+'''
+
+
+def records_query():
+    # Every DNS record of the request with its details, whatever its type: one
+    # LEFT JOIN per record table, matched on the type name like get-summary
+    columns = ['rdr.request_domain_id', 'dr.id', 'dt.name', 'dr.dns_record_id']
+    joins = []
+    for index, (record_type, (table, fields)) in enumerate(DNS_TABLES.items()):
+        alias = f't{index}'
+        columns += [f'{alias}.{field}' for field in fields]
+        joins.append(f"LEFT JOIN {table} {alias} ON dt.name = '{record_type}' AND {alias}.id = dr.dns_record_id")
+    return (f"SELECT {', '.join(columns)}\n"
+            'FROM request_dns_record rdr\n'
+            'JOIN request_domain rd ON rd.id = rdr.request_domain_id\n'
+            'JOIN dns_record dr ON dr.id = rdr.dns_record_id\n'
+            'JOIN dns_type dt ON dt.id = dr.dns_type_id\n'
+            + '\n'.join(joins) +
+            '\nWHERE rd.request_id = ? ORDER BY rdr.id')
+
+
+RECORDS_QUERY = records_query()
+
+
+class SourceError(Exception):
+    pass
+
+
+def without_nulls(values):
+    # get-summary drops null fields from users, records and the summary itself
+    return {key: value for key, value in values.items() if value is not None}
+
+
+class ApiSource:
+
+    def __init__(self, host=None):
+        self.host = host
+
+    def summary(self, request_token):
+        host = self.host or os.getenv('GOV_LK_HOST')
+        url = f"{host}/api/request/get-summary?requestToken={request_token}"
+        try:
+            return form_http.client().get_json(url)['data']
+        except form_http.FetchError as e:
+            raise SourceError(f"Failed to fetch data from API: {e}")
+        except (KeyError, TypeError):
+            raise SourceError("Failed to fetch data from API: response has no summary data")
+
+    def tokens(self, since=None, until=None):
+        raise SourceError("Selecting requests by date needs a database source (--source database or a URL)")
+
+
+class SqlSource:
+    # connect() opens a DB-API connection; placeholder is the driver's parameter
+    # marker. A connection is kept per thread (and per process, for forked
+    # batch builders). Organization names are not in the database: they are
+    # looked up on GOV_API_HOST like get-summary does, unless a site code ->
+    # name mapping is given.
+
+    def __init__(self, connect, placeholder='?', organization_names=None):
+        self.connect = connect
+        self.placeholder = placeholder
+        self.organization_names = organization_names
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.queries = 0
+
+    def connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.db = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def query(self, sql, params):
+        with self.lock:
+            self.queries += 1
+        if self.placeholder != '?':
+            sql = sql.replace('?', self.placeholder)
+        cursor = self.connection().cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def organization_name(self, site_code):
+        if self.organization_names is not None:
+            return self.organization_names.get(site_code, '')
+        host = os.getenv('GOV_API_HOST')
+        if not host:
+            return ''
+        try:
+            response = form_http.client().get_json(f"{host}/api/organization/get-org-name?site_code={site_code}")
+            return response['data']['name'] or ''
+        except (form_http.FetchError, KeyError, TypeError):
+            return ''
+
+    def summary(self, request_token):
+        try:
+            return self.load(request_token)
+        except SourceError:
+            raise
+        except Exception as e:
+            raise SourceError(f"Failed to load summary from database: {e}")
+
+    def tokens(self, since=None, until=None):
+        # Tokens of the requests created from since to until (YYYY-MM-DD, both
+        # included), oldest first
+        conditions = []
+        params = []
+        try:
+            if since:
+                conditions.append('created_at >= ?')
+                params.append(datetime.date.fromisoformat(since).isoformat())
+            if until:
+                conditions.append('created_at < ?')
+                params.append((datetime.date.fromisoformat(until) + datetime.timedelta(days=1)).isoformat())
+        except ValueError as e:
+            raise SourceError(f"Invalid date: {e}")
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+        try:
+            return [token for token, in self.query(f"SELECT request_token FROM request {where}ORDER BY created_at, id",
+                                                   tuple(params))]
+        except Exception as e:
+            raise SourceError(f"Failed to list requests from database: {e}")
+
+    def load(self, request_token):
+        # Five queries: request, contacts, requested domains, FQDN chains, DNS records
+        rows = self.query(REQUEST_QUERY, (request_token,))
+        if not rows:
+            raise SourceError("Failed to load summary from database: request_not_found")
+        (request_id, site_code, reason, address, email, contact_no, hosting_place, *contact_ids) = rows[0]
+
+        ids = sorted({user_id for user_id in contact_ids if user_id is not None})
+        users = {}
+        if ids:
+            for user_id, full_name, nic, mobile, user_email, designation in self.query(
+                    USERS_QUERY.format(ids=', '.join('?' * len(ids))), tuple(ids)):
+                users[user_id] = without_nulls({'id': user_id, 'full_name': full_name, 'nic': nic, 'mobile': mobile,
+                                                'email': user_email, 'designation': designation})
+
+        labels = {}
+        for request_domain_id, domain_name in self.query(FQDN_QUERY, (request_id,)):
+            labels.setdefault(request_domain_id, []).append(domain_name)
+
+        records = {}
+        for row in self.query(RECORDS_QUERY, (request_id,)):
+            request_domain_id, dns_record_id, record_type, type_record_id = row[:4]
+            details = None
+            offset = 4
+            for name, (_, fields) in DNS_TABLES.items():
+                if name == record_type and row[offset] is not None:
+                    details = dict(zip(fields, row[offset:offset + len(fields)]))
+                offset += len(fields)
+            if details is None:
+                # Unknown type or a dangling reference: get-summary skips these too
+                continue
+            records.setdefault(request_domain_id, []).append({
+                'dns_record_id': dns_record_id,
+                'type_record_id': details['id'],
+                'type': record_type,
+                **without_nulls(details),
+            })
+
+        domains = [{
+            'domain_id': domain_id,
+            'request_domain_id': request_domain_id,
+            'fqdn': '.'.join(labels.get(request_domain_id, [])),
+            'dns_records': records.get(request_domain_id, []),
+            'reason': domain_reason,
+            'include_www': bool(include_www),
+        } for request_domain_id, domain_id, domain_reason, include_www in self.query(DOMAINS_QUERY, (request_id,))]
+
+        contacts = dict(zip([column for column, _ in CONTACTS], contact_ids))
+        summary = {
+            'request_id': request_id,
+            'site_code': site_code,
+            'organization_name': self.organization_name(site_code),
+            'request_reason': reason,
+            'address': address,
+            'email': email,
+            'contact_no': contact_no,
+            'requested_domains': domains,
+        }
+        for column, key in CONTACTS:
+            summary[key] = users.get(contacts[column])
+        # Key order as get-summary sends it
+        summary['hosting_provider'] = hosting_place
+        summary['hosting_coordinator'] = summary.pop('hosting_coordinator')
+        return without_nulls(summary)
+
+
+def postgres_connect(url):
+    # Prisma's DATABASE_URL may carry ?schema=..., which libpq does not know;
+    # it becomes the search_path instead
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qs(parts.query)
+    schema = query.pop('schema', [None])[0]
+    dsn = urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query, doseq=True)))
+    options = {'options': f'-c search_path={schema}'} if schema else {}
+    try:
+        import psycopg
+    except ImportError:
+        try:
+            import psycopg2 as psycopg
+        except ImportError:
+            raise SourceError("Reading from PostgreSQL needs psycopg (pip install psycopg) or psycopg2")
+
+    def connect():
+        db = psycopg.connect(dsn, **options)
+        # Reads only: no transaction is left open between requests
+        db.autocommit = True
+        return db
+    return connect
+
+
+def open_source(url, organization_names=None):
+    # 'api', a postgresql:// URL, or sqlite:///path for a fixture database
+    if not url or url == 'api':
+        return ApiSource()
+    if url.startswith(('postgres://', 'postgresql://')):
+        return SqlSource(postgres_connect(url), '%s', organization_names)
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        if not os.path.isfile(path):
+            raise SourceError(f"SQLite database not found: {path}")
+        import sqlite3
+        return SqlSource(lambda: sqlite3.connect(path), '?', organization_names)
+    raise SourceError(f"Unknown data source: {url}")
+
+
+# The tables of prisma/schema.prisma that the summary reads, for SQLite
+FIXTURE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS "user" (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, full_name TEXT NOT NULL, nic TEXT, mobile INTEGER, email TEXT,
+    employee BOOLEAN, designation TEXT
+);
+CREATE TABLE IF NOT EXISTS request (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, request_token TEXT NOT NULL UNIQUE, org_site_code TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, request_reason TEXT, request_status_id INTEGER,
+    owner_user_id INTEGER REFERENCES "user" (id), administrator_user_id INTEGER REFERENCES "user" (id),
+    technical_user_id INTEGER REFERENCES "user" (id), content_developer_user_id INTEGER REFERENCES "user" (id),
+    hosting_coordinator_user_id INTEGER REFERENCES "user" (id), hosting_place TEXT, address TEXT, email TEXT,
+    contact_no INTEGER, request_form_path TEXT, cover_letter_path TEXT, uploaded_request_form_path TEXT,
+    uploaded_cover_letter_path TEXT
+);
+CREATE TABLE IF NOT EXISTS domain (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, domain_name TEXT NOT NULL, parent_domain_id INTEGER REFERENCES domain (id)
+);
+CREATE TABLE IF NOT EXISTS request_domain (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, request_id INTEGER NOT NULL REFERENCES request (id),
+    domain_id INTEGER NOT NULL REFERENCES domain (id), reason TEXT NOT NULL, type TEXT NOT NULL,
+    include_www BOOLEAN NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dns_type (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, table_name TEXT NOT NULL, tip TEXT,
+    warn TEXT
+);
+CREATE TABLE IF NOT EXISTS dns_record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, dns_type_id INTEGER NOT NULL REFERENCES dns_type (id),
+    dns_record_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS request_dns_record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, request_domain_id INTEGER NOT NULL REFERENCES request_domain (id),
+    dns_record_id INTEGER NOT NULL REFERENCES dns_record (id)
+);
+CREATE TABLE IF NOT EXISTS dns_a_record (id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dns_aaaa_record (id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dns_cname_record (id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dns_txt_record (id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dns_ptr_record (id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dns_ns_record (id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dns_mx_record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, value TEXT NOT NULL, priority INTEGER
+);
+CREATE TABLE IF NOT EXISTS dns_soa_record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, m_name TEXT NOT NULL, r_name TEXT NOT NULL,
+    serial INTEGER NOT NULL, refresh INTEGER NOT NULL, retry INTEGER NOT NULL, expire INTEGER NOT NULL,
+    min_ttl INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cca_record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ttl INTEGER, flag INTEGER NOT NULL, tag TEXT NOT NULL, value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dns_srv_record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, service TEXT NOT NULL, ttl INTEGER, weight INTEGER NOT NULL,
+    port INTEGER NOT NULL, target TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dns_other_record (id INTEGER PRIMARY KEY AUTOINCREMENT, content TEXT NOT NULL);
+'''
+
+
+def insert(db, table, values):
+    columns = ', '.join(values)
+    marks = ', '.join('?' * len(values))
+    return db.execute(f'INSERT INTO {table} ({columns}) VALUES ({marks})', tuple(values.values())).lastrowid
+
+
+def domain_chain(db, fqdn, known):
+    # Domains are stored one label per row, each pointing at its parent
+    # (www.example.gov.lk -> www -> example -> gov -> lk); shared parents are reused
+    parent_id = None
+    labels = fqdn.split('.')
+    for depth in range(len(labels) - 1, -1, -1):
+        suffix = '.'.join(labels[depth:])
+        if suffix not in known:
+            known[suffix] = insert(db, 'domain', {'domain_name': labels[depth], 'parent_domain_id': parent_id})
+        parent_id = known[suffix]
+    return parent_id
+
+
+def insert_summary(db, request_token, summary):
+    # Store a get-summary payload in the fixture tables, so that
+    # SqlSource(...).summary(request_token) returns it again
+    db.executescript(FIXTURE_SCHEMA)
+    types = {name: row_id for row_id, name in db.execute('SELECT id, name FROM dns_type')}
+    for name, (table, _) in DNS_TABLES.items():
+        if name not in types:
+            types[name] = insert(db, 'dns_type', {'name': name, 'table_name': table})
+
+    users = {}
+    for column, key in CONTACTS:
+        user = summary.get(key)
+        if user:
+            users[column] = insert(db, '"user"', {field: user.get(field) for field in
+                                                  ('full_name', 'nic', 'mobile', 'email', 'designation')})
+    request_id = insert(db, 'request', {
+        'request_token': request_token,
+        'org_site_code': summary['site_code'],
+        'request_reason': summary.get('request_reason'),
+        'hosting_place': summary.get('hosting_provider'),
+        'address': summary.get('address'),
+        'email': summary.get('email'),
+        'contact_no': summary.get('contact_no'),
+        **users,
+    })
+
+    known = {}
+    for domain in summary['requested_domains']:
+        request_domain_id = insert(db, 'request_domain', {
+            'request_id': request_id,
+            'domain_id': domain_chain(db, domain['fqdn'], known),
+            'reason': domain.get('reason') or '',
+            'type': 'new',
+            'include_www': bool(domain.get('include_www')),
+        })
+        for record in domain['dns_records']:
+            table, fields = DNS_TABLES[record['type']]
+            type_record_id = insert(db, table, {field: record.get(field) for field in fields[1:]})
+            dns_record_id = insert(db, 'dns_record', {'dns_type_id': types[record['type']],
+                                                      'dns_record_id': type_record_id})
+            insert(db, 'request_dns_record', {'request_domain_id': request_domain_id, 'dns_record_id': dns_record_id})
+    db.commit()
+    return request_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a get-summary payload into a SQLite fixture database.')
+    parser.add_argument('--fixture', required=True, help='SQLite database to create or extend')
+    parser.add_argument('--summary-json', required=True, help='get-summary payload (the summary or the response body)')
+    parser.add_argument('--token', required=True, help='Request token to store it under')
+    args = parser.parse_args()
+    import sqlite3
+
+    with open(args.summary_json) as f:
+        payload = json.load(f)
+    if 'data' in payload and 'request_id' not in payload:
+        payload = payload['data']
+    db = sqlite3.connect(args.fixture)
+    try:
+        request_id = insert_summary(db, args.token, payload)
+    finally:
+        db.close()
+    print(json.dumps({'fixture': args.fixture, 'token': args.token, 'request_id': request_id}))
+
+
+if __name__ == '__main__':
+    main()
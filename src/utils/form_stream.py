@@ -0,0 +1,245 @@
+import io
+import re
+import struct
+import zipfile
+import zlib
+
+# Writes a .docx whose main part is produced piece by piece instead of from a
+# complete lxml tree. The fixed part of a document is built with python-docx
+# (the skeleton), with placeholders where the values of a request go; the
+# repeated parts are rendered from row and paragraph templates cut out of that
+# skeleton and written straight into the compressed zip entry, so memory stays
+# flat however many rows there are, and one skeleton serves every request.
+#
+# Text is encoded the way python-docx's Run.text does it (tabs and line breaks
+# become w:tab and w:br, w:t keeps surrounding spaces), and an empty text has
+# no run at all, as the generator's python-docx builders write none for it, so
+# a streamed document is the same document python-docx would have saved.
+
+DOCUMENT_PART = 'word/document.xml'
+
+# 1980-01-01 in the MS-DOS date format of zip headers
+DOS_EPOCH_DATE = (1 << 5) | 1
+
+# Text handed to the compressor at a time
+CHUNK_SIZE = 64 * 1024
+
+# Characters XML 1.0 does not allow (lxml refuses them as well), including
+# lone surrogates, which a JSON \ud800 escape decodes to and UTF-8 cannot encode
+INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+
+class StreamError(Exception):
+    pass
+
+
+def escape(text):
+    if INVALID_XML.search(text):
+        raise StreamError(f"Text contains characters not allowed in XML: {text!r}")
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def unescape(text):
+    return text.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+
+
+def text_element(text):
+    if len(text.strip()) < len(text):
+        return f'<w:t xml:space="preserve">{escape(text)}</w:t>'
+    return f'<w:t>{escape(text)}</w:t>'
+
+
+def run_content(text):
+    # The elements Run.text = text appends inside w:r
+    parts = []
+    for piece in re.split(r'([\t\r\n])', text):
+        if piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece in ('\r', '\n'):
+            parts.append('<w:br/>')
+        elif piece:
+            parts.append(text_element(piece))
+    return ''.join(parts)
+
+
+class Template:
+    # A piece of serialized WordprocessingML with slots: each w:t whose text
+    # contains slot markers is rendered again from that text, with every marker
+    # replaced by the text given for it. A marker can fill several slots, and a
+    # slot can hold static text around its markers ("{marker} Record").
+
+    def __init__(self, xml, markers):
+        self.index = {marker: i for i, marker in enumerate(markers)}
+        self.pattern = re.compile('|'.join(map(re.escape, markers))) if markers else None
+        self.pieces = []
+        self.slots = []
+        start = 0
+        if self.pattern is not None:
+            for match in re.finditer('<w:t(?: xml:space="preserve")?>([^<]*)</w:t>', xml):
+                text = unescape(match.group(1))
+                if not self.pattern.search(text):
+                    continue
+                self.pieces.append(xml[start:match.start()])
+                # A slot holding nothing but a marker is filled without a substitution
+                self.slots.append(self.index.get(text, text))
+                start = match.end()
+        self.pieces.append(xml[start:])
+
+    def render(self, *texts):
+        parts = [self.pieces[0]]
+        for slot, piece in zip(self.slots, self.pieces[1:]):
+            if isinstance(slot, int):
+                text = texts[slot]
+            else:
+                text = self.pattern.sub(lambda match: texts[self.index[match.group()]], slot)
+            content = run_content(text)
+            if not content and piece.startswith('</w:r>'):
+                # The run of an empty text is left out, with its properties
+                start = max(parts[-1].rfind('<w:r>'), parts[-1].rfind('<w:r '))
+                if start >= 0 and '</w:r>' not in parts[-1][start:]:
+                    parts[-1] = parts[-1][:start]
+                    piece = piece[len('</w:r>'):]
+            parts.append(content)
+            parts.append(piece)
+        return ''.join(parts)
+
+
+class TextTemplate:
+    # Any other XML part (docProps/core.xml): the markers are replaced by the
+    # escaped texts wherever they are
+
+    def __init__(self, xml, markers):
+        self.index = {marker: i for i, marker in enumerate(markers)}
+        self.pieces = re.split('(' + '|'.join(map(re.escape, markers)) + ')', xml)
+
+    def render(self, *texts):
+        return ''.join(escape(texts[self.index[piece]]) if i % 2 else piece for i, piece in enumerate(self.pieces))
+
+
+def element_span(xml, tag, position):
+    # (start, end) of the innermost <tag>...</tag> around position; the
+    # elements cut out here (w:p, w:tr, w:tbl) are never nested in themselves
+    start = max(xml.rfind(f'<{tag}>', 0, position), xml.rfind(f'<{tag} ', 0, position))
+    end = xml.find(f'</{tag}>', position)
+    if start < 0 or end < 0:
+        raise StreamError(f"No <{tag}> around offset {position}")
+    return start, end + len(tag) + 3
+
+
+def first_element(xml, tag):
+    # Offset of the first <tag> of xml, with or without attributes (Word
+    # writes <w:tr w:rsidR="...">, python-docx a bare <w:tr>)
+    match = re.search(f'<{tag}[ >]', xml)
+    if match is None:
+        raise StreamError(f"No <{tag}> found")
+    return match.start()
+
+
+def elements(xml, tag):
+    # Consecutive top-level <tag> elements of xml
+    return re.findall(f'<{tag}(?:>| [^>]*>).*?</{tag}>', xml, re.S)
+
+
+def buffered(chunks, size=CHUNK_SIZE):
+    # Small chunks (a table row each) joined into blocks of about size bytes
+    block = []
+    length = 0
+    for chunk in chunks:
+        block.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(block).encode('utf-8')
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block).encode('utf-8')
+
+
+class Skeleton:
+    # A .docx saved by python-docx. Its parts are copied into every streamed
+    # document as they are, still compressed; only the parts a document replaces
+    # (always the main part) are compressed again, from the chunks they are
+    # written as.
+
+    def __init__(self, data):
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+            self.entries = archive.infolist()
+            self.central = archive.start_dir
+            self.parts = {info.filename: archive.read(info.filename) for info in self.entries}
+            self.document = self.parts[DOCUMENT_PART].decode('utf-8')
+        except (zipfile.BadZipFile, KeyError, OSError) as e:
+            raise StreamError(f"Invalid skeleton document: {e}")
+        for info in self.entries:
+            if info.flag_bits & 0x08:
+                raise StreamError(f"Unsupported zip entry in skeleton document: {info.filename}")
+        self.data = data
+
+    def write(self, path, parts):
+        # Write the document to path with the parts in parts (name -> chunks of
+        # str) compressed as they arrive, the others copied, and every entry dated
+        # 1980-01-01 00:00 like normalized python-docx output. Returns the size of
+        # the file.
+        data = self.data
+        offsets = []
+        replaced = {}
+        with open(path, 'wb') as f:
+            for info in self.entries:
+                offsets.append(f.tell())
+                name_length, extra_length = struct.unpack_from('<HH', data, info.header_offset + 26)
+                start = info.header_offset + 30 + name_length + extra_length
+                header = bytearray(data[info.header_offset:start])
+                struct.pack_into('<HH', header, 10, 0, DOS_EPOCH_DATE)
+                f.write(header)
+                if info.filename not in parts:
+                    f.write(data[start:start + info.compress_size])
+                    continue
+                if info.compress_type != zipfile.ZIP_DEFLATED:
+                    raise StreamError(f"Replaced part is not deflated in skeleton document: {info.filename}")
+                # As zipfile compresses: raw deflate at the default level
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+                crc = size = compressed_size = 0
+                for chunk in buffered(parts[info.filename]):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    compressed = compressor.compress(chunk)
+                    compressed_size += len(compressed)
+                    f.write(compressed)
+                compressed = compressor.flush()
+                compressed_size += len(compressed)
+                f.write(compressed)
+                if size > 0xffffffff or compressed_size > 0xffffffff:
+                    raise StreamError(f"{info.filename} too large for a zip entry without ZIP64")
+                replaced[info.filename] = struct.pack('<III', crc, compressed_size, size)
+                end = f.tell()
+                f.seek(offsets[-1] + 14)
+                f.write(replaced[info.filename])
+                f.seek(end)
+
+            central_start = f.tell()
+            position = self.central
+            for info, offset in zip(self.entries, offsets):
+                name_length, extra_length, comment_length = struct.unpack_from('<HHH', data, position + 28)
+                record = bytearray(data[position:position + 46 + name_length + extra_length + comment_length])
+                struct.pack_into('<HH', record, 12, 0, DOS_EPOCH_DATE)
+                if info.filename in replaced:
+                    record[16:28] = replaced[info.filename]
+                struct.pack_into('<I', record, 42, offset)
+                f.write(record)
+                position += len(record)
+            end_record = bytearray(data[position:])
+            struct.pack_into('<II', end_record, 12, f.tell() - central_start, central_start)
+            f.write(end_record)
+            return f.tell()
+
+
+class StreamedDocument:
+    # A document that is only ever written out: parts() maps the name of each
+    # part it replaces to the chunks of that part, the main part among them
+
+    def __init__(self, skeleton, parts):
+        self.skeleton = skeleton
+        self.parts = parts
+
+    def save(self, path):
+        return self.skeleton.write(path, self.parts())
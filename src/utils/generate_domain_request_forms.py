@@ -1,575 +1,2245 @@
 import argparse
-import requests
-from docx import Document
-from docx.shared import Pt, Inches, RGBColor
-from docx.oxml import OxmlElement, parse_xml
-from docx.oxml.ns import qn
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+import hashlib
+import io
+import json
 import os
-from datetime import datetime
-from dotenv import load_dotenv
+import shutil
+import socket
+import socketserver
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import sys
-import subprocess
+import tempfile
+import threading
+import struct
+import time
+import zipfile
+
+import form_cache
+import form_converter
+import form_export
+import form_http
+import form_metrics
+import form_optimize
+import form_pdf
+import form_source
+import form_stream
+
+# requests, python-docx (and with it lxml), python-dotenv, concurrent.futures
+# and sqlite3 are imported by the functions that need them: the API starts a new
+# interpreter per request, and a cached, native PDF or queue-only run should
+# not pay for loading them.
+
+DOCUMENT_VERSION = '2.1'
+
+# docx: python-docx documents converted by LibreOffice; pdf: drawn directly by form_pdf
+BACKENDS = ('docx', 'pdf')
+
+# --prewarm waits this many seconds for further edits before rendering, and
+# runs at this niceness (FORM_PREWARM_DELAY, FORM_PREWARM_NICE)
+DEFAULT_PREWARM_DELAY = 2
+DEFAULT_PREWARM_NICE = 10
+
+# In the zipapp built by build_form_generator.py the modules are inside the
+# archive, which sits in src/utils next to this file
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if os.path.isfile(script_dir):
+    script_dir = os.path.dirname(script_dir)
+project_root = os.path.abspath(os.path.join(script_dir, '../'))
+media_root = os.path.join(project_root, 'public/media/domain-request/forms/')
+cache_root = os.path.join(project_root, '../.cache/domain-request-forms/')
+queue_path = os.path.join(project_root, '../.cache/form-queue.sqlite3')
+
+# Where summaries are read from unless one is passed in (see --source)
+data_source = form_source.ApiSource()
+
+
+class FormGenerationError(Exception):
+    pass
+
 
 def print_and_log(message):
     print(message)
     sys.stdout.flush()
 
-def convert_to_pdf(docx_path, pdf_path):
+def convert_to_pdf(docx_path, pdf_path, converter_pool=None):
+    # Uses the given pool, or the warm converter server when SOFFICE_POOL_SOCKET
+    # points at one, otherwise falls back to a one-shot LibreOffice process
     try:
-        # Redirect stdout and stderr to /dev/null to suppress output
-        with open(os.devnull, 'w') as devnull:
-            subprocess.run(
-                ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', os.path.dirname(pdf_path), docx_path],
-                check=True,
-                stdout=devnull,  # Suppress standard output
-                stderr=devnull   # Suppress standard error
-            )
-    except subprocess.CalledProcessError as e:
-        print_and_log(f"Failed to convert {docx_path} to PDF: {e}")
-        sys.exit(1)
+        form_converter.convert(docx_path, pdf_path, converter_pool)
+    except form_converter.ConversionError as e:
+        raise FormGenerationError(str(e))
 
 
-# Load environment variables from .env file
-load_dotenv()
-gov_lk_host = os.getenv('GOV_LK_HOST')
-
-# Parse command-line arguments for the request token
-parser = argparse.ArgumentParser(description='Generate a domain registration form.')
-parser.add_argument('-t', '--token', required=True, help='Request token for the API')
-args = parser.parse_args()
-request_token = args.token
-
-# Fetch data from the API
-try:
-    url = f"{gov_lk_host}/api/request/get-summary?requestToken={request_token}"
-    response = requests.get(url)
-    response.raise_for_status()  # Check for HTTP errors
-    data = response.json()['data']
-except requests.exceptions.RequestException as e:
-    print_and_log(f"Failed to fetch data from API: {e}")
-    sys.exit(1)
-
-# Extract the necessary information
-request_id = data["request_id"]
-site_code = data["site_code"]
-organization_name = data["organization_name"]
-address = data["address"]
-email = data["email"]
-contact_no = data["contact_no"]
-org_head_name = data["organization_head"]["full_name"]
-org_head_designation = data["organization_head"]["designation"]
-requested_domains = data["requested_domains"]
-administrator_name = data["administrator"]["full_name"]
-administrator_designation = data["administrator"]["designation"]
-hosting_provider = data["hosting_provider"]
-hosting_coordinator = data["hosting_coordinator"]
-domains_list = ', '.join([domain['fqdn'] for domain in requested_domains])
-
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
-media_root = os.path.join(project_root, 'public/media/domain-request/forms/')
-if not os.path.exists(media_root):
+def convert_all_to_pdf(pairs, converter_pool=None):
+    # Hands every (docx_path, pdf_path) pair to the converter in a single call
     try:
-        os.makedirs(media_root)
-    except Exception as e:
-        print_and_log(f"Failed to create media directory: {e}")
-        sys.exit(1)
+        form_converter.convert_many(pairs, converter_pool)
+    except (form_converter.ConversionError, OSError) as e:
+        raise FormGenerationError(str(e))
+
+
+def fetch_summary(request_token, gov_lk_host=None):
+    # From the configured data source (--source): the get-summary API through
+    # the shared keep-alive session (form_http), or the database directly
+    source = form_source.ApiSource(gov_lk_host) if gov_lk_host else data_source
+    try:
+        return source.summary(request_token)
+    except form_source.SourceError as e:
+        raise FormGenerationError(str(e))
+
+
+def prefetch_summaries(request_tokens, on_fetched):
+    # Fetches many summaries concurrently (FORM_PREFETCH_CONCURRENCY at a time)
+    # and calls on_fetched(token, summary, error) as each one arrives
+    def fetch(request_token):
+        with form_metrics.stage("fetch"):
+            return fetch_summary(request_token)
+
+    concurrency = int(os.getenv('FORM_PREFETCH_CONCURRENCY', form_http.DEFAULT_PREFETCH_CONCURRENCY))
+    form_http.prefetch(fetch, request_tokens, on_fetched, concurrency)
+
+
+def unwrap_summary(payload):
+    # Accept either the summary itself or the full get-summary response body
+    if isinstance(payload, dict) and 'data' in payload and 'request_id' not in payload:
+        payload = payload['data']
+    if not isinstance(payload, dict) or 'request_id' not in payload:
+        raise FormGenerationError("Summary payload is missing request_id")
+    return payload
+
 
-# Create the Request Form Document
-doc = Document()
+def load_summary(path):
+    # Read a summary payload from a JSON file, or from stdin when path is '-'
+    try:
+        if path == '-':
+            payload = json.load(sys.stdin)
+        else:
+            with open(path) as f:
+                payload = json.load(f)
+    except (OSError, ValueError) as e:
+        raise FormGenerationError(f"Failed to read summary payload: {e}")
+    return unwrap_summary(payload)
+
+
+_template_bytes = None
+
+def new_document():
+    # The form styles are added to python-docx's default template once and the
+    # result is kept in memory, so every document starts with them defined and
+    # long-running workers do not reopen the template from disk
+    from docx import Document
+
+    global _template_bytes
+    if _template_bytes is None:
+        template = Document()
+        add_form_styles(template)
+        buffer = io.BytesIO()
+        template.save(buffer)
+        _template_bytes = buffer.getvalue()
+    return Document(io.BytesIO(_template_bytes))
+
+
+TABLE_BORDERS_XML = (
+    '<w:tblPr %s><w:tblBorders>'
+    '<w:top w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:left w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:bottom w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:right w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:insideH w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:insideV w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '</w:tblBorders></w:tblPr>'
+)
 
-# Set margins to narrow (0.5 inches from all sides)
-sections = doc.sections
-for section in sections:
+
+def add_form_styles(doc):
+    # Named styles used by both documents; content only refers to them by id
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+    from docx.shared import Pt
+
+    styles = doc.styles
+
+    # Base for everything in the forms: no space after paragraphs
+    body = styles.add_style('FormBody', WD_STYLE_TYPE.PARAGRAPH)
+    body.base_style = styles['Normal']
+    body.paragraph_format.space_after = Pt(0)
+
+    # Text inside table cells
+    cell = styles.add_style('FormCell', WD_STYLE_TYPE.PARAGRAPH)
+    cell.base_style = body
+    cell.font.name = 'Calibri'
+    cell.font.size = Pt(11)
+    cell.paragraph_format.space_before = Pt(0)
+
+    # Section headings
+    heading = styles.add_style('FormHeading', WD_STYLE_TYPE.PARAGRAPH)
+    heading.base_style = body
+    heading.font.name = 'Calibri'
+    heading.font.size = Pt(14)
+    heading.font.bold = True
+
+    # Role and domain titles, kept on the same page as the table below them
+    subheading = styles.add_style('FormSubheading', WD_STYLE_TYPE.PARAGRAPH)
+    subheading.base_style = heading
+    subheading.font.size = Pt(12)
+    subheading.paragraph_format.keep_with_next = True
+
+    # Cover letter paragraphs
+    letter = styles.add_style('FormLetter', WD_STYLE_TYPE.PARAGRAPH)
+    letter.base_style = body
+    letter.paragraph_format.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+
+    strong = styles.add_style('FormStrong', WD_STYLE_TYPE.CHARACTER)
+    strong.font.bold = True
+
+    # Single-line borders around and between all cells
+    table = styles.add_style('FormTable', WD_STYLE_TYPE.TABLE)
+    table.base_style = styles['Normal Table']
+    table.element.append(parse_xml(TABLE_BORDERS_XML % nsdecls('w')))
+
+
+def set_narrow_margins(section, footer_text):
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.shared import Inches, Pt, RGBColor
+
+    # Set margins to narrow (0.5 inches from all sides)
     section.left_margin = Inches(0.5)
     section.right_margin = Inches(0.5)
     section.top_margin = Inches(0.5)
     section.bottom_margin = Inches(0.5)
 
-    # Add footer with request token and document version
+    # Add footer
     footer = section.footer.paragraphs[0] if section.footer.paragraphs else section.footer.add_paragraph()
     footer.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    footer_text = footer.add_run(f"Request Token: {request_token} | Document Version: 2.1")
-    footer_text.font.size = Pt(9)
-    footer_text.font.color.rgb = RGBColor(0, 0, 0)
-
-# Add centered title
-title = doc.add_paragraph()
-title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-run = title.add_run(f"Domain Registration Form | Request ID - {request_id}")
-run.font.name = 'Calibri'
-run.font.size = Pt(14)
-run.bold = True
-title.add_run().add_break()
-title.paragraph_format.line_spacing = None  # Ensure no line spacing
-title.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add "Organization Information" heading
-heading = doc.add_paragraph()
-run = heading.add_run("Organization Information")
-run.font.name = 'Calibri'
-run.font.size = Pt(14)
-run.bold = True
-heading.paragraph_format.line_spacing = None  # Ensure no line spacing
-heading.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add Organization Table with 6 rows (one for each data field) and 2 columns
-org_table = doc.add_table(rows=6, cols=2)
-
-# Define the data field names and corresponding data
-field_names = ["Organization Name", "Address", "Email", "Contact No", "Organization Head", "Organization Head Designation"]
-field_data = [
-    organization_name,
-    address,
-    email,
-    str(contact_no),
-    org_head_name,
-    org_head_designation
-]
-
-# Set table width to span the full width of the page minus the margins
-table_width = doc.sections[0].page_width - doc.sections[0].left_margin - doc.sections[0].right_margin
-col_widths = [table_width * 0.30, table_width * 0.70]
-
-# Set column widths and populate the table with field names and data
-for row_idx in range(6):
-    row = org_table.rows[row_idx]
-    for idx, width in enumerate(col_widths):
-        cell = row.cells[idx]
-        cell.width = width
-        if idx == 0:
-            cell.text = field_names[row_idx]
+    footer_run = footer.add_run(footer_text)
+    footer_run.font.size = Pt(9)
+    footer_run.font.color.rgb = RGBColor(0, 0, 0)
+
+
+def add_table(doc, rows, cols):
+    table = doc.add_table(rows=rows, cols=cols)
+    table._tbl.tblPr.style = 'FormTable'
+    return table
+
+
+class DocumentEnd:
+    # Stands in for the document in add_styled_paragraph and add_table when a
+    # section adds a heading and a table per domain. doc.add_paragraph() and
+    # doc.add_table() find the final section properties, and the block width,
+    # by scanning the whole body on every call, which made the DNS records
+    # section quadratic in the number of domains; both are looked up once here.
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.sectPr = doc.element.body.sectPr
+        self.width = doc._block_width
+
+    def insert(self, element):
+        if self.sectPr is not None:
+            self.sectPr.addprevious(element)
         else:
-            cell.text = field_data[row_idx]
-        for paragraph in cell.paragraphs:
-            paragraph.paragraph_format.line_spacing = None
-            paragraph.paragraph_format.space_before = Pt(0)
-            paragraph.paragraph_format.space_after = Pt(0)
-            for run in paragraph.runs:
-                run.font.name = 'Calibri'
-                run.font.size = Pt(11)
-
-# Function to set borders for a table
-def set_table_borders(table):
-    tbl = table._tbl  # Get the table xml element
-    tblPr = tbl.tblPr if tbl.tblPr is not None else OxmlElement('w:tblPr')
-    tblBorders = OxmlElement('w:tblBorders')
-    
-    border_values = {
-        'top': {"val": "single", "sz": "4", "space": "0", "color": "auto"},
-        'left': {"val": "single", "sz": "4", "space": "0", "color": "auto"},
-        'bottom': {"val": "single", "sz": "4", "space": "0", "color": "auto"},
-        'right': {"val": "single", "sz": "4", "space": "0", "color": "auto"},
-        'insideH': {"val": "single", "sz": "4", "space": "0", "color": "auto"},
-        'insideV': {"val": "single", "sz": "4", "space": "0", "color": "auto"},
-    }
+            self.doc.element.body.append(element)
+
+    def add_paragraph(self, style=None):
+        from docx.oxml import OxmlElement
+        from docx.text.paragraph import Paragraph
+
+        paragraph = Paragraph(OxmlElement('w:p'), self.doc._body)
+        self.insert(paragraph._p)
+        if style is not None:
+            paragraph.style = style
+        return paragraph
+
+    def add_table(self, rows, cols):
+        from docx.oxml.table import CT_Tbl
+        from docx.table import Table
+
+        table = Table(CT_Tbl.new_tbl(rows, cols, self.width), self.doc._body)
+        self.insert(table._tbl)
+        return table
+
+
+def table_row_adder(table):
+    # Table.add_row() for tables that grow to thousands of rows: add_row() looks
+    # up the table grid on every call, a search that takes longer the more rows
+    # the table has, so the grid is read once here
+    from docx.table import _Cell
+
+    widths = [gridCol.w for gridCol in table._tbl.tblGrid.gridCol_lst]
+
+    def add_row():
+        tr = table._tbl.add_tr()
+        cells = []
+        for width in widths:
+            tc = tr.add_tc()
+            if width is not None:
+                tc.width = width
+            cells.append(_Cell(tc, table))
+        return cells
+
+    return add_row
+
+
+def set_column_widths(table, col_widths):
+    # Set the table grid and every cell width in one pass over the rows
+    from docx.shared import Emu
+
+    for gridCol, width in zip(table._tbl.tblGrid.gridCol_lst, col_widths):
+        gridCol.w = Emu(int(width))
+    for tr in table._tbl.tr_lst:
+        for tc, width in zip(tr.tc_lst, col_widths):
+            tc.width = width
+
+
+def merge_column_cells(cells):
+    # Vertically merge cells of one column by marking them with w:vMerge directly.
+    # _Cell.merge() re-walks the whole table on every call, which made large DNS
+    # tables quadratic; the merged cells here are empty so no content needs moving.
+    if len(cells) < 2:
+        return
+    cells[0]._tc.vMerge = 'restart'
+    for cell in cells[1:]:
+        cell._tc.vMerge = 'continue'
+
+
+def set_cell_text(cell, text, bold=False, style='FormCell'):
+    # New cells hold a single empty paragraph; style it and add the text run.
+    # Empty text gets no run, as in add_styled_paragraph and the cover letter.
+    p = cell._tc.p_lst[0]
+    p.style = style
+    if not text:
+        return
+    r = p.add_r()
+    r.text = text
+    if bold:
+        r.style = 'FormStrong'
+
+
+def add_styled_paragraph(container, text='', style='FormBody', bold=False):
+    paragraph = container.add_paragraph(style=None)
+    paragraph._p.style = style
+    if text:
+        run = paragraph.add_run(text)
+        if bold:
+            run._r.style = 'FormStrong'
+    return paragraph
+
+
+def add_line_break(doc):
+    add_styled_paragraph(doc)
+
+
+def add_heading(doc, text, sub=False):
+    return add_styled_paragraph(doc, text, 'FormSubheading' if sub else 'FormHeading')
+
+
+# The content of each section, shared by the docx and the native PDF backends
+
+def organization_rows(summary):
+    field_names = ["Organization Name", "Address", "Email", "Contact No", "Organization Head", "Organization Head Designation"]
+    field_data = [
+        summary["organization_name"],
+        summary["address"],
+        summary["email"],
+        str(summary["contact_no"]),
+        summary["organization_head"]["full_name"],
+        summary["organization_head"]["designation"]
+    ]
+    return list(zip(field_names, field_data))
 
-    for border_name, border_attrs in border_values.items():
-        border = OxmlElement(f'w:{border_name}')
-        for attr_name, attr_value in border_attrs.items():
-            border.set(qn(f'w:{attr_name}'), attr_value)
-        tblBorders.append(border)
-
-    tblPr.append(tblBorders)
-    if tbl.tblPr is None:
-        tbl.append(tblPr)
-
-# Apply table borders
-set_table_borders(org_table)
-
-# Add a line break after the "Organization Information" table
-line_break = doc.add_paragraph()
-line_break.paragraph_format.line_spacing = None  # Ensure no line spacing
-line_break.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add "Requesting Domain(s)" heading
-domain_heading = doc.add_paragraph()
-run = domain_heading.add_run("Requesting Domain(s)")
-run.font.name = 'Calibri'
-run.font.size = Pt(14)
-run.bold = True
-domain_heading.paragraph_format.line_spacing = None  # Ensure no line spacing
-domain_heading.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add Requesting Domains Table with 2 columns: Domain and Reason
-domain_table = doc.add_table(rows=1, cols=2)
-domain_table.autofit = False
-
-# Set header row
-hdr_cells = domain_table.rows[0].cells
-hdr_cells[0].text = 'Domain'
-hdr_cells[1].text = 'Reason'
-for cell in hdr_cells:
-    for paragraph in cell.paragraphs:
-        paragraph.paragraph_format.line_spacing = None
-        paragraph.paragraph_format.space_before = Pt(0)
-        paragraph.paragraph_format.space_after = Pt(0)
-        for run in paragraph.runs:
-            run.font.name = 'Calibri'
-            run.font.size = Pt(11)
-            run.bold = True
-
-# Populate the table with domain and reason
-for domain in requested_domains:
-    row_cells = domain_table.add_row().cells
-    row_cells[0].text = domain['fqdn']
-    row_cells[1].text = domain['reason']
 
-    # Set column widths
-    for row in domain_table.rows:
-        row.cells[0].width = col_widths[0]
-        row.cells[1].width = col_widths[1]
-
-    for cell in row_cells:
-        for paragraph in cell.paragraphs:
-            paragraph.paragraph_format.line_spacing = None  # Ensure default line spacing
-            paragraph.paragraph_format.space_before = Pt(0)
-            paragraph.paragraph_format.space_after = Pt(0)
-            for run in paragraph.runs:
-                run.font.name = 'Calibri'
-                run.font.size = Pt(11)
-
-# Apply table borders
-set_table_borders(domain_table)
-
-# Add a line break after the "Requesting Domain(s)" table
-line_break = doc.add_paragraph()
-line_break.paragraph_format.line_spacing = None  # Ensure no line spacing
-line_break.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add "Contact Information" heading
-contact_heading = doc.add_paragraph()
-run = contact_heading.add_run("Contact Information")
-run.font.name = 'Calibri'
-run.font.size = Pt(14)
-run.bold = True
-contact_heading.paragraph_format.line_spacing = None  # Ensure no line spacing
-contact_heading.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
+def contact_sections(summary):
+    roles = ["Administrator Contact", "Technical Contact", "Content Developer", "Hosting Coordinator"]
+    users = [summary["administrator"], summary["technical_contact"], summary["content_developer"], summary["hosting_coordinator"]]
+    hostings = [None, None, None, summary["hosting_provider"]]
+    return list(zip(roles, users, hostings))
 
-# Function to create user table
-def add_user_table(doc, role, user_data, hosting_provider=None):
-    # Add role title
-    role_title = doc.add_paragraph()
-    role_title.keep_with_next = True  # Keep this paragraph on the same page as the next
-    run = role_title.add_run(role)
-    run.font.name = 'Calibri'
-    run.font.size = Pt(12)
-    run.bold = True
-    role_title.paragraph_format.line_spacing = None  # Ensure no line spacing
-    role_title.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-    
-    # Create table
-    user_table = doc.add_table(rows=0, cols=2)
-    user_table.autofit = False
-    
-    # Add user data to the table, excluding 'id' and modifying parameter names
-    user_data_mod = { 
+
+def user_rows(user_data, hosting_provider=None):
+    # Excluding 'id' and modifying parameter names
+    user_data_mod = {
         "Full Name": user_data.get("full_name"),
         "NIC No": user_data.get("nic"),
         "Mobile": user_data.get("mobile"),
         "Email": user_data.get("email"),
         "Designation": user_data.get("designation")
     }
-    
-    for key, value in user_data_mod.items():
-        if value is not None:  # Only add rows for parameters that exist
-            row_cells = user_table.add_row().cells
-            row_cells[0].text = key
-            row_cells[1].text = str(value)
-            for cell in row_cells:
-                for paragraph in cell.paragraphs:
-                    paragraph.paragraph_format.line_spacing = None  # Ensure default line spacing
-                    paragraph.paragraph_format.space_before = Pt(0)
-                    paragraph.paragraph_format.space_after = Pt(0)
-                    for run in paragraph.runs:
-                        run.font.name = 'Calibri'
-                        run.font.size = Pt(11)
-    
+
+    # Only add rows for parameters that exist
+    rows = [(key, str(value)) for key, value in user_data_mod.items() if value is not None]
     if hosting_provider:
+        rows.append(("Hosting Place", hosting_provider))
+    return rows
+
+
+def dns_record_groups(domain):
+    # [(record type, [(field, value), ...]), ...] in first-seen type order
+    records = {}
+    for record in domain['dns_records']:
+        record_type = record['type']
+        if record_type not in records:
+            records[record_type] = []
+        record_details = []
+        for k, v in record.items():
+            if k not in ('dns_record_id', 'type_record_id', 'id', 'type'):
+                record_details.append((k, v))
+        records[record_type].extend(record_details)
+    return list(records.items())
+
+
+def request_form_footer(request_token):
+    return f"Request Token: {request_token} | Document Version: {DOCUMENT_VERSION}"
+
+
+def cover_letter_footer(request_token):
+    return f"Request Token: {request_token}"
+
+
+def cover_letter_paragraphs(summary, letter_date=None):
+    # Each paragraph is a list of (text, bold) runs
+    org_head_name = summary["organization_head"]["full_name"]
+    org_head_designation = summary["organization_head"]["designation"]
+    administrator_name = summary["administrator"]["full_name"]
+    administrator_designation = summary["administrator"]["designation"]
+    domains_list = ', '.join([domain['fqdn'] for domain in summary["requested_domains"]])
+
+    paragraphs = [
+        "",
+        "",
+        "",
+        "",
+        letter_date or today(),
+        "Hostmaster,",
+        "Gov.lk Domain Registry,",
+        "Network Operation Center,",
+        "Information and Communication Technology Agency of Sri Lanka,",
+        "490, R.A.DeMelMawatha,",
+        "Colombo 03,",
+        "Sri Lanka",
+        "",
+        "Request for the Domain Registration / Modification of domain(s) {},",
+        "I hereby confirm that the information in the attached domain registration / modification form is accurate, "
+        "and the request has been made for official purposes only. Please note that "
+        "{} who is the {} of this organization will be the authorized officer "
+        "for this request and you may contact him/her pertaining to this request in the future.",
+        "Thank You.",
+        "",
+        "",
+        "",
+        "_______________________________",
+        org_head_name,
+        org_head_designation,
+        summary["organization_name"]
+    ]
+
+    result = []
+    for para in paragraphs:
+        if para == "Request for the Domain Registration / Modification of domain(s) {},":
+            result.append([(para.format(domains_list), True)])
+        elif para.startswith("I hereby confirm that the information"):
+            text_parts = para.split("{}")
+            result.append([
+                (text_parts[0], False),
+                (administrator_name, True),
+                (text_parts[1], False),
+                (administrator_designation, False),
+                (text_parts[2], False),
+            ])
+        else:
+            result.append([(para, False)] if para else [])
+    return result
+
+
+# Function to create user table
+def add_user_table(doc, role, user_data, col_widths, hosting_provider=None):
+    # Add role title
+    add_heading(doc, role, sub=True)
+
+    # Create table
+    user_table = add_table(doc, rows=0, cols=2)
+    user_table.autofit = False
+
+    # Add user data to the table
+    for key, value in user_rows(user_data, hosting_provider):
         row_cells = user_table.add_row().cells
-        row_cells[0].text = "Hosting Place"
-        row_cells[1].text = hosting_provider
-        for cell in row_cells:
-            for paragraph in cell.paragraphs:
-                paragraph.paragraph_format.line_spacing = None  # Ensure default line spacing
-                paragraph.paragraph_format.space_before = Pt(0)
-                paragraph.paragraph_format.space_after = Pt(0)
-                for run in paragraph.runs:
-                    run.font.name = 'Calibri'
-                    run.font.size = Pt(11)
-    
+        set_cell_text(row_cells[0], key)
+        set_cell_text(row_cells[1], value)
+
     # Set column widths
-    for row in user_table.rows:
-        row.cells[0].width = col_widths[0]
-        row.cells[1].width = col_widths[1]
-    
-    # Apply table borders
-    set_table_borders(user_table)
-    
-    # Add a line break after the table
-    line_break = doc.add_paragraph()
-    line_break.paragraph_format.line_spacing = None  # Ensure no line spacing
-    line_break.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
+    set_column_widths(user_table, col_widths)
 
-# Add user tables for each role
-roles = ["Administrator Contact", "Technical Contact", "Content Developer", "Hosting Coordinator"]
-users = [data["administrator"], data["technical_contact"], data["content_developer"], data["hosting_coordinator"]]
-hostings = [None, None, None, hosting_provider]
+    # Add a line break after the table
+    add_line_break(doc)
 
-for role, user, hosting in zip(roles, users, hostings):
-    add_user_table(doc, role, user, hosting)
 
 # Function to add DNS records tables
 def add_dns_records(doc, domains):
-    dns_heading = doc.add_paragraph()
-    dns_heading.keep_with_next = True  # Keep this paragraph on the same page as the next
-    run = dns_heading.add_run("DNS Records")
-    run.font.name = 'Calibri'
-    run.font.size = Pt(14)
-    run.bold = True
-    dns_heading.paragraph_format.line_spacing = None  # Ensure no line spacing
-    dns_heading.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+
+    end = DocumentEnd(doc)
+    add_heading(end, "DNS Records").paragraph_format.keep_with_next = True
 
     for domain in domains:
-        domain_title = doc.add_paragraph()
-        domain_title.keep_with_next = True  # Keep this paragraph on the same page as the next
-        run = domain_title.add_run(domain['fqdn'])
-        run.font.name = 'Calibri'
-        run.font.size = Pt(12)
-        run.bold = True
-        domain_title.paragraph_format.line_spacing = None  # Ensure no line spacing
-        domain_title.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-        dns_table = doc.add_table(rows=0, cols=3)
+        add_heading(end, domain['fqdn'], sub=True)
+
+        dns_table = add_table(end, rows=0, cols=3)
         dns_table.autofit = False
+        add_row = table_row_adder(dns_table)
+
+        for record_type, values in dns_record_groups(domain):
+            # Keep the new rows' cells instead of re-indexing the table for each value
+            row_cells = [add_row() for _ in range(max(len(values), 1))]
+            type_cell = row_cells[0][0]
+            set_cell_text(type_cell, f"{record_type} Record", bold=True, style='Normal')
+            type_cell.paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            type_cell.vertical_alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+            for cells, (key, value) in zip(row_cells, values):
+                set_cell_text(cells[1], key)
+                set_cell_text(cells[2], str(value))
+
+            merge_column_cells([cells[0] for cells in row_cells])
+
+
+def build_request_form(summary, request_token, doc=None, letter_date=None):
+    from docx.enum.section import WD_SECTION
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+
+    request_id = summary["request_id"]
+    org_head_name = summary["organization_head"]["full_name"]
+    org_head_designation = summary["organization_head"]["designation"]
+    administrator_name = summary["administrator"]["full_name"]
+    administrator_designation = summary["administrator"]["designation"]
+    requested_domains = summary["requested_domains"]
+
+    # Create the Request Form Document, or continue an existing one (the cover
+    # letter) in a new section on a new page with its own footer
+    if doc is None:
+        doc = new_document()
+        set_core_properties(doc, summary, letter_date)
+        section = doc.sections[0]
+    else:
+        section = doc.add_section(WD_SECTION.NEW_PAGE)
+        section.footer.is_linked_to_previous = False
 
-        records = {}
-        for record in domain['dns_records']:
-            record_type = record['type']
-            if record_type not in records:
-                records[record_type] = []
-            record_details = []
-            for k, v in record.items():
-                if k not in ('dns_record_id', 'type_record_id', 'id', 'type'):
-                    record_details.append((k, v))
-            records[record_type].extend(record_details)
-
-        for record_type, values in records.items():
-            num_values = len(values)
-            row_cells = dns_table.add_row().cells
-            row_cells[0].text = f"{record_type} Record"
-            row_cells[0].paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            row_cells[0].vertical_alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            row_cells[0].paragraphs[0].runs[0].bold = True
-
-            for i in range(1, num_values):
-                dns_table.add_row().cells
-
-            for idx, (key, value) in enumerate(values):
-                dns_table.rows[-num_values + idx].cells[1].text = key
-                dns_table.rows[-num_values + idx].cells[2].text = str(value)
-                for cell in dns_table.rows[-num_values + idx].cells[1:]:
-                    for paragraph in cell.paragraphs:
-                        paragraph.paragraph_format.line_spacing_rule = None  # Ensure default line spacing
-                        paragraph.paragraph_format.space_before = Pt(0)
-                        paragraph.paragraph_format.space_after = Pt(0)
-                        for run in paragraph.runs:
-                            run.font.name = 'Calibri'
-                            run.font.size = Pt(11)
-
-            merged_cell = dns_table.cell(-num_values, 0)
-            for i in range(1, num_values):
-                merged_cell.merge(dns_table.cell(-num_values + i, 0))
-
-        set_table_borders(dns_table)
-
-# Add DNS Records section
-add_dns_records(doc, requested_domains)
-
-# Add a line break after the DNS Records section
-line_break = doc.add_paragraph()
-line_break.paragraph_format.line_spacing = None  # Ensure no line spacing
-line_break.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add the "Confirmation Seal & Signature" title
-confirmation_title = doc.add_paragraph()
-run = confirmation_title.add_run("Confirmation Seal & Signature")
-run.font.name = 'Calibri'
-run.font.size = Pt(14)
-run.bold = True
-confirmation_title.paragraph_format.line_spacing = None  # Ensure no line spacing
-confirmation_title.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add a line break before the confirmation text
-line_break = doc.add_paragraph()
-line_break.paragraph_format.line_spacing = None  # Ensure no line spacing
-line_break.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add the confirmation text
-confirmation_text = doc.add_paragraph()
-confirmation_text.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-confirmation_text.keep_with_next = True  # Keep this paragraph on the same page as the next
-run = confirmation_text.add_run(
-    "I hereby confirm that the information provided above is true, correct, and accurate."
-)
-run.font.name = 'Calibri'
-run.font.size = Pt(11)
-run.bold = True
-confirmation_text.paragraph_format.line_spacing = None  # Ensure no line spacing
-confirmation_text.paragraph_format.space_after = Pt(0)  # Remove space after paragraph
-
-# Add the combined administrator and organization head's name and designation table
-combined_table = doc.add_table(rows=2, cols=2)
-combined_table.autofit = False
-
-# First row with blank lines
-row_cells = combined_table.rows[0].cells
-row_cells[0].text = '\n\n\n'  # 3 blank lines
-row_cells[1].text = '\n\n\n'  # 3 blank lines
-
-# Second row with centered names and designations
-row_cells = combined_table.rows[1].cells
-p = row_cells[0].add_paragraph()
-p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-run = p.add_run(administrator_name)
-run.font.name = 'Calibri'
-run.font.size = Pt(11)
-run.bold = True
-
-p = row_cells[0].add_paragraph()
-p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-run = p.add_run(administrator_designation)
-run.font.name = 'Calibri'
-run.font.size = Pt(11)
-
-p = row_cells[1].add_paragraph()
-p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-run = p.add_run(org_head_name)
-run.font.name = 'Calibri'
-run.font.size = Pt(11)
-run.bold = True
-
-p = row_cells[1].add_paragraph()
-p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-run = p.add_run(org_head_designation)
-run.font.name = 'Calibri'
-run.font.size = Pt(11)
-
-for row in combined_table.rows:
-    for cell in row.cells:
-        for paragraph in cell.paragraphs:
-            paragraph.paragraph_format.line_spacing = None  # Ensure default line spacing
-            paragraph.paragraph_format.space_before = Pt(0)
-            paragraph.paragraph_format.space_after = Pt(0)
-
-set_table_borders(combined_table)
-
-# Save the request form document
-docx_request_filename = os.path.join(media_root, f"Request_Form_{site_code}_{request_id}.docx")
-try:
-    doc.save(docx_request_filename)
-except Exception as e:
-    print_and_log(f"Failed to save request form document: {e}")
-    sys.exit(1)
-
-# Convert the request form document to PDF
-pdf_request_filename = os.path.join(media_root, f"Request_Form_{site_code}_{request_id}.pdf")
-convert_to_pdf(docx_request_filename, pdf_request_filename)
-
-# Delete the request form Word document after conversion
-try:
-    os.remove(docx_request_filename)
-except Exception as e:
-    print_and_log(f"Failed to delete request form document: {e}")
-    sys.exit(1)
-
-# Create the Cover Letter Document
-cover_letter = Document()
-
-# Set margins to narrow (0.5 inches from all sides)
-sections = cover_letter.sections
-for section in sections:
-    section.left_margin = Inches(0.5)
-    section.right_margin = Inches(0.5)
-    section.top_margin = Inches(0.5)
-    section.bottom_margin = Inches(0.5)
+    # Footer with request token and document version
+    set_narrow_margins(section, request_form_footer(request_token))
 
-    # Add footer with request token
-    footer = section.footer.paragraphs[0] if section.footer.paragraphs else section.footer.add_paragraph()
-    footer.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    footer_text = footer.add_run(f"Request Token: {request_token}")
-    footer_text.font.size = Pt(9)
-    footer_text.font.color.rgb = RGBColor(0, 0, 0)
-
-# Add cover letter content
-paragraphs = [
-    "",
-    "",
-    "",
-    "",
-    datetime.now().strftime("%Y-%m-%d"),
-    "Hostmaster,",
-    "Gov.lk Domain Registry,",
-    "Network Operation Center,",
-    "Information and Communication Technology Agency of Sri Lanka,",
-    "490, R.A.DeMelMawatha,",
-    "Colombo 03,",
-    "Sri Lanka",
-    "",
-    "Request for the Domain Registration / Modification of domain(s) {},",
-    "I hereby confirm that the information in the attached domain registration / modification form is accurate, "
-    "and the request has been made for official purposes only. Please note that "
-    "{} who is the {} of this organization will be the authorized officer "
-    "for this request and you may contact him/her pertaining to this request in the future.",
-    "Thank You.",
-    "",
-    "",
-    "",
-    "_______________________________",
-    org_head_name,
-    org_head_designation,
-    organization_name
-]
-
-# Add paragraphs to the document
-for para in paragraphs:
-    p = cover_letter.add_paragraph()
-    if para == "Request for the Domain Registration / Modification of domain(s) {},":
-        run = p.add_run(para.format(domains_list))
-        run.bold = True
-    elif para.startswith("I hereby confirm that the information"):
-        text_parts = para.split("{}")
-        p.add_run(text_parts[0])
-        run = p.add_run(administrator_name)
-        run.bold = True
-        p.add_run(text_parts[1])
-        p.add_run(administrator_designation)
-        p.add_run(text_parts[2])
+    # Add centered title
+    title = add_heading(doc, f"Domain Registration Form | Request ID - {request_id}")
+    title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    title.add_run().add_break()
+
+    # Add "Organization Information" heading
+    add_heading(doc, "Organization Information")
+
+    # Add Organization Table with 6 rows (one for each data field) and 2 columns
+    org_table = add_table(doc, rows=6, cols=2)
+
+    # Set table width to span the full width of the page minus the margins
+    table_width = section.page_width - section.left_margin - section.right_margin
+    col_widths = [table_width * 0.30, table_width * 0.70]
+
+    # Populate the table with field names and data
+    for row, (name, value) in zip(org_table.rows, organization_rows(summary)):
+        row_cells = row.cells
+        set_cell_text(row_cells[0], name)
+        set_cell_text(row_cells[1], value)
+    set_column_widths(org_table, col_widths)
+
+    # Add a line break after the "Organization Information" table
+    add_line_break(doc)
+
+    # Add "Requesting Domain(s)" heading
+    add_heading(doc, "Requesting Domain(s)")
+
+    # Add Requesting Domains Table with 2 columns: Domain and Reason
+    domain_table = add_table(doc, rows=1, cols=2)
+    domain_table.autofit = False
+
+    # Set header row
+    hdr_cells = domain_table.rows[0].cells
+    set_cell_text(hdr_cells[0], 'Domain', bold=True)
+    set_cell_text(hdr_cells[1], 'Reason', bold=True)
+
+    # Populate the table with domain and reason
+    add_row = table_row_adder(domain_table)
+    for domain in requested_domains:
+        row_cells = add_row()
+        set_cell_text(row_cells[0], domain['fqdn'])
+        set_cell_text(row_cells[1], domain['reason'])
+
+    # Set column widths once all rows exist
+    set_column_widths(domain_table, col_widths)
+
+    # Add a line break after the "Requesting Domain(s)" table
+    add_line_break(doc)
+
+    # Add "Contact Information" heading
+    add_heading(doc, "Contact Information")
+
+    # Add user tables for each role
+    for role, user, hosting in contact_sections(summary):
+        add_user_table(doc, role, user, col_widths, hosting)
+
+    # Add DNS Records section
+    add_dns_records(doc, requested_domains)
+
+    # Add a line break after the DNS Records section
+    add_line_break(doc)
+
+    # Add the "Confirmation Seal & Signature" title
+    add_heading(doc, "Confirmation Seal & Signature")
+
+    # Add a line break before the confirmation text
+    add_line_break(doc)
+
+    # Add the confirmation text
+    confirmation_text = add_styled_paragraph(
+        doc, "I hereby confirm that the information provided above is true, correct, and accurate.",
+        style='FormCell', bold=True)
+    confirmation_text.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    confirmation_text.paragraph_format.keep_with_next = True  # Keep this paragraph on the same page as the next
+
+    # Add the combined administrator and organization head's name and designation table
+    combined_table = add_table(doc, rows=2, cols=2)
+    combined_table.autofit = False
+
+    # First row with blank lines
+    row_cells = combined_table.rows[0].cells
+    set_cell_text(row_cells[0], '\n\n\n')  # 3 blank lines
+    set_cell_text(row_cells[1], '\n\n\n')  # 3 blank lines
+
+    # Second row with centered names and designations
+    row_cells = combined_table.rows[1].cells
+    for cell, name, designation in ((row_cells[0], administrator_name, administrator_designation),
+                                    (row_cells[1], org_head_name, org_head_designation)):
+        cell.paragraphs[0].style = 'FormCell'
+        add_styled_paragraph(cell, name, 'FormCell', bold=True).alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        add_styled_paragraph(cell, designation, 'FormCell').alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+    return doc
+
+
+# Stand-ins for the requested domains while the fixed part of a streamed request
+# form is built with python-docx. The rows and paragraphs python-docx produces
+# for them are the templates of the streamed ones: a domain row, a DNS heading,
+# and DNS rows for a type with several fields, one field and none.
+STREAM_DOMAIN = {
+    'fqdn': '\ue000',
+    'reason': '\ue001',
+    'dns_records': [
+        {'type': '\ue002', '\ue003': '\ue004', '\ue005': '\ue006'},
+        {'type': '\ue007', '\ue008': '\ue009'},
+        {'type': '\ue00a'},
+    ],
+}
+
+# Requests with at least this many table rows (requested domains plus DNS
+# record fields) are streamed rather than built as one python-docx tree
+DEFAULT_STREAM_MIN_ROWS = 100
+
+
+def table_rows(summary):
+    rows = 0
+    for domain in summary["requested_domains"]:
+        rows += 1 + sum(max(len(values), 1) for _, values in dns_record_groups(domain))
+    return rows
+
+
+def streams_request_form(summary):
+    return table_rows(summary) >= int(os.getenv('FORM_STREAM_MIN_ROWS', DEFAULT_STREAM_MIN_ROWS))
+
+
+# Placeholders of the precompiled templates: every value of a request outside
+# the repeated rows is a private-use character in the template, replaced when a
+# request fills it in. The letter date has to be a date python-docx can parse.
+USER_FIELDS = ('full_name', 'nic', 'mobile', 'email', 'designation')
+CONTACT_KEYS = ('organization_head', 'administrator', 'technical_contact', 'content_developer', 'hosting_coordinator')
+TEMPLATE_FIELDS = ['request_id', 'request_token', 'organization_name', 'address', 'email', 'contact_no',
+                   'hosting_provider', 'domains'] + [f'{key}.{field}' for key in CONTACT_KEYS for field in USER_FIELDS]
+TEMPLATE_DATE = '1999-12-31'
+TEMPLATE_MARKERS = [chr(0xe100 + i) for i in range(len(TEMPLATE_FIELDS))] + [TEMPLATE_DATE]
+PLACEHOLDERS = dict(zip(TEMPLATE_FIELDS, TEMPLATE_MARKERS))
+
+# The precompiled templates and the repeated parts each of them must contain
+REQUEST_FORM_REGIONS = ['domains', 'administrator', 'technical_contact', 'content_developer', 'hosting_coordinator',
+                        'dns_records']
+TEMPLATE_KINDS = {'request_form': REQUEST_FORM_REGIONS, 'cover_letter': [], 'combined': REQUEST_FORM_REGIONS}
+
+
+def template_values(summary, request_token, letter_date):
+    # The text of each placeholder, in TEMPLATE_MARKERS order
+    fields = {
+        'request_id': str(summary["request_id"]),
+        'request_token': request_token,
+        'organization_name': summary["organization_name"],
+        'address': summary["address"],
+        'email': summary["email"],
+        'contact_no': str(summary["contact_no"]),
+        'hosting_provider': summary.get("hosting_provider") or '',
+        'domains': ', '.join([domain['fqdn'] for domain in summary["requested_domains"]]),
+    }
+    for key in CONTACT_KEYS:
+        user = summary.get(key) or {}
+        for field in USER_FIELDS:
+            value = user.get(field)
+            fields[f'{key}.{field}'] = '' if value is None else str(value)
+    return [fields[name] for name in TEMPLATE_FIELDS] + [letter_date]
+
+
+class FormTemplate:
+    # A document cut at its repeated parts. The XML in between is kept as it is,
+    # with the placeholders in markers as slots, and the requested domains, the
+    # DNS records and (when their placeholders are in markers) the contact
+    # tables are rendered per request from rows cut out of the document.
+
+    def __init__(self, data, markers=()):
+        self.skeleton = form_stream.Skeleton(data)
+        self.markers = list(markers)
+        xml = self.skeleton.document
+
+        regions = []
+        if '\ue000' in xml:
+            regions.extend(self.domain_regions(xml))
+        for key in CONTACT_KEYS[1:]:
+            marker = PLACEHOLDERS[f'{key}.nic']
+            if marker in self.markers and marker in xml:
+                regions.append(self.contact_region(xml, key, marker))
+        regions.sort(key=lambda region: region[0])
+        self.regions = [name for _, _, name, _ in regions]
+
+        self.segments = []
+        position = 0
+        for start, end, _, rows in regions:
+            self.segments.append(form_stream.Template(xml[position:start], self.markers))
+            self.segments.append(rows)
+            position = end
+        self.segments.append(form_stream.Template(xml[position:], self.markers))
+
+        # The footers and document properties that show a placeholder
+        self.parts = {}
+        for name, content in self.skeleton.parts.items():
+            if name == form_stream.DOCUMENT_PART or not name.endswith('.xml'):
+                continue
+            text = content.decode('utf-8')
+            if any(marker in text for marker in self.markers):
+                template = form_stream.Template if name.startswith('word/') else form_stream.TextTemplate
+                self.parts[name] = template(text, self.markers)
+
+    def domain_regions(self, xml):
+        # The first stand-in fqdn is in the Requesting Domain(s) table, the second
+        # heads the DNS table
+        row_start, row_end = form_stream.element_span(xml, 'w:tr', xml.index('\ue000'))
+        domain_row = form_stream.Template(xml[row_start:row_end], ['\ue000', '\ue001'])
+        heading_start, heading_end = form_stream.element_span(xml, 'w:p', xml.index('\ue000', row_end))
+        heading = form_stream.Template(xml[heading_start:heading_end], ['\ue000'])
+        table_start, table_end = form_stream.element_span(xml, 'w:tbl', xml.index('\ue002', heading_end))
+        table = xml[table_start:table_end]
+        table_open = table[:form_stream.first_element(table, 'w:tr')]
+        first_row, next_row, single_row, empty_row = form_stream.elements(table, 'w:tr')
+        first_row = form_stream.Template(first_row, ['\ue002', '\ue003', '\ue004'])
+        next_row = form_stream.Template(next_row, ['\ue005', '\ue006'])
+        single_row = form_stream.Template(single_row, ['\ue007', '\ue008', '\ue009'])
+        empty_row = form_stream.Template(empty_row, ['\ue00a'])
+
+        def domain_rows(summary):
+            for domain in summary["requested_domains"]:
+                yield domain_row.render(domain['fqdn'], domain['reason'])
+
+        def record_rows(record_type, values):
+            if not values:
+                yield empty_row.render(record_type)
+            elif len(values) == 1:
+                yield single_row.render(record_type, values[0][0], str(values[0][1]))
+            else:
+                yield first_row.render(record_type, values[0][0], str(values[0][1]))
+                for key, value in values[1:]:
+                    yield next_row.render(key, str(value))
+
+        def dns_records(summary):
+            for domain in summary["requested_domains"]:
+                yield heading.render(domain['fqdn']) + table_open
+                for record_type, values in dns_record_groups(domain):
+                    yield from record_rows(record_type, values)
+                yield '</w:tbl>'
+
+        return [(row_start, row_end, 'domains', domain_rows), (heading_start, table_end, 'dns_records', dns_records)]
+
+    def contact_region(self, xml, key, marker):
+        # The rows of a contact table, which only lists the fields a user has
+        table_start, table_end = form_stream.element_span(xml, 'w:tbl', xml.index(marker))
+        table = xml[table_start:table_end]
+        row = form_stream.Template(form_stream.elements(table, 'w:tr')[0],
+                                   ['Full Name', PLACEHOLDERS[f'{key}.full_name']])
+        if len(row.slots) != 2:
+            raise form_stream.StreamError(f"The first row of the {key} table is not its Full Name row")
+        section = CONTACT_KEYS.index(key) - 1
+
+        def rows(summary):
+            _, user, hosting = contact_sections(summary)[section]
+            for name, value in user_rows(user, hosting):
+                yield row.render(name, value)
+
+        rows_start = table_start + form_stream.first_element(table, 'w:tr')
+        rows_end = table_start + table.rindex('</w:tr>') + len('</w:tr>')
+        return rows_start, rows_end, key, rows
+
+    def document(self, summary, request_token, letter_date=None):
+        values = properties = ()
+        if self.markers:
+            letter_date = letter_date or today()
+            values = template_values(summary, request_token, letter_date)
+            # Document properties hold the date as python-docx writes a datetime
+            properties = values[:-1] + [datetime.strptime(letter_date, "%Y-%m-%d").strftime("%Y-%m-%d")]
+
+        def chunks():
+            for segment in self.segments:
+                if isinstance(segment, form_stream.Template):
+                    yield segment.render(*values)
+                else:
+                    yield from segment(summary)
+
+        def parts():
+            result = {form_stream.DOCUMENT_PART: chunks()}
+            for name, template in self.parts.items():
+                result[name] = [template.render(*(properties if isinstance(template, form_stream.TextTemplate) else values))]
+            return result
+
+        return form_stream.StreamedDocument(self.skeleton, parts)
+
+
+def stream_request_form(summary, request_token, doc=None, letter_date=None):
+    # build_request_form for very large requests: everything but the requested
+    # domain rows and the DNS records is built with python-docx, and those are
+    # rendered into document.xml while it is written, one record type at a time.
+    # Peak memory then no longer grows with the number of records.
+    data = docx_bytes(build_request_form(dict(summary, requested_domains=[STREAM_DOMAIN]), request_token, doc,
+                                         letter_date), 'request form')
+    return FormTemplate(data).document(summary, request_token)
+
+
+def template_path(kind):
+    # FORM_TEMPLATE_DIR/<kind>-<DOCUMENT_VERSION>.docx, as --write-templates saves them
+    directory = os.getenv('FORM_TEMPLATE_DIR')
+    if not directory:
+        return None
+    return os.path.join(directory, f"{kind}-{DOCUMENT_VERSION}.docx")
+
+
+def templates_enabled():
+    # FORM_TEMPLATES=off builds every document with python-docx instead
+    return os.getenv('FORM_TEMPLATES', 'on').lower() not in ('', '0', 'off', 'no')
+
+
+def build_template(kind):
+    # The document of a request whose values are all placeholders, with the
+    # stand-in domain of streamed request forms; the cover letter lists its own
+    # placeholder rather than the stand-in fqdn
+    summary = {name: PLACEHOLDERS[name] for name in ('request_id', 'organization_name', 'address', 'email',
+                                                      'contact_no', 'hosting_provider')}
+    for key in CONTACT_KEYS:
+        summary[key] = {field: PLACEHOLDERS[f'{key}.{field}'] for field in USER_FIELDS}
+    request_token = PLACEHOLDERS['request_token']
+    form_summary = dict(summary, requested_domains=[STREAM_DOMAIN])
+    letter_summary = dict(summary, requested_domains=[{'fqdn': PLACEHOLDERS['domains']}])
+    if kind == 'request_form':
+        doc = build_request_form(form_summary, request_token, letter_date=TEMPLATE_DATE)
+    elif kind == 'cover_letter':
+        doc = build_cover_letter(letter_summary, request_token, TEMPLATE_DATE)
     else:
-        p.add_run(para)
-    p.paragraph_format.line_spacing = None
-    p.paragraph_format.space_after = Pt(0)
-    p.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-
-# Save the cover letter document
-docx_cover_letter_filename = os.path.join(media_root, f"Cover_Letter_{site_code}_{request_id}.docx")
-try:
-    cover_letter.save(docx_cover_letter_filename)
-except Exception as e:
-    print_and_log(f"Failed to save cover letter document: {e}")
-    sys.exit(1)
-
-# Convert the cover letter document to PDF
-pdf_cover_letter_filename = os.path.join(media_root, f"Cover_Letter_{site_code}_{request_id}.pdf")
-convert_to_pdf(docx_cover_letter_filename, pdf_cover_letter_filename)
-
-# Delete the cover letter Word document after conversion
-try:
-    os.remove(docx_cover_letter_filename)
-except Exception as e:
-    print_and_log(f"Failed to delete cover letter document: {e}")
-    sys.exit(1)
-
-# Print the final paths of the generated PDF files
-print(f"media/domain-request/forms/{os.path.basename(pdf_request_filename)}")
-print(f"media/domain-request/forms/{os.path.basename(pdf_cover_letter_filename)}")
+        doc = build_request_form(form_summary, request_token,
+                                 build_cover_letter(letter_summary, request_token, TEMPLATE_DATE))
+    return docx_bytes(doc, f"{kind} template")
+
+
+_form_templates = {}
+
+def form_template(kind):
+    # Compiled once per process, from FORM_TEMPLATE_DIR when it has a template
+    # of this document version, otherwise from build_template
+    template = _form_templates.get(kind)
+    if template is None:
+        path = template_path(kind)
+        if not (path and os.path.isfile(path)):
+            path = None
+        label = path or f"built-in {kind} template"
+        try:
+            if path:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            else:
+                data = build_template(kind)
+            template = FormTemplate(data, TEMPLATE_MARKERS)
+        except (OSError, form_stream.StreamError, ValueError) as e:
+            raise FormGenerationError(f"Invalid {label}: {e}")
+        if template.regions != TEMPLATE_KINDS[kind]:
+            raise FormGenerationError(f"{label} has the repeated parts {template.regions}, "
+                                      f"expected {TEMPLATE_KINDS[kind]}")
+        _form_templates[kind] = template
+    return template
+
+
+def write_templates(directory):
+    # Save the templates built from this file's layout for FORM_TEMPLATE_DIR;
+    # returns their paths
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for kind in TEMPLATE_KINDS:
+        path = os.path.join(directory, f"{kind}-{DOCUMENT_VERSION}.docx")
+        write_output(path, build_template(kind), f"{kind} template")
+        paths.append(path)
+    return paths
+
+
+def document_title(summary):
+    return f"Domain Registration Request {summary['request_id']}"
+
+
+def set_core_properties(doc, summary, letter_date=None):
+    # Fixed metadata dated like the letter, instead of python-docx's template
+    # defaults, so the same request and date always give the same document
+    created = datetime.strptime(letter_date or today(), "%Y-%m-%d")
+    properties = doc.core_properties
+    properties.title = document_title(summary)
+    properties.author = form_pdf.PRODUCER
+    properties.comments = ''
+    properties.last_modified_by = ''
+    properties.revision = 1
+    properties.created = created
+    properties.modified = created
+
+
+def build_cover_letter(summary, request_token, letter_date=None):
+    # Create the Cover Letter Document
+    cover_letter = new_document()
+    set_core_properties(cover_letter, summary, letter_date)
+
+    # Footer with request token
+    set_narrow_margins(cover_letter.sections[0], cover_letter_footer(request_token))
+
+    # Add paragraphs to the document
+    for runs in cover_letter_paragraphs(summary, letter_date):
+        p = add_styled_paragraph(cover_letter, style='FormLetter')
+        for text, bold in runs:
+            if not text:
+                continue
+            run = p.add_run(text)
+            if bold:
+                run._r.style = 'FormStrong'
+
+    return cover_letter
+
+
+def build_combined_document(summary, request_token, letter_date=None):
+    # The cover letter followed by the request form, converted as one PDF
+    return build_request_form(summary, request_token, build_cover_letter(summary, request_token, letter_date))
+
+
+def pdf_heading(text, sub=False, keep_with_next=False):
+    # FormHeading / FormSubheading; subheadings always stay with the table below them
+    return form_pdf.Paragraph([(text, True)], size=12 if sub else 14, keep_with_next=sub or keep_with_next)
+
+
+def pdf_cell(text, bold=False, align='left'):
+    return form_pdf.Paragraph([(text, bold)], align=align)
+
+
+def request_form_flowables(summary):
+    # The request form layout drawn by the native PDF backend, mirroring build_request_form
+    Paragraph = form_pdf.Paragraph
+    Table = form_pdf.Table
+    col_widths = [0.30, 0.70]
+    line_break = Paragraph()
+
+    title = form_pdf.Paragraph([(f"Domain Registration Form | Request ID - {summary['request_id']}", True)],
+                               size=14, align='center', space_after=14 * form_pdf.LEADING)
+    flowables = [title, pdf_heading("Organization Information")]
+    flowables.append(Table([[pdf_cell(name), pdf_cell(value)] for name, value in organization_rows(summary)], col_widths))
+    flowables += [line_break, pdf_heading("Requesting Domain(s)")]
+
+    domain_rows = [[pdf_cell('Domain', bold=True), pdf_cell('Reason', bold=True)]]
+    domain_rows += [[pdf_cell(domain['fqdn']), pdf_cell(domain['reason'])] for domain in summary["requested_domains"]]
+    flowables += [Table(domain_rows, col_widths), line_break, pdf_heading("Contact Information")]
+
+    for role, user, hosting in contact_sections(summary):
+        rows = [[pdf_cell(key), pdf_cell(value)] for key, value in user_rows(user, hosting)]
+        flowables += [pdf_heading(role, sub=True), Table(rows, col_widths), line_break]
+
+    flowables.append(pdf_heading("DNS Records", keep_with_next=True))
+    for domain in summary["requested_domains"]:
+        rows = []
+        for record_type, values in dns_record_groups(domain):
+            type_cell = pdf_cell(f"{record_type} Record", bold=True, align='center')
+            for n in range(max(len(values), 1)):
+                key, value = values[n] if n < len(values) else ('', '')
+                rows.append([type_cell if n == 0 else None, pdf_cell(key), pdf_cell(str(value))])
+        flowables += [pdf_heading(domain['fqdn'], sub=True), Table(rows, [1 / 3, 1 / 3, 1 / 3])]
+
+    flowables += [line_break, pdf_heading("Confirmation Seal & Signature"), line_break]
+    flowables.append(Paragraph([("I hereby confirm that the information provided above is true, correct, and accurate.", True)],
+                               align='center', keep_with_next=True))
+
+    administrator = summary["administrator"]
+    org_head = summary["organization_head"]
+    signatures = [
+        [pdf_cell('\n\n\n'), pdf_cell('\n\n\n')],
+        [[Paragraph(), pdf_cell(person["full_name"], bold=True, align='center'), pdf_cell(person["designation"], align='center')]
+         for person in (administrator, org_head)],
+    ]
+    flowables.append(Table(signatures, [0.5, 0.5], keep_together=True))
+    return flowables
+
+
+def cover_letter_flowables(summary, letter_date=None):
+    return [form_pdf.Paragraph(runs, align='justify') for runs in cover_letter_paragraphs(summary, letter_date)]
+
+
+def build_pdf_document(summary, request_token, letter_date=None, sections=('request_form',)):
+    # Draw the given sections straight to PDF, without Word or LibreOffice
+    document = form_pdf.PdfDocument(document_title(summary))
+    for section in sections:
+        if section == 'cover_letter':
+            document.add_section(cover_letter_flowables(summary, letter_date), cover_letter_footer(request_token))
+        else:
+            document.add_section(request_form_flowables(summary), request_form_footer(request_token))
+    return document
+
+
+@contextmanager
+def atomic_output(path, label):
+    # Write to a hidden temporary file next to path and rename it into place, so
+    # a reader of the media directory sees either the old file or the complete new one
+    directory, name = os.path.split(path)
+    try:
+        fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    except OSError as e:
+        raise FormGenerationError(f"Failed to save {label} PDF: {e}")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception as e:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        if isinstance(e, FormGenerationError):
+            raise
+        raise FormGenerationError(f"Failed to save {label} PDF: {e}")
+
+
+def write_output(path, data, label):
+    # Replace path with data unless it already holds exactly these bytes, so an
+    # unchanged form keeps its file, modification time and HTTP validators
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    with atomic_output(path, label) as f:
+        f.write(data)
+    return True
+
+
+def save_pdf(document, pdf_path, label):
+    data = document.to_bytes()
+    write_output(pdf_path, data, label)
+    return len(data)
+
+
+def optimizes_pdfs():
+    # FORM_PDF_OPTIMIZE: auto (the default) optimizes converted PDFs when pikepdf
+    # or qpdf is installed, on requires one of them, off publishes them as exported
+    mode = os.getenv('FORM_PDF_OPTIMIZE', 'auto').lower()
+    if mode in ('', '0', 'off', 'no'):
+        return False
+    if form_optimize.backend() is None:
+        if mode == 'auto':
+            return False
+        raise FormGenerationError("FORM_PDF_OPTIMIZE=on needs pikepdf (pip install pikepdf) or qpdf")
+    return True
+
+
+def pdf_output_settings():
+    # The export and optimization settings, which change the bytes of converted
+    # PDFs, as configured: checking them (or the optimizer's version) costs a
+    # subprocess or an import, which is left to the conversions that publish a
+    # PDF. An optimizer upgrade keeps the cached PDFs, which are still valid.
+    return {
+        'pdfa': os.getenv('FORM_PDF_A', ''),
+        'optimize': os.getenv('FORM_PDF_OPTIMIZE', 'auto').lower(),
+    }
+
+
+def optimize_pdf(data, label):
+    # Object streams, recompressed streams and no unused objects (form_optimize);
+    # the size as exported is recorded next to the published size
+    if not optimizes_pdfs():
+        return data
+    try:
+        object_streams = form_converter.pdfa_level() != '1'
+        with form_metrics.stage("optimize_pdf"):
+            optimized = form_optimize.optimize(data, object_streams)
+    except (form_converter.ConversionError, form_optimize.OptimizeError) as e:
+        raise FormGenerationError(f"Failed to optimize {label} PDF: {e}")
+    form_metrics.record_size(f"{metric_name(label)}_pdf_exported", len(data))
+    return optimized
+
+
+def publish_pdf(source_path, pdf_path, label, letter_date=None):
+    # Move a converted PDF from the scratch area into the media directory, with
+    # the converter's export time and random IDs pinned to the letter date. The
+    # pinned PDF is then optimized, which may pack the pinned fields into
+    # compressed object streams.
+    try:
+        with open(source_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise FormGenerationError(f"Failed to save {label} PDF: {e}")
+    write_output(pdf_path, optimize_pdf(form_pdf.pin_metadata(data, letter_date or today()), label), label)
+
+
+def normalize_docx(data):
+    # python-docx writes the parts in a fixed order but stamps every zip entry
+    # with the current time. The time and date of each local and central
+    # directory header are set to 1980-01-01 00:00 in place, which is much
+    # cheaper than recompressing the archive.
+    data = bytearray(data)
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    central = archive.start_dir
+    for info in archive.infolist():
+        struct.pack_into('<HH', data, info.header_offset + 10, 0, form_stream.DOS_EPOCH_DATE)
+        struct.pack_into('<HH', data, central + 12, 0, form_stream.DOS_EPOCH_DATE)
+        name_length, extra_length, comment_length = struct.unpack_from('<HHH', data, central + 28)
+        central += 46 + name_length + extra_length + comment_length
+    return bytes(data)
+
+
+def docx_bytes(doc, label):
+    buffer = io.BytesIO()
+    try:
+        doc.save(buffer)
+    except Exception as e:
+        raise FormGenerationError(f"Failed to save {label} document: {e}")
+    return normalize_docx(buffer.getvalue())
+
+
+def save_docx(doc, docx_path, label):
+    if isinstance(doc, form_stream.StreamedDocument):
+        # Compressed into the file as it is rendered, never held whole in memory
+        try:
+            return doc.save(docx_path)
+        except (form_stream.StreamError, OSError) as e:
+            raise FormGenerationError(f"Failed to save {label} document: {e}")
+    data = docx_bytes(doc, label)
+    try:
+        with open(docx_path, 'wb') as f:
+            f.write(data)
+    except OSError as e:
+        raise FormGenerationError(f"Failed to save {label} document: {e}")
+    return len(data)
+
+
+def scratch_root():
+    # Word documents only exist on their way to the converter. They go to a
+    # private scratch area, on tmpfs when the machine has one, and never to the
+    # publicly served media directory.
+    root = os.getenv('FORM_SCRATCH_DIR')
+    if root:
+        return root
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+def new_scratch_dir():
+    # mkdtemp creates the directory readable by this user only
+    try:
+        return tempfile.mkdtemp(prefix='gov-lk-forms-', dir=scratch_root())
+    except OSError as e:
+        raise FormGenerationError(f"Failed to create scratch directory: {e}")
+
+
+def ensure_media_root(output_root):
+    if not os.path.exists(output_root):
+        try:
+            os.makedirs(output_root)
+        except Exception as e:
+            raise FormGenerationError(f"Failed to create media directory: {e}")
+
+
+def public_path(pdf_path):
+    # Path as served by Next.js from the public directory
+    return f"media/domain-request/forms/{os.path.basename(pdf_path)}"
+
+
+def today():
+    # SOURCE_DATE_EPOCH pins "today" for reproducible runs, as in reproducible builds
+    epoch = os.getenv('SOURCE_DATE_EPOCH')
+    if epoch:
+        return datetime.fromtimestamp(int(epoch), timezone.utc).strftime("%Y-%m-%d")
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def output_bases(summary, output_root=None, combined=False):
+    # (cache name, path without extension, label) for each PDF that is produced
+    if output_root is None:
+        output_root = media_root
+    site_code = summary["site_code"]
+    request_id = summary["request_id"]
+    if combined:
+        return [('combined.pdf', os.path.join(output_root, f"Domain_Request_{site_code}_{request_id}"), "combined request")]
+    return [
+        ('request_form.pdf', os.path.join(output_root, f"Request_Form_{site_code}_{request_id}"), "request form"),
+        ('cover_letter.pdf', os.path.join(output_root, f"Cover_Letter_{site_code}_{request_id}"), "cover letter"),
+    ]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def result_fields(pdf_paths):
+    # Public paths and SHA-256 digests keyed the way job and batch results report
+    # them. Output is byte-reproducible, so a digest works as a strong ETag.
+    names = ['combined'] if len(pdf_paths) == 1 else ['request_form', 'cover_letter']
+    fields = {}
+    for name, pdf_path in zip(names, pdf_paths):
+        fields[f'{name}_path'] = public_path(pdf_path)
+        fields[f'{name}_sha256'] = file_digest(pdf_path)
+    return fields
+
+
+def module_source(module):
+    # Read through the module's loader so this also works inside the zipapp,
+    # where the sources are stored next to their bytecode
+    path = module.__file__
+    if path.endswith('.pyc'):
+        path = path[:-1]
+    return module.__loader__.get_data(path)
+
+
+_renderer_fingerprint = None
+
+def renderer_fingerprint():
+    # Layout changes in this file, the PDF layout engine, the streamed writer or
+    # the optimizer invalidate cached PDFs even if DOCUMENT_VERSION is not bumped
+    global _renderer_fingerprint
+    if _renderer_fingerprint is None:
+        digest = hashlib.sha256()
+        for module in (sys.modules[__name__], form_pdf, form_stream, form_optimize):
+            digest.update(module_source(module))
+        # and so do edits of the templates loaded from FORM_TEMPLATE_DIR
+        for kind in TEMPLATE_KINDS:
+            path = template_path(kind)
+            if path and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _renderer_fingerprint = digest.hexdigest()
+    return _renderer_fingerprint
+
+
+def rendered_inputs(summary, request_token, letter_date, combined=False, backend='docx'):
+    # Everything that ends up in either document; database ids are left out
+    def contact(user, fields=('full_name', 'nic', 'mobile', 'email', 'designation')):
+        return {field: (user or {}).get(field) for field in fields}
+
+    return {
+        'document_version': DOCUMENT_VERSION,
+        'renderer': renderer_fingerprint(),
+        'combined': combined,
+        'backend': backend,
+        'pdf_output': pdf_output_settings() if backend == 'docx' else None,
+        'request_token': request_token,
+        'letter_date': letter_date,
+        'request_id': summary.get('request_id'),
+        'site_code': summary.get('site_code'),
+        'organization_name': summary.get('organization_name'),
+        'address': summary.get('address'),
+        'email': summary.get('email'),
+        'contact_no': summary.get('contact_no'),
+        'organization_head': contact(summary.get('organization_head'), ('full_name', 'designation')),
+        'administrator': contact(summary.get('administrator')),
+        'technical_contact': contact(summary.get('technical_contact')),
+        'content_developer': contact(summary.get('content_developer')),
+        'hosting_coordinator': contact(summary.get('hosting_coordinator')),
+        'hosting_provider': summary.get('hosting_provider'),
+        'requested_domains': [
+            {
+                'fqdn': domain.get('fqdn'),
+                'reason': domain.get('reason'),
+                'dns_records': [
+                    {k: v for k, v in record.items() if k not in ('dns_record_id', 'type_record_id', 'id')}
+                    for record in domain.get('dns_records', [])
+                ],
+            }
+            for domain in summary.get('requested_domains', [])
+        ],
+    }
+
+
+def cover_letter_inputs(summary, request_token, letter_date, backend='docx'):
+    # The cover letter only shows the organization head, the administrator, the
+    # organization name and the domain names, so contact details, reasons and DNS
+    # records can change without invalidating it
+    def person(user):
+        return {field: (user or {}).get(field) for field in ('full_name', 'designation')}
+
+    return {
+        'document_version': DOCUMENT_VERSION,
+        'renderer': renderer_fingerprint(),
+        'artifact': 'cover_letter',
+        'backend': backend,
+        'pdf_output': pdf_output_settings() if backend == 'docx' else None,
+        'request_token': request_token,
+        'letter_date': letter_date,
+        'request_id': summary.get('request_id'),
+        'organization_name': summary.get('organization_name'),
+        'organization_head': person(summary.get('organization_head')),
+        'administrator': person(summary.get('administrator')),
+        'domains': [domain.get('fqdn') for domain in summary.get('requested_domains', [])],
+    }
+
+
+def render_keys(summary, request_token, letter_date, combined=False, backend='docx'):
+    # Cache name -> fingerprint of the inputs of that output alone, so an edit
+    # only invalidates the outputs that show it
+    if combined:
+        return {'combined.pdf': form_cache.fingerprint(rendered_inputs(summary, request_token, letter_date, True, backend))}
+    return {
+        'request_form.pdf': form_cache.fingerprint(rendered_inputs(summary, request_token, letter_date, False, backend)),
+        'cover_letter.pdf': form_cache.fingerprint(cover_letter_inputs(summary, request_token, letter_date, backend)),
+    }
+
+
+def default_cache():
+    # FORM_CACHE_DIR=off disables the render cache
+    root = os.getenv('FORM_CACHE_DIR', cache_root)
+    if root.lower() in ('', '0', 'off', 'none'):
+        return None
+    return form_cache.RenderCache(
+        root,
+        max_bytes=int(os.getenv('FORM_CACHE_MAX_MB', form_cache.DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024,
+        max_age=float(os.getenv('FORM_CACHE_MAX_AGE_DAYS', form_cache.DEFAULT_MAX_AGE / 86400)) * 86400,
+    )
+
+
+def restore_cached(summary, request_token, letter_date, cache, output_root=None, combined=False, backend='docx'):
+    # Copy previous renderings of identical input into place, output by output;
+    # returns the cache names of the outputs that still have to be built
+    outputs = output_bases(summary, output_root, combined)
+    ensure_media_root(os.path.dirname(outputs[0][1]))
+    if cache is None:
+        return [name for name, _, _ in outputs]
+    keys = render_keys(summary, request_token, letter_date, combined, backend)
+    return [name for name, base, _ in outputs if not cache.restore(keys[name], {name: base + ".pdf"})]
+
+
+def store_cached(summary, request_token, letter_date, cache, built, combined=False, backend='docx'):
+    # built maps cache name -> path of a freshly rendered PDF
+    if cache is not None:
+        keys = render_keys(summary, request_token, letter_date, combined, backend)
+        for name, pdf_path in built.items():
+            cache.put(keys[name], {name: pdf_path})
+
+
+def artifact_name(cache_name):
+    # request_form.pdf -> request_form, as results name the outputs
+    return os.path.splitext(cache_name)[0]
+
+
+def record_artifacts(outputs, rebuilt):
+    for name, _, _ in outputs:
+        form_metrics.record_artifact(artifact_name(name), name in rebuilt)
+
+
+def document_builders(summary, request_token, letter_date, combined=False):
+    # Builders in output_bases order
+    if templates_enabled():
+        kinds = ['combined'] if combined else ['request_form', 'cover_letter']
+        return [lambda kind=kind: form_template(kind).document(summary, request_token, letter_date) for kind in kinds]
+    if streams_request_form(summary):
+        if combined:
+            return [lambda: stream_request_form(summary, request_token,
+                                                build_cover_letter(summary, request_token, letter_date))]
+        return [
+            lambda: stream_request_form(summary, request_token, letter_date=letter_date),
+            lambda: build_cover_letter(summary, request_token, letter_date),
+        ]
+    if combined:
+        return [lambda: build_combined_document(summary, request_token, letter_date)]
+    return [
+        lambda: build_request_form(summary, request_token, letter_date=letter_date),
+        lambda: build_cover_letter(summary, request_token, letter_date),
+    ]
+
+
+def metric_name(label):
+    return label.replace(' ', '_')
+
+
+def build_and_save(build, base, label, scratch):
+    # Build a document and serialize it into the scratch directory; returns
+    # (docx_path, final pdf_path, label)
+    with form_metrics.stage(f"build_{metric_name(label)}"):
+        doc = build()
+    docx_path = os.path.join(scratch, os.path.basename(base) + ".docx")
+    with form_metrics.stage("save_docx"):
+        size = save_docx(doc, docx_path, label)
+    form_metrics.record_size(f"{metric_name(label)}_docx", size)
+    return docx_path, base + ".pdf", label
+
+
+def build_documents(summary, request_token, output_root=None, letter_date=None, combined=False, names=None):
+    # Build the Word documents (only the outputs in names, when given) into a
+    # fresh scratch directory, returning the conversions still to run as
+    # (docx_path, pdf_path, label) in output_bases order
+    outputs = output_bases(summary, output_root, combined)
+    ensure_media_root(os.path.dirname(outputs[0][1]))
+
+    scratch = new_scratch_dir()
+    try:
+        return [build_and_save(build, base, label, scratch)
+                for (name, base, label), build in zip(outputs, document_builders(summary, request_token, letter_date, combined))
+                if names is None or name in names]
+    except Exception:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+
+
+def record_pdf_sizes(pending):
+    for _, pdf_path, label in pending:
+        form_metrics.record_file_size(f"{metric_name(label)}_pdf", pdf_path)
+
+
+def convert_documents(pending, converter_pool=None, letter_date=None):
+    # Every document goes to the converter in one call, so a cold LibreOffice
+    # start is paid once per request rather than once per document. The PDFs
+    # are written next to the Word documents in scratch, then published to
+    # their final paths, and the scratch directories are removed.
+    conversions = [(docx_path, os.path.splitext(docx_path)[0] + ".pdf") for docx_path, _, _ in pending]
+    try:
+        with form_metrics.stage("convert_pdf"):
+            convert_all_to_pdf(conversions, converter_pool)
+        for (_, scratch_pdf), (_, pdf_path, label) in zip(conversions, pending):
+            publish_pdf(scratch_pdf, pdf_path, label, letter_date)
+    finally:
+        for scratch in {os.path.dirname(docx_path) for docx_path, _, _ in pending}:
+            shutil.rmtree(scratch, ignore_errors=True)
+    record_pdf_sizes(pending)
+    return tuple(pdf_path for _, pdf_path, _ in pending)
+
+
+def render_native(summary, request_token, output_root=None, letter_date=None, combined=False, names=None):
+    # The native backend writes the PDFs directly; there is nothing left to convert.
+    # Returns the paths of the PDFs written (only the outputs in names, when given).
+    outputs = output_bases(summary, output_root, combined)
+    ensure_media_root(os.path.dirname(outputs[0][1]))
+    sections = [('cover_letter', 'request_form')] if combined else [('request_form',), ('cover_letter',)]
+
+    pdf_paths = []
+    for (name, base, label), parts in zip(outputs, sections):
+        if names is not None and name not in names:
+            continue
+        with form_metrics.stage(f"render_{metric_name(label)}_pdf"):
+            try:
+                size = save_pdf(build_pdf_document(summary, request_token, letter_date, parts), base + ".pdf", label)
+            except form_pdf.PdfError as e:
+                raise FormGenerationError(f"Failed to render {label} PDF: {e}")
+        form_metrics.record_size(f"{metric_name(label)}_pdf", size)
+        pdf_paths.append(base + ".pdf")
+    return tuple(pdf_paths)
+
+
+def build_and_convert_overlapped(summary, request_token, output_root=None, converter_pool=None, letter_date=None):
+    # With a warm converter each conversion is cheap to start, so the short
+    # cover letter is built and converted in the background while the request
+    # form is still being built
+    from concurrent.futures import ThreadPoolExecutor
+
+    outputs = output_bases(summary, output_root)
+    ensure_media_root(os.path.dirname(outputs[0][1]))
+    builders = document_builders(summary, request_token, letter_date)
+    (_, form_base, form_label), (_, letter_base, letter_label) = outputs
+
+    # Each document gets its own scratch directory, removed once it is converted
+    with ThreadPoolExecutor(max_workers=1) as background:
+        letter = background.submit(
+            convert_documents, [build_and_save(builders[1], letter_base, letter_label, new_scratch_dir())],
+            converter_pool, letter_date)
+        convert_documents([build_and_save(builders[0], form_base, form_label, new_scratch_dir())], converter_pool,
+                          letter_date)
+        letter.result()
+
+    return form_base + ".pdf", letter_base + ".pdf"
+
+
+def render(summary, request_token, output_root=None, converter_pool=None, letter_date=None, cache=None,
+           combined=False, backend='docx', rebuilt=None):
+    # The cover letter date is an explicit input so that it is part of the cache key.
+    # With combined=True a single PDF (cover letter, then request form) is produced.
+    # backend='pdf' draws the PDFs directly instead of converting Word documents.
+    # Each output is restored from the cache on its own, and only the ones whose
+    # inputs changed are built; their names (request_form, cover_letter or
+    # combined) are appended to the rebuilt list when one is given.
+    letter_date = letter_date or today()
+    outputs = output_bases(summary, output_root, combined)
+    with form_metrics.stage("cache_lookup"):
+        missing = restore_cached(summary, request_token, letter_date, cache, output_root, combined, backend)
+
+    pdf_paths = {name: base + ".pdf" for name, base, _ in outputs}
+    if missing:
+        if backend == 'pdf':
+            render_native(summary, request_token, output_root, letter_date, combined, missing)
+        elif len(missing) == 2 and form_converter.is_warm(converter_pool):
+            build_and_convert_overlapped(summary, request_token, output_root, converter_pool, letter_date)
+        else:
+            pending = build_documents(summary, request_token, output_root, letter_date, combined, missing)
+            convert_documents(pending, converter_pool, letter_date)
+        with form_metrics.stage("cache_store"):
+            store_cached(summary, request_token, letter_date, cache, {name: pdf_paths[name] for name in missing},
+                         combined, backend)
+    record_artifacts(outputs, missing)
+    if rebuilt is not None:
+        rebuilt.extend(artifact_name(name) for name in missing)
+    return tuple(pdf_paths.values())
+
+
+def generate(request_token, summary=None, converter_pool=None, letter_date=None, cache=None, combined=False,
+             backend='docx', rebuilt=None):
+    # The get-summary round trip is only needed when the caller has no payload
+    if summary is None:
+        with form_metrics.stage("fetch"):
+            summary = fetch_summary(request_token)
+    with form_metrics.stage("total"):
+        return render(summary, request_token, converter_pool=converter_pool, letter_date=letter_date, cache=cache,
+                      combined=combined, backend=backend, rebuilt=rebuilt)
+
+
+def prewarm_marker(cache, request_token):
+    # Per-token record of the latest pre-warm run and the cache keys it rendered
+    name = hashlib.sha256(request_token.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(cache.root, '.prewarm', name + '.json')
+
+
+def read_marker(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_marker(path, marker):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.marker-', suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(marker, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        raise FormGenerationError(f"Failed to write pre-warm marker: {e}")
+
+
+def prewarm(request_token, summary=None, cache=None, letter_date=None, combined=False, backend='docx'):
+    # Renders the request into the render cache only, so that the generate-forms
+    # run that follows is a cache hit; nothing is published. Started in the
+    # background after every edit (submit-contacts, add-domain, add-dns), it runs
+    # niced (the I/O scheduler follows the CPU niceness) and first waits a moment:
+    # when another edit starts a newer run for the token in the meantime, this
+    # one gives way to it. Cache keys cover everything a document shows, so a
+    # render of data that has since changed is never served; the newer run also
+    # drops the entries its predecessor rendered for it.
+    if cache is None:
+        raise FormGenerationError("Pre-warming needs the render cache (FORM_CACHE_DIR is off)")
+    try:
+        os.nice(int(os.getenv('FORM_PREWARM_NICE', DEFAULT_PREWARM_NICE)))
+    except OSError:
+        pass
+    marker_path = prewarm_marker(cache, request_token)
+    run_id = f"{os.getpid()}-{time.time_ns()}"
+    write_marker(marker_path, {**read_marker(marker_path), 'run': run_id})
+    time.sleep(float(os.getenv('FORM_PREWARM_DELAY', DEFAULT_PREWARM_DELAY)))
+    marker = read_marker(marker_path)
+    if marker.get('run') != run_id:
+        return {'token': request_token, 'superseded': True}
+
+    if summary is None:
+        with form_metrics.stage("fetch"):
+            summary = fetch_summary(request_token)
+    letter_date = letter_date or today()
+    keys = render_keys(summary, request_token, letter_date, combined, backend)
+    for key in set(marker.get('keys', [])) - set(keys.values()):
+        cache.discard(key)
+    scratch = new_scratch_dir()
+    rebuilt = []
+    try:
+        with form_metrics.stage("total"):
+            render(summary, request_token, output_root=scratch, letter_date=letter_date, cache=cache,
+                   combined=combined, backend=backend, rebuilt=rebuilt)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if read_marker(marker_path).get('run') == run_id:
+        write_marker(marker_path, {'run': run_id, 'keys': sorted(keys.values())})
+    return {'token': request_token, 'superseded': False, 'rebuilt': rebuilt}
+
+
+def run_job(job, converter_pool=None, cache=None):
+    # Worker-mode job: {"token": "...", "summary": {...} | "summary_json": "path", "date": "YYYY-MM-DD",
+    # "combined": false, "backend": "docx" | "pdf"} -> JSON-serializable result, never raises
+    request_token = job.get('token')
+    try:
+        summary = None
+        if job.get('summary') is not None:
+            summary = unwrap_summary(job['summary'])
+        elif job.get('summary_json'):
+            summary = load_summary(job['summary_json'])
+        if not request_token and summary is not None:
+            request_token = summary.get('request_token')
+        if not request_token:
+            raise FormGenerationError("Job is missing a request token")
+        backend = job.get('backend', 'docx')
+        if backend not in BACKENDS:
+            raise FormGenerationError(f"Unknown backend: {backend}")
+        rebuilt = []
+        pdf_paths = generate(request_token, summary, converter_pool, job.get('date'), cache, bool(job.get('combined')),
+                             backend, rebuilt)
+    except Exception as e:
+        result = {'ok': False, 'token': request_token, 'error': str(e)}
+    else:
+        result = {'ok': True, 'token': request_token, 'rebuilt': rebuilt, **result_fields(pdf_paths)}
+    form_metrics.record_run(result['ok'])
+    form_metrics.flush()
+    return result
+
+
+def handle_job_line(line, converter_pool=None, cache=None):
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        return {'ok': False, 'error': f"Invalid job: {e}"}
+    if not isinstance(job, dict):
+        return {'ok': False, 'error': "Invalid job: expected a JSON object"}
+    return run_job(job, converter_pool, cache)
+
+
+def serve_stdio(converter_pool=None, cache=None):
+    # One JSON job per input line, one JSON result per output line
+    for line in sys.stdin:
+        if line.strip():
+            print_and_log(json.dumps(handle_job_line(line, converter_pool, cache)))
+
+
+class _JobRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                result = handle_job_line(line, self.server.converter_pool, self.server.cache)
+                self.wfile.write((json.dumps(result) + '\n').encode())
+                self.wfile.flush()
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, converter_pool=None, cache=None):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.converter_pool = converter_pool
+        self.cache = cache
+        super().__init__(socket_path, _JobRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+
+def serve(socket_path=None, converters=0, cache=None):
+    converter_pool = form_converter.ConverterPool(converters) if converters > 0 else None
+    # Warm the document template before the first job arrives
+    new_document()
+    try:
+        if socket_path:
+            server = JobServer(socket_path, converter_pool, cache)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                if os.path.exists(socket_path):
+                    os.remove(socket_path)
+        else:
+            serve_stdio(converter_pool, cache)
+    finally:
+        if converter_pool is not None:
+            converter_pool.close()
+
+
+def default_queue():
+    import form_queue
+
+    return form_queue.JobQueue(
+        os.getenv('FORM_QUEUE_DB', queue_path),
+        max_attempts=int(os.getenv('FORM_QUEUE_MAX_ATTEMPTS', form_queue.DEFAULT_MAX_ATTEMPTS)),
+    )
+
+
+def enqueue_job(queue, job):
+    # job has the run_job fields; returns the job status plus whether a new job was created
+    request_token = job.get('token') or (job.get('summary') or {}).get('request_token')
+    if not request_token:
+        raise FormGenerationError("Job is missing a request token")
+    status, created = queue.enqueue(request_token, dict(job, token=request_token))
+    return dict(status, created=created)
+
+
+def run_queue_worker(queue, concurrency=2, converters=0, cache=None, poll_interval=1.0, drain=False):
+    # Runs queued jobs on `concurrency` threads. The same number caps running jobs
+    # across every worker sharing the queue file. A job whose result is not ok is
+    # retried with backoff by the queue. With drain=True the worker exits once no
+    # job is runnable.
+    converter_pool = form_converter.ConverterPool(converters) if converters > 0 else None
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = threading.Event()
+    # Summaries of the jobs next in line, fetched while the current ones render.
+    # A summary older than FORM_PREFETCH_TTL seconds, or fetched before its job
+    # was last enqueued (an edit since), is fetched again by its job.
+    prefetched = form_http.PrefetchedValues(float(os.getenv('FORM_PREFETCH_TTL', 60)))
+    lookahead = int(os.getenv('FORM_PREFETCH_CONCURRENCY', form_http.DEFAULT_PREFETCH_CONCURRENCY))
+
+    def prefetch():
+        while not stopping.is_set():
+            started = time.time()
+
+            def on_fetched(request_token, summary, error):
+                # A failed prefetch is left to the job, which fetches and reports it itself
+                if error is None:
+                    prefetched.put(request_token, summary, started)
+
+            upcoming = [job['token'] for job in queue.upcoming(lookahead, poll_interval)
+                        if not job['job'].get('summary') and not job['job'].get('summary_json')
+                        and job['token'] not in prefetched]
+            prefetch_summaries(upcoming, on_fetched)
+            stopping.wait(poll_interval)
+
+    def work(index):
+        while not stopping.is_set():
+            claimed = queue.claim(f"{worker_name}:{index}", limit=concurrency)
+            if claimed is None:
+                if drain:
+                    return
+                stopping.wait(poll_interval)
+                continue
+            job = claimed['job']
+            if not job.get('summary') and not job.get('summary_json'):
+                summary = prefetched.pop(claimed['token'], since=claimed['queued_at'])
+                if summary is not None:
+                    job = dict(job, summary=summary)
+            with queue.keep_lease(claimed['id'], claimed['worker']):
+                result = run_job(job, converter_pool, cache)
+            if result['ok']:
+                recorded = queue.complete(claimed['id'], claimed['worker'], result)
+            else:
+                recorded = queue.fail(claimed['id'], claimed['worker'], result['error'])
+            if not recorded:
+                # The lease ran out (the worker was stalled) and the job went to another worker
+                result = dict(result, discarded='lease lost')
+            print_and_log(json.dumps(dict(result, attempt=claimed['attempt'])))
+
+    new_document()
+    threads = [threading.Thread(target=work, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    threading.Thread(target=prefetch, daemon=True).start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stopping.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        stopping.set()
+        if converter_pool is not None:
+            converter_pool.close()
+
+
+def parse_batch_item(item):
+    # A batch item is a request token, a summary JSON file, or TOKEN=summary.json
+    if '=' in item:
+        request_token, summary_path = item.split('=', 1)
+        return request_token, summary_path
+    if item.endswith('.json') or os.path.isfile(item):
+        return None, item
+    return item, None
+
+
+def build_batch_item(item, letter_date=None, cache=None, combined=False, backend='docx', summary=None):
+    # Runs in a builder process: resolve the summary (unless the parent already
+    # fetched it) and save both Word documents, or restore them from the render cache
+    request_token, summary_path = parse_batch_item(item)
+    try:
+        if summary is None and summary_path:
+            summary = load_summary(summary_path)
+        if not request_token and summary is not None:
+            request_token = summary.get('request_token')
+        if not request_token:
+            raise FormGenerationError("Batch item has no request token")
+        if summary is None:
+            summary = fetch_summary(request_token)
+        letter_date = letter_date or today()
+        outputs = output_bases(summary, combined=combined)
+        missing = restore_cached(summary, request_token, letter_date, cache, combined=combined, backend=backend)
+        pdf_paths = [base + ".pdf" for _, base, _ in outputs]
+        result = {'item': item, 'ok': True, 'token': request_token, 'cached': not missing,
+                  'rebuilt': [artifact_name(name) for name in missing]}
+        if not missing:
+            return {**result, **result_fields(pdf_paths)}
+        if backend == 'pdf':
+            # Nothing to convert: the builder process writes the final PDFs itself
+            built = render_native(summary, request_token, letter_date=letter_date, combined=combined, names=missing)
+            store_cached(summary, request_token, letter_date, cache, dict(zip(missing, built)), combined, backend)
+            return {**result, **result_fields(pdf_paths)}
+        pending = build_documents(summary, request_token, letter_date=letter_date, combined=combined, names=missing)
+        keys = render_keys(summary, request_token, letter_date, combined, backend)
+    except Exception as e:
+        return {'item': item, 'ok': False, 'token': request_token, 'error': str(e)}
+    return {
+        **result,
+        'pending': pending,
+        'letter_date': letter_date,
+        'pdf_paths': pdf_paths,
+        # (cache key, cache name) of each pending conversion
+        'cache_entries': [(keys[name], name) for name in missing],
+    }
+
+
+def convert_batch_item(built, converter_pool, cache=None):
+    result = {key: value for key, value in built.items()
+              if key not in ('pending', 'letter_date', 'pdf_paths', 'cache_entries')}
+    try:
+        converted = convert_documents(built['pending'], converter_pool, built['letter_date'])
+    except Exception as e:
+        result.update(ok=False, error=str(e))
+    else:
+        if cache is not None:
+            for (key, name), pdf_path in zip(built['cache_entries'], converted):
+                cache.put(key, {name: pdf_path})
+        result.update(result_fields(built['pdf_paths']))
+    return result
+
+
+def run_batch(items, jobs=None, converters=2, letter_date=None, cache=None, combined=False, backend='docx'):
+    # Documents are built in a process pool sized to the machine and handed to a
+    # bounded converter pool in this process. Summaries of token items are fetched
+    # here, concurrently, and each item goes to a builder as soon as its summary
+    # arrives. Every item reports one JSON line on stdout and a failure never
+    # stops the rest of the batch.
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    jobs = jobs or os.cpu_count() or 1
+    converter_pool = form_converter.ConverterPool(converters if backend == 'docx' else 0)
+    output_lock = threading.Lock()
+    failures = []
+
+    def report(result):
+        with output_lock:
+            if not result['ok']:
+                failures.append(result['item'])
+            else:
+                # Recorded here: metrics from the builder processes are not collected
+                for name in (['combined'] if combined else ['request_form', 'cover_letter']):
+                    form_metrics.record_artifact(name, name in result['rebuilt'])
+            form_metrics.record_run(result['ok'])
+            print_and_log(json.dumps(result))
+
+    def on_built(item, future):
+        try:
+            built = future.result()
+        except Exception as e:
+            # The builder process itself died (e.g. killed for memory)
+            built = {'item': item, 'ok': False, 'token': None, 'error': str(e)}
+        if not built['ok'] or 'pending' not in built:
+            report(built)
+            return
+        conversions.submit(convert_batch_item, built, converter_pool, cache).add_done_callback(
+            lambda converted: report(converted.result()))
+
+    def build(item, summary=None):
+        builders.submit(build_batch_item, item, letter_date, cache, combined, backend, summary).add_done_callback(
+            lambda future: on_built(item, future))
+
+    def on_fetched(request_token, summary, error):
+        for item in to_fetch[request_token]:
+            if error is None:
+                build(item, summary)
+            else:
+                report({'item': item, 'ok': False, 'token': request_token, 'error': str(error)})
+
+    # Items with a summary file are built straight away; the rest wait for the API
+    to_fetch = {}
+    try:
+        with ThreadPoolExecutor(max_workers=converters) as conversions:
+            with ProcessPoolExecutor(max_workers=jobs) as builders:
+                for item in items:
+                    request_token, summary_path = parse_batch_item(item)
+                    if summary_path:
+                        build(item)
+                    else:
+                        to_fetch.setdefault(request_token, []).append(item)
+                prefetch_summaries(list(to_fetch), on_fetched)
+    finally:
+        converter_pool.close()
+
+    return len(items) - len(failures), len(failures)
+
+
+def resolve_item(item):
+    # (token, summary) of a batch item, reading or fetching its summary
+    request_token, summary_path = parse_batch_item(item)
+    summary = load_summary(summary_path) if summary_path else None
+    request_token = request_token or (summary or {}).get('request_token')
+    if not request_token:
+        raise FormGenerationError("Item has no request token")
+    if summary is None:
+        with form_metrics.stage("fetch"):
+            summary = fetch_summary(request_token)
+    return request_token, summary
+
+
+def dated_items(since=None, until=None):
+    # Tokens of the requests created from since to until (YYYY-MM-DD, both
+    # included), oldest first; needs a database source
+    try:
+        return data_source.tokens(since, until)
+    except form_source.SourceError as e:
+        raise FormGenerationError(str(e))
+
+
+def export_title(summary):
+    title = f"{summary['site_code']} {summary['request_id']}"
+    if summary.get('organization_name'):
+        title += f" \u2014 {summary['organization_name']}"
+    return title
+
+
+def exported_documents(summary, request_token, scratch, converter_pool=None, letter_date=None, cache=None,
+                       combined=False, backend='docx', rebuilt=None):
+    # (label, path) of each published PDF of the request, and whether they are
+    # the published ones. A request with a PDF missing is rendered into the
+    # scratch directory instead: only generate-forms publishes forms, since it
+    # also records their paths on the request.
+    outputs = output_bases(summary, combined=combined)
+    pdf_paths = [base + ".pdf" for _, base, _ in outputs]
+    published = all(os.path.isfile(pdf_path) for pdf_path in pdf_paths)
+    if not published:
+        with form_metrics.stage("total"):
+            pdf_paths = render(summary, request_token, scratch, converter_pool=converter_pool,
+                               letter_date=letter_date, cache=cache, combined=combined, backend=backend,
+                               rebuilt=rebuilt)
+    return [(label.capitalize(), pdf_path) for (_, _, label), pdf_path in zip(outputs, pdf_paths)], published
+
+
+def export_forms(items, f, export_format='zip', title=None, converters=0, letter_date=None, cache=None,
+                 combined=False, backend='docx', report=print_and_log):
+    # Writes the PDFs of every item (as for --batch) to f, in order, as one ZIP
+    # or one merged PDF with a bookmark per request. Items are handled one at a
+    # time and their PDFs written out before the next, while the summaries of
+    # the next few are fetched; each item is reported as a JSON line and a
+    # failed one (whatever the error, e.g. a malformed summary) is left out
+    # without stopping the export.
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        if export_format == 'pdf':
+            writer = form_export.MergedPdf(f, title, form_pdf.PRODUCER)
+        else:
+            writer = form_export.ZipExport(f)
+    except form_export.ExportError as e:
+        raise FormGenerationError(str(e))
+    converter_pool = form_converter.ConverterPool(converters) if converters > 0 and backend == 'docx' else None
+    concurrency = int(os.getenv('FORM_PREFETCH_CONCURRENCY', form_http.DEFAULT_PREFETCH_CONCURRENCY))
+    items = iter(items)
+    pending = deque()
+    succeeded = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as fetchers:
+            while True:
+                while len(pending) < concurrency:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.append((item, fetchers.submit(resolve_item, item)))
+                if not pending:
+                    break
+                item, future = pending.popleft()
+                request_token = None
+                rebuilt = []
+                try:
+                    with tempfile.TemporaryDirectory(prefix='form-export-') as scratch:
+                        request_token, summary = future.result()
+                        documents, published = exported_documents(summary, request_token, scratch, converter_pool,
+                                                                  letter_date, cache, combined, backend, rebuilt)
+                        with form_metrics.stage("export"):
+                            writer.add(export_title(summary), documents)
+                except (FormGenerationError, form_export.ExportError) as e:
+                    error = str(e)
+                except Exception as e:
+                    # A malformed summary (a missing field, a value of the wrong type)
+                    error = f"{type(e).__name__}: {e}"
+                else:
+                    error = None
+                if error is not None:
+                    failed += 1
+                    form_metrics.record_run(False)
+                    report(json.dumps({'item': item, 'ok': False, 'token': request_token, 'error': error}))
+                    continue
+                succeeded += 1
+                form_metrics.record_run(True)
+                result = {'item': item, 'ok': True, 'token': request_token, 'rebuilt': rebuilt,
+                          'published': published}
+                if published:
+                    result['files'] = [public_path(pdf_path) for _, pdf_path in documents]
+                report(json.dumps(result))
+        writer.close()
+    finally:
+        if converter_pool is not None:
+            converter_pool.close()
+    return succeeded, failed
+
+
+def run_export(path, items, export_format=None, converters=0, letter_date=None, cache=None, combined=False,
+               backend='docx'):
+    # To path, replaced once the export is complete, or to stdout for '-' (the
+    # item reports then go to stderr)
+    export_format = export_format or form_export.export_format(path)
+    if path == '-':
+        def report(line):
+            print(line, file=sys.stderr, flush=True)
+        f = sys.stdout.buffer
+        result = export_forms(items, f, export_format, None, converters, letter_date, cache, combined, backend, report)
+        f.flush()
+        return result
+    title = os.path.splitext(os.path.basename(path))[0]
+    with atomic_output(os.path.abspath(path), f"{export_format} export") as f:
+        return export_forms(items, f, export_format, title, converters, letter_date, cache, combined, backend)
+
+
+def load_environment():
+    # The nearest .env in this directory or above, as load_dotenv() finds it when
+    # called from this file; its caller lookup does not work inside the zipapp
+    from dotenv import load_dotenv
+
+    directory = script_dir
+    while True:
+        dotenv_path = os.path.join(directory, '.env')
+        if os.path.isfile(dotenv_path):
+            load_dotenv(dotenv_path)
+            return
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return
+        directory = parent
+
+
+def use_source(name):
+    # api, database (the app's own DATABASE_URL) or an explicit URL
+    global data_source
+    if name == 'database':
+        name = os.getenv('DATABASE_URL')
+        if not name:
+            raise form_source.SourceError("--source database needs DATABASE_URL")
+    data_source = form_source.open_source(name)
+
+
+def main():
+    # Parse command-line arguments for the request token
+    parser = argparse.ArgumentParser(description='Generate a domain registration form.')
+    parser.add_argument('-t', '--token', help='Request token for the API')
+    parser.add_argument('--summary-json', metavar='PATH|-',
+                        help='Read the get-summary payload from a file or stdin instead of calling the API')
+    parser.add_argument('--batch', nargs='*', metavar='ITEM',
+                        help='Generate forms for many requests; items are tokens, summary JSON files or TOKEN=file.json '
+                             '(read from stdin, one per line, when none are given)')
+    parser.add_argument('--export', nargs='+', metavar=('PATH|-', 'ITEM'),
+                        help='Write the PDFs of many requests to one ZIP or merged PDF (by the extension of PATH, '
+                             'or --export-format), rendering any not generated yet; items are as for --batch, or '
+                             'the requests created between --since and --until')
+    parser.add_argument('--export-format', choices=form_export.FORMATS,
+                        help='zip: the PDFs as published; pdf: one PDF with a bookmark per request')
+    parser.add_argument('--since', metavar='YYYY-MM-DD', help='With --export, requests created on or after this day')
+    parser.add_argument('--until', metavar='YYYY-MM-DD', help='With --export, requests created on or before this day')
+    parser.add_argument('--jobs', type=int, help='Builder processes for --batch (defaults to the number of CPUs)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a worker reading JSON jobs ({"token": ..., "summary": ...}) from stdin or --socket')
+    parser.add_argument('--socket', help='Unix socket path to listen on in --serve mode')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='Queue the request (-t/--summary-json) for a --worker and print its status as JSON')
+    parser.add_argument('--status', metavar='TOKEN', help='Print the queue status of a request as JSON')
+    parser.add_argument('--worker', action='store_true', help='Run queued jobs until interrupted')
+    parser.add_argument('--drain', action='store_true', help='With --worker, exit once the queue has no runnable job')
+    parser.add_argument('--concurrency', type=int, default=2,
+                        help='Jobs run at once by --worker, across all workers sharing the queue')
+    parser.add_argument('--date', help='Date printed on the cover letter (YYYY-MM-DD, defaults to today)')
+    parser.add_argument('--no-cache', action='store_true', help='Always render, bypassing the render cache')
+    parser.add_argument('--backend', choices=BACKENDS, default='docx',
+                        help='docx: build Word documents and convert them with LibreOffice; '
+                             'pdf: draw the PDFs directly (no LibreOffice needed)')
+    parser.add_argument('--combined', action='store_true',
+                        help='Produce a single PDF with the cover letter followed by the request form')
+    parser.add_argument('--metrics-file',
+                        help='Write stage durations and document sizes here (Prometheus textfile format for *.prom, '
+                             'JSON otherwise; defaults to FORM_METRICS_FILE)')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Write cProfile stats and a tracemalloc snapshot of a single run to DIR')
+    parser.add_argument('--source',
+                        help='Where summaries come from: api (get-summary, the default), database (DATABASE_URL) '
+                             'or a postgresql:// or sqlite:/// URL; defaults to FORM_DATA_SOURCE')
+    parser.add_argument('--prewarm', action='store_true',
+                        help='Render the request (-t) into the render cache at low priority without publishing it, '
+                             'for the generate-forms run that follows')
+    parser.add_argument('--write-templates', metavar='DIR',
+                        help='Save the precompiled document templates to DIR for FORM_TEMPLATE_DIR and exit')
+    parser.add_argument('--converters', type=int, default=0,
+                        help='LibreOffice instances to keep (--serve: 0 uses SOFFICE_POOL_SOCKET or one-shot; --batch: defaults to 2)')
+    args = parser.parse_args()
+
+    # Load environment variables from .env file
+    load_environment()
+    args.metrics_file = args.metrics_file or os.getenv('FORM_METRICS_FILE')
+    try:
+        use_source(args.source or os.getenv('FORM_DATA_SOURCE'))
+    except (form_source.SourceError, FormGenerationError) as e:
+        print_and_log(str(e))
+        sys.exit(1)
+
+    if args.date:
+        try:
+            datetime.strptime(args.date, "%Y-%m-%d")
+        except ValueError:
+            parser.error('--date must be in YYYY-MM-DD format')
+
+    for name in ('since', 'until'):
+        if getattr(args, name):
+            try:
+                datetime.strptime(getattr(args, name), "%Y-%m-%d")
+            except ValueError:
+                parser.error(f'--{name} must be in YYYY-MM-DD format')
+    if (args.since or args.until) and not args.export:
+        parser.error('--since and --until only apply to --export')
+
+    if args.profile and (args.serve or args.worker or args.batch is not None or args.export or args.prewarm):
+        parser.error('--profile only applies to a single run')
+
+    cache = None if args.no_cache else default_cache()
+
+    # Instrumentation never writes to stdout or stderr, which the API parses
+    if args.metrics_file:
+        form_metrics.enable(args.metrics_file)
+    try:
+        run_command(parser, args, cache)
+    finally:
+        form_metrics.flush()
+
+
+def run_command(parser, args, cache):
+    if args.write_templates:
+        try:
+            for path in write_templates(args.write_templates):
+                print(path)
+        except (FormGenerationError, OSError) as e:
+            print_and_log(str(e))
+            sys.exit(1)
+        return
+
+    if args.serve:
+        serve(args.socket, args.converters, cache)
+        return
+
+    if args.worker:
+        run_queue_worker(default_queue(), args.concurrency, args.converters, cache, drain=args.drain)
+        return
+
+    if args.status:
+        status = default_queue().status(args.status)
+        print(json.dumps(status or {'token': args.status, 'status': 'unknown'}))
+        if status is None:
+            sys.exit(1)
+        return
+
+    if args.enqueue:
+        try:
+            job = {'token': args.token, 'date': args.date, 'combined': args.combined, 'backend': args.backend}
+            if args.summary_json:
+                job['summary'] = load_summary(args.summary_json)
+            print(json.dumps(enqueue_job(default_queue(), job)))
+        except FormGenerationError as e:
+            print_and_log(str(e))
+            sys.exit(1)
+        return
+
+    if args.batch is not None:
+        items = args.batch or [line.strip() for line in sys.stdin if line.strip()]
+        succeeded, failed = run_batch(items, args.jobs, args.converters or 2, args.date, cache, args.combined, args.backend)
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.export:
+        path, *items = args.export
+        try:
+            if args.since or args.until:
+                items += dated_items(args.since, args.until)
+            elif not items:
+                items = [line.strip() for line in sys.stdin if line.strip()]
+            # A request listed twice is exported once
+            items = list(dict.fromkeys(items))
+            succeeded, failed = run_export(path, items, args.export_format, args.converters, args.date, cache,
+                                           args.combined, args.backend)
+        except FormGenerationError as e:
+            print_and_log(str(e))
+            sys.exit(1)
+        if failed:
+            sys.exit(1)
+        return
+
+    try:
+        summary = load_summary(args.summary_json) if args.summary_json else None
+        request_token = args.token or (summary or {}).get('request_token')
+        if not request_token:
+            parser.error('the following arguments are required: -t/--token')
+        if args.prewarm:
+            print(json.dumps(prewarm(request_token, summary, cache, args.date, args.combined, args.backend)))
+            return
+        if args.profile:
+            with form_metrics.Profiler(args.profile, f"generate-{request_token}-{int(time.time())}"):
+                pdf_paths = generate(request_token, summary, letter_date=args.date, cache=cache,
+                                     combined=args.combined, backend=args.backend)
+        else:
+            pdf_paths = generate(request_token, summary, letter_date=args.date, cache=cache, combined=args.combined,
+                                 backend=args.backend)
+    except FormGenerationError as e:
+        form_metrics.record_run(False)
+        print_and_log(str(e))
+        sys.exit(1)
+    form_metrics.record_run(True)
+
+    # Print the final paths of the generated PDF files
+    for pdf_path in pdf_paths:
+        print(public_path(pdf_path))
+
+
+if __name__ == '__main__':
+    main()
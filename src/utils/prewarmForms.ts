@@ -0,0 +1,75 @@
+import { spawn } from 'child_process';
+import path from 'path';
+import { coverLetterDate } from '@/utils/coverLetterDate';
+
+type PrewarmRequest = {
+  request_token: string;
+  owner_user_id: number | null;
+  administrator_user_id: number | null;
+  technical_user_id: number | null;
+  content_developer_user_id: number | null;
+  hosting_coordinator_user_id: number | null;
+  address: string | null;
+  email: string | null;
+  contact_no: number | null;
+  cover_letter_date: Date | null;
+};
+
+// Pre-warms waiting for more edits, by request token
+const pending = new Map<string, NodeJS.Timeout>();
+
+// The forms need every contact and the organization details; until the request has them
+// generate-forms fails, so there is nothing to pre-render
+function formsComplete(request: PrewarmRequest) {
+  return Boolean(
+    request.owner_user_id &&
+      request.administrator_user_id &&
+      request.technical_user_id &&
+      request.content_developer_user_id &&
+      request.hosting_coordinator_user_id &&
+      request.address &&
+      request.email &&
+      request.contact_no
+  );
+}
+
+// Start rendering the forms of an edited request into the generator's render cache in the
+// background, so that generate-forms usually finds them ready. The response does not wait
+// for it, and a failure only costs the cache hit. Edits of the same request within
+// FORM_PREWARM_DELAY seconds (2) start a single pre-warm after the last of them.
+// FORM_PREWARM=off disables it.
+export function prewarmForms(request: PrewarmRequest) {
+  if (process.env.FORM_PREWARM === 'off' || !formsComplete(request)) {
+    return;
+  }
+
+  const token = request.request_token;
+  const delay = Number(process.env.FORM_PREWARM_DELAY ?? 2) * 1000;
+  clearTimeout(pending.get(token));
+  const timer = setTimeout(() => {
+    pending.delete(token);
+    // Rendered with the date generate-forms will print, so that it finds them in the cache
+    startPrewarm(token, coverLetterDate(request));
+  }, delay);
+  timer.unref();
+  pending.set(token, timer);
+}
+
+function startPrewarm(token: string, letterDate: string) {
+  const scriptPath = process.env.FORM_GENERATOR_PYZ
+    ? path.resolve(process.cwd(), process.env.FORM_GENERATOR_PYZ)
+    : path.join(process.cwd(), 'src', 'utils', 'generate_domain_request_forms.py');
+
+  try {
+    // The delay has already passed here
+    const child = spawn('python3', [scriptPath, '--prewarm', '-t', token, '--date', letterDate], {
+      detached: true,
+      stdio: 'ignore',
+      env: { ...process.env, FORM_PREWARM_DELAY: '0' },
+    });
+    child.on('error', () => {});
+    child.unref();
+  } catch {
+    // Pre-warming is best-effort
+  }
+}
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The generator's modules import each other as top-level modules, as they do
+# when run from src/utils or from the zipapp
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'utils'))
@@ -0,0 +1,59 @@
+import re
+
+import pytest
+
+import form_pdf
+
+TEXT = re.compile(rb'BT /F\d (\d+) Tf (?:\S+ Tw )?(\S+) (\S+) Td \((.*)\) Tj ET')
+LINE = re.compile(rb'(\S+) (\S+) m (\S+) (\S+) l S')
+BOTTOM = form_pdf.MARGIN + form_pdf.FOOTER_SIZE * form_pdf.LEADING
+
+
+def page_contents(document):
+    # (text, baseline) of the body text and the y of every border, page by page
+    pages = []
+    for canvas in document.pages:
+        stream = canvas.stream()
+        texts = [(match.group(4).decode('cp1252'), float(match.group(3)))
+                 for match in TEXT.finditer(stream) if int(match.group(1)) != form_pdf.FOOTER_SIZE]
+        borders = [float(y) for match in LINE.finditer(stream) for y in (match.group(2), match.group(4))]
+        pages.append((texts, borders))
+    return pages
+
+
+def cell(text, align='left'):
+    return form_pdf.Paragraph(text, align=align)
+
+
+@pytest.mark.parametrize('rows, prefix', [
+    # A long TXT value
+    ([[cell('TXT Record', 'center'), cell('example.gov.lk'), cell(' '.join(f'word{n}' for n in range(3000)))]],
+     'word'),
+    # Many values in one record, below a merged cell that continues the row above
+    ([[cell('MX Record', 'center'), cell('mail'), cell('10')],
+      [None, cell('values'), [cell(f'value{n}') for n in range(150)]],
+      [None, cell('last'), cell('after')]],
+     'value'),
+])
+def test_row_taller_than_a_page_is_split(rows, prefix):
+    document = form_pdf.PdfDocument()
+    document.add_section([cell('DNS Records'), form_pdf.Table(rows, [1 / 3, 1 / 3, 1 / 3])], 'footer')
+    pages = page_contents(document)
+
+    assert len(pages) > 1
+    for texts, borders in pages:
+        assert all(baseline >= BOTTOM for _, baseline in texts)
+        assert all(y >= BOTTOM for y in borders)
+    # The long cell is printed once, in order, and the rows after it follow
+    printed = ' '.join(text for texts, _ in pages for text, _ in texts).split()
+    expected = [word for row in rows for paragraphs in row for paragraph in form_pdf.Table.paragraphs(paragraphs)
+                for text, _ in paragraph.runs for word in text.split() if word.startswith(prefix)]
+    assert [word for word in printed if word.startswith(prefix)] == expected
+    assert printed[-1] == rows[-1][-1].runs[-1][0].split()[-1]
+
+
+def test_row_that_never_fits_is_refused():
+    tall = form_pdf.Paragraph('x', size=1000)
+    document = form_pdf.PdfDocument()
+    with pytest.raises(form_pdf.PdfError):
+        document.add_section([form_pdf.Table([[tall]], [1])])
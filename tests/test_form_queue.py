@@ -0,0 +1,77 @@
+import time
+
+import form_http
+import form_queue
+
+
+def make_queue(tmp_path, **options):
+    return form_queue.JobQueue(str(tmp_path / 'queue.sqlite3'), **options)
+
+
+def test_expired_lease_fails_after_last_attempt(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2, lease=0.05)
+    queue.enqueue('T1', {'token': 'T1'})
+    attempts = []
+    for _ in range(4):
+        claimed = queue.claim('worker')
+        if claimed is None:
+            break
+        attempts.append(claimed['attempt'])
+        # The worker hangs and never finishes the job
+        time.sleep(0.1)
+    assert attempts == [1, 2]
+    status = queue.status('T1')
+    assert status['status'] == form_queue.FAILED
+    assert status['error'] == 'lease expired'
+
+
+def test_payload_enqueued_while_running_is_rendered_next(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('T1', {'token': 'T1', 'edit': 1})
+    first = queue.claim('worker')
+    status, created = queue.enqueue('T1', {'token': 'T1', 'edit': 2})
+    assert not created and status['follow_up']
+    assert queue.claim('worker') is None
+
+    assert queue.complete(first['id'], first['worker'], {'ok': True})
+    follow_up = queue.claim('worker')
+    assert follow_up['job'] == {'token': 'T1', 'edit': 2}
+    assert follow_up['attempt'] == 1
+
+
+def test_retry_renders_newest_payload(tmp_path):
+    queue = make_queue(tmp_path, backoff=0)
+    queue.enqueue('T1', {'token': 'T1', 'edit': 1})
+    first = queue.claim('worker')
+    queue.enqueue('T1', {'token': 'T1', 'edit': 2})
+    assert queue.fail(first['id'], first['worker'], 'boom')
+    assert queue.claim('worker')['job'] == {'token': 'T1', 'edit': 2}
+
+
+def test_stale_worker_cannot_finish_job(tmp_path):
+    queue = make_queue(tmp_path, lease=0.05)
+    queue.enqueue('T1', {'token': 'T1'})
+    stale = queue.claim('worker-1')
+    time.sleep(0.1)
+    current = queue.claim('worker-2')
+    assert current['id'] == stale['id']
+    assert not queue.complete(stale['id'], stale['worker'], {'ok': True})
+    assert not queue.fail(stale['id'], stale['worker'], 'boom')
+    assert queue.complete(current['id'], current['worker'], {'ok': True})
+
+
+def test_summary_prefetched_before_an_edit_is_not_used(tmp_path):
+    queue = make_queue(tmp_path)
+    prefetched = form_http.PrefetchedValues(60)
+    queue.enqueue('T1', {'token': 'T1', 'edit': 1})
+    prefetched.put('T1', {'edit': 1}, time.time())
+    time.sleep(0.01)
+    # Edited and enqueued again before a worker claims the job
+    queue.enqueue('T1', {'token': 'T1', 'edit': 2})
+    claimed = queue.claim('worker')
+    assert prefetched.pop('T1', since=claimed['queued_at']) is None
+
+    queue.enqueue('T2', {'token': 'T2'})
+    prefetched.put('T2', {'fresh': True})
+    claimed = queue.claim('worker')
+    assert prefetched.pop('T2', since=claimed['queued_at']) == {'fresh': True}
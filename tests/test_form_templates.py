@@ -0,0 +1,82 @@
+import re
+import zipfile
+
+import pytest
+
+import benchmark_forms
+import generate_domain_request_forms as forms
+
+LETTER_DATE = '2024-01-01'
+
+
+@pytest.fixture
+def template_dir(tmp_path, monkeypatch):
+    # Templates are compiled once per process; each test compiles its own
+    monkeypatch.setattr(forms, '_form_templates', {})
+    monkeypatch.setenv('FORM_TEMPLATE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def document_xml(path):
+    with zipfile.ZipFile(path) as archive:
+        return archive.read('word/document.xml').decode('utf-8')
+
+
+def resave_as_word(path):
+    # Word writes revision ids on paragraphs, rows and runs: <w:tr w:rsidR="...">
+    with zipfile.ZipFile(path) as archive:
+        entries = [(info, archive.read(info)) for info in archive.infolist()]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for info, data in entries:
+            if info.filename == 'word/document.xml':
+                data = re.sub(r'<(w:p|w:tr|w:tbl)>', r'<\1 w:rsidR="00A1B2C3">', data.decode('utf-8')).encode('utf-8')
+            archive.writestr(info, data)
+
+
+def test_word_saved_template(template_dir, tmp_path):
+    summary = benchmark_forms.synthetic_summary(3, 8, benchmark_forms.RECORD_TYPES)
+    token = summary['request_token']
+    builtin = tmp_path / 'builtin.docx'
+    forms.save_docx(forms.form_template('request_form').document(summary, token, LETTER_DATE), str(builtin), 'form')
+
+    forms.write_templates(str(template_dir))
+    resave_as_word(template_dir / f'request_form-{forms.DOCUMENT_VERSION}.docx')
+    forms._form_templates.clear()
+    template = forms.form_template('request_form')
+    assert template.regions == forms.REQUEST_FORM_REGIONS
+
+    edited = tmp_path / 'edited.docx'
+    forms.save_docx(template.document(summary, token, LETTER_DATE), str(edited), 'form')
+    assert ' w:rsidR="00A1B2C3"' in document_xml(edited)
+    assert re.sub(' w:rsidR="00A1B2C3"', '', document_xml(edited)) == document_xml(builtin)
+
+
+def summary_with_empty_fields():
+    summary = benchmark_forms.synthetic_summary(2, 4, benchmark_forms.RECORD_TYPES)
+    summary['organization_name'] = ''
+    summary['hosting_provider'] = ''
+    summary['organization_head']['designation'] = ''
+    summary['administrator']['designation'] = ''
+    summary['technical_contact']['mobile'] = ''
+    summary['requested_domains'][0]['reason'] = ''
+    return summary
+
+
+BUILDERS = {
+    'request_form': lambda summary: forms.build_request_form(summary, summary['request_token'],
+                                                              letter_date=LETTER_DATE),
+    'cover_letter': lambda summary: forms.build_cover_letter(summary, summary['request_token'], LETTER_DATE),
+    'combined': lambda summary: forms.build_combined_document(summary, summary['request_token'], LETTER_DATE),
+}
+
+
+@pytest.mark.parametrize('kind', sorted(BUILDERS))
+@pytest.mark.parametrize('summary', [benchmark_forms.synthetic_summary(3, 8, benchmark_forms.RECORD_TYPES),
+                                     summary_with_empty_fields()], ids=['filled', 'empty-fields'])
+def test_template_matches_python_docx(kind, summary, template_dir, tmp_path):
+    built = tmp_path / 'built.docx'
+    built.write_bytes(forms.docx_bytes(BUILDERS[kind](summary), kind))
+    templated = tmp_path / 'templated.docx'
+    forms.save_docx(forms.form_template(kind).document(summary, summary['request_token'], LETTER_DATE),
+                    str(templated), kind)
+    assert document_xml(templated) == document_xml(built)
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+import benchmark_forms
+import generate_domain_request_forms as forms
+
+# Build time has to grow linearly with the size of a request: from the middle
+# size to the largest, the time per added row may be at most this many times
+# the time per row from the smallest size to the middle one (a quadratic
+# build gives about 10)
+MAX_SLOWDOWN = 2.5
+
+# (domains, records per domain) from the smallest to the largest request
+SIZES = {
+    'domains': [(10, 1), (100, 1), (1000, 1)],
+    'records': [(1, 100), (1, 1000), (1, 10000)],
+}
+
+
+def build_time(build, domains, records):
+    summary = benchmark_forms.synthetic_summary(domains, records, benchmark_forms.RECORD_TYPES)
+    start = time.process_time()
+    build(summary)
+    return time.process_time() - start
+
+
+def python_docx(summary):
+    forms.build_request_form(summary, summary['request_token'], letter_date='2024-01-01')
+
+
+def template(summary, path):
+    document = forms.form_template('request_form').document(summary, summary['request_token'], '2024-01-01')
+    forms.save_docx(document, path, 'request form')
+
+
+def assert_linear(build, sizes):
+    rows = [domains * records for domains, records in sizes]
+    times = [build_time(build, domains, records) for domains, records in sizes]
+    per_row = [(times[i + 1] - times[i]) / (rows[i + 1] - rows[i]) for i in range(2)]
+    assert per_row[1] <= MAX_SLOWDOWN * per_row[0], f"rows {rows} took {times} s"
+
+
+@pytest.mark.parametrize('grows', sorted(SIZES))
+def test_python_docx_build_is_linear(grows):
+    # The warm-up run keeps imports and style setup out of the first size
+    python_docx(benchmark_forms.synthetic_summary(1, 1, benchmark_forms.RECORD_TYPES))
+    assert_linear(python_docx, SIZES[grows])
+
+
+@pytest.mark.parametrize('grows', sorted(SIZES))
+def test_template_render_is_linear(grows, tmp_path, monkeypatch):
+    monkeypatch.delenv('FORM_TEMPLATE_DIR', raising=False)
+    path = str(tmp_path / 'Request_Form.docx')
+    template(benchmark_forms.synthetic_summary(1, 1, benchmark_forms.RECORD_TYPES), path)
+    assert_linear(lambda summary: template(summary, path), SIZES[grows])